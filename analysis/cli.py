@@ -1,19 +1,34 @@
-from typing import Iterable
-from datetime import datetime
+import os
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+from datetime import datetime, timedelta
 
+import attr
 import click
 import pytz
 
+from analysis.data.cache import QueryCache
+from analysis.data.checkpoint import Checkpoint
+from analysis.data.cube import MetricCube
+from analysis.data.metric import MetricLookupManager
+from analysis.data.planner import SharedScanPlanner
+from analysis.data.sources import BigQuerySource, DuckDBSource, MetricSource
 from analysis.detection.explorer.all_dimensions import AllDimensionEvaluator
+from analysis.detection.explorer.dimension_evaluator import worker_pool
 from analysis.detection.explorer.multiple_dimensions import MultiDimensionEvaluator
 from analysis.detection.explorer.one_dimension import OneDimensionEvaluator
 from analysis.detection.explorer.top_level import TopLevelEvaluator
-from analysis.configuration.configs import AnalysisProfile, Notification
-from analysis.logging import logger
+from analysis.detection.results.store import write_processing_info
+from analysis.configuration.configs import AnalysisProfile, Config, Notification
+from analysis.logging import logger, profile_context
+from analysis.logging.profiling import profiling
+from analysis.logging.timings import timings
 from analysis.notification.slack import SlackNotifier
 from analysis.reports.generator import ReportGenerator
 from analysis.configuration.loader import Loader
 from analysis.configuration.processing_dates import calculate_date_ranges, ProcessingDateRange
+from analysis.errors import TopLevelMismatchError
 
 
 @click.group()
@@ -49,31 +64,135 @@ def get_parent_df(top_level_evaluation: dict, top_level_dims_values_excluded_eva
         )
 
 
+def get_cube_dimensions(profile: AnalysisProfile) -> list:
+    """
+    :return: the dimensions of the profile and the excluded dimensions, a cube loaded with them
+     and without the exclusions can roll up the top level values too.
+    """
+    return list(
+        dict.fromkeys(
+            profile.percent_change.dimensions
+            + [dim["dimension"] for dim in profile.percent_change.exclude_dimension_values]
+        )
+    )
+
+
+def run_stage(checkpoint: Checkpoint, stage: str, func: Callable[[], Any], **kwargs) -> Any:
+    """Runs the stage through the checkpoint (see Checkpoint.run) and records its timing."""
+    with timings.measure(stage):
+        return checkpoint.run(stage, func, **kwargs)
+
+
 def find_significant_dimensions(
     profile: AnalysisProfile,
     baseline_period: ProcessingDateRange,
     current_period: ProcessingDateRange,
+    query_cache: QueryCache = None,
+    metric_source: MetricSource = None,
+    max_concurrent_queries: int = 1,
+    executor: Executor = None,
+    metric_lookup: MetricLookupManager = None,
+    checkpoint: Checkpoint = None,
 ) -> dict:
-    # 1.  Find overall percent change
-    # Perform top level calculation including all dimensions.
-    evaluator = TopLevelEvaluator(
-        profile=profile,
-        baseline_period=baseline_period,
-        current_period=current_period,
+    """
+    :param executor: the worker processes the dimension sets are evaluated in, see worker_pool.
+    :param checkpoint: the output of each stage (top level, one dimension, multiple dimensions
+     and all dimensions) is stored in it, stages completed by a previous run are skipped when
+     resuming.
+    """
+    checkpoint = checkpoint or Checkpoint()
+    # A single lookup manager is shared by all the evaluators so that prefetched values are reused.
+    metric_lookup = metric_lookup or MetricLookupManager(
+        query_cache=query_cache, source=metric_source
     )
-    top_level_evaluation = evaluator.evaluate()
-    logger.info(f"top_level_evaluation: {top_level_evaluation}")
-
-    if not exceeds_top_level_percent_change(profile, top_level_evaluation):
-        return {}
+    if profile.dataset.fetch_mode == "cube":
+        metric_lookup = MetricCube(metric_lookup)
+    date_ranges = {"current": current_period, "baseline": baseline_period}
+    prefetched = False
+
+    def prefetch():
+        """
+        Retrieves the values for all the lookups ahead of time (see Dataset.fetch_mode), once and
+        only when a stage that has not been checkpointed needs them.
+        """
+        nonlocal prefetched
+        if prefetched:
+            return
+        prefetched = True
+
+        if profile.dataset.fetch_mode == "grouping_sets":
+            # Retrieve every single dimension and dimension pair with one query.
+            metric_lookup.prefetch_dimension_sets(
+                metric_name=profile.dataset.metric_name,
+                table_name=profile.dataset.table_name,
+                app_name=profile.dataset.app_name,
+                date_ranges=date_ranges,
+                dimension_sets=get_dimension_sets(profile, baseline_period, current_period),
+                excluded_dimensions=profile.percent_change.exclude_dimension_values,
+            )
+        elif (
+            profile.dataset.fetch_mode == "cube" and profile.dataset.top_level_mode == "dimensions"
+        ):
+            # The top level values are rolled up from the cube too.  The cube is loaded without
+            # the exclusions (they are applied when rolling up) so the totals including the
+            # excluded values can be rolled up as well.
+            metric_lookup.load(
+                metric_name=profile.dataset.metric_name,
+                table_name=profile.dataset.table_name,
+                app_name=profile.dataset.app_name,
+                date_ranges=date_ranges,
+                dimensions=get_cube_dimensions(profile),
+            )
+        elif profile.dataset.fetch_mode == "cube":
+            # Retrieve all dimensions at the finest grain with one query, rolled up as requested.
+            metric_lookup.load(
+                metric_name=profile.dataset.metric_name,
+                table_name=profile.dataset.table_name,
+                app_name=profile.dataset.app_name,
+                date_ranges=date_ranges,
+                dimensions=profile.percent_change.dimensions,
+                excluded_dimensions=profile.percent_change.exclude_dimension_values,
+            )
 
-    # Calculate the top level values excluding all the specified dimension values.
-    top_level_dims_values_excluded_evaluation = evaluator.evaluate_dimension_values_excluded()
+    # 1.  Find overall percent change
+    def evaluate_top_level() -> Optional[tuple]:
+        """
+        :return: the top level evaluations including all dimensions, excluding the excluded
+         dimension values and including only them.  None if the percent change does not exceed
+         the threshold.
+        """
+        if profile.dataset.fetch_mode == "cube" and profile.dataset.top_level_mode == "dimensions":
+            prefetch()
+
+        # Perform top level calculation including all dimensions.
+        evaluator = TopLevelEvaluator(
+            profile=profile,
+            baseline_period=baseline_period,
+            current_period=current_period,
+            metric_lookup=metric_lookup,
+        )
+        top_level_evaluation = evaluator.evaluate()
+        logger.info(f"top_level_evaluation: {top_level_evaluation}")
+
+        if not exceeds_top_level_percent_change(profile, top_level_evaluation):
+            return None
+
+        return (
+            top_level_evaluation,
+            # Calculate the top level values excluding all the specified dimension values.
+            evaluator.evaluate_dimension_values_excluded(),
+            # Calculate the top level values including only the listed excluded values.
+            evaluator.evaluate_excluded_dimension_values_only(),
+        )
 
-    # Calculate the top level values including only the listed excluded values.
-    top_level_excluded_dim_values_only_evaluation = (
-        evaluator.evaluate_excluded_dimension_values_only()
-    )
+    top_level = run_stage(checkpoint, "top_level", evaluate_top_level)
+    if top_level is None:
+        return {}
+    (
+        top_level_evaluation,
+        top_level_dims_values_excluded_evaluation,
+        top_level_excluded_dim_values_only_evaluation,
+    ) = top_level
 
     # 2. Find
     # - percent change
@@ -85,16 +204,35 @@ def find_significant_dimensions(
         baseline_period=baseline_period,
         current_period=current_period,
         parent_df=get_parent_df(top_level_evaluation, top_level_dims_values_excluded_evaluation),
+        metric_lookup=metric_lookup,
+        max_concurrent_queries=max_concurrent_queries,
+        executor=executor,
     )
-    one_dim_evaluation = one_dim_evaluator.evaluate()
 
     multi_dim_evaluator = MultiDimensionEvaluator(
         profile=profile,
         baseline_period=baseline_period,
         current_period=current_period,
         parent_df=get_parent_df(top_level_evaluation, top_level_dims_values_excluded_evaluation),
+        metric_lookup=metric_lookup,
+        max_concurrent_queries=max_concurrent_queries,
+        executor=executor,
     )
-    multi_dim_evaluation = multi_dim_evaluator.evaluate()
+
+    def evaluate_one_dim() -> dict:
+        prefetch()
+        return one_dim_evaluator.evaluate()
+
+    one_dim_evaluation = run_stage(checkpoint, "one_dim", evaluate_one_dim)
+
+    def evaluate_multi_dim() -> dict:
+        prefetch()
+        if profile.percent_change.lazy_dimension_permutations:
+            # Only the pairs of dimensions with significant values individually are evaluated.
+            return multi_dim_evaluator.evaluate(one_dim_evaluation)
+        return multi_dim_evaluator.evaluate()
+
+    multi_dim_evaluation = run_stage(checkpoint, "multi_dim", evaluate_multi_dim)
 
     all_dim_evaluator = AllDimensionEvaluator(
         profile=profile,
@@ -102,7 +240,7 @@ def find_significant_dimensions(
         multi_dim_evaluation=multi_dim_evaluation,
     )
 
-    all_dim_evaluation = all_dim_evaluator.evaluate()
+    all_dim_evaluation = run_stage(checkpoint, "all_dim", all_dim_evaluator.evaluate)
 
     return (
         top_level_evaluation
@@ -114,30 +252,276 @@ def find_significant_dimensions(
     )
 
 
+def get_dimension_sets(
+    profile: AnalysisProfile,
+    baseline_period: ProcessingDateRange,
+    current_period: ProcessingDateRange,
+) -> list:
+    """
+    :return: the dimension sets evaluated for the profile, the single dimensions then the pairs.
+    """
+    evaluator_kwargs = {
+        "profile": profile,
+        "baseline_period": baseline_period,
+        "current_period": current_period,
+        "parent_df": None,
+    }
+    return (
+        OneDimensionEvaluator(**evaluator_kwargs).dimension_sets()
+        + MultiDimensionEvaluator(**evaluator_kwargs).dimension_sets()
+    )
+
+
+def prefetch_shared_scans(
+    planner: SharedScanPlanner,
+    configs: Iterable[Config],
+    date: datetime,
+    run_dir: str = None,
+    resume: bool = False,
+):
+    """
+    Retrieves the dimension sets of the profiles sharing a table and dates with one query per
+    table, see SharedScanPlanner.  Cube profiles retrieve their own finest grain values, as do
+    the profiles resuming after their dimension stages (see process_profile).
+    """
+    scans = []
+    for config in configs:
+        profile = config.analysis_profile
+        if profile.dataset.fetch_mode == "cube":
+            continue
+        if (
+            resume
+            and run_dir is not None
+            and Checkpoint.for_profile(run_dir, date, profile.name).completed("multi_dim")
+        ):
+            continue
+        try:
+            baseline_period, current_period = calculate_date_ranges(
+                dataset_config=profile.dataset, exclusive_end_date=date
+            )
+        except Exception:
+            # Reported when the profile is processed.
+            continue
+        scans.append(
+            (
+                profile,
+                {"current": current_period, "baseline": baseline_period},
+                get_dimension_sets(profile, baseline_period, current_period),
+            )
+        )
+    planner.prefetch(scans)
+
+
 def issue_report(
     profile: AnalysisProfile,
     notif_config: Notification,
     evaluation: dict,
     baseline_period: ProcessingDateRange,
     current_period: ProcessingDateRange,
+    checkpoint: Checkpoint = None,
 ):
-
-    report_generator = ReportGenerator(
-        output_dir="generated_reports",
-        template=notif_config.report.template,
-        analysis_profile=profile,
-        notif_config=notif_config,
-        evaluation=evaluation,
-        baseline_period=baseline_period,
-        current_period=current_period,
-    )
+    """
+    :param checkpoint: the report and notify stages are stored in it, a report that was already
+     published is not published again when resuming.
+    """
+    checkpoint = checkpoint or Checkpoint()
+
+    def build_report() -> str:
+        report_generator = ReportGenerator(
+            output_dir="generated_reports",
+            template=notif_config.report.template,
+            analysis_profile=profile,
+            notif_config=notif_config,
+            evaluation=evaluation,
+            baseline_period=baseline_period,
+            current_period=current_period,
+        )
+        return report_generator.build_pdf_report()
 
     # Limited to publishing PDF to Slack for now.
     # In the future other notifications types will be supported.
-    pdfreport_filename = report_generator.build_pdf_report()
-    # Only publish to Slack for MVP
-    notifier = SlackNotifier(output_pdf=pdfreport_filename, config=notif_config.slack)
-    notifier.publish_pdf_report()
+    pdfreport_filename = run_stage(checkpoint, "report", build_report, is_valid=os.path.exists)
+
+    def notify():
+        # Only publish to Slack for MVP
+        notifier = SlackNotifier(output_pdf=pdfreport_filename, config=notif_config.slack)
+        notifier.publish_pdf_report()
+
+    run_stage(checkpoint, "notify", notify)
+
+
+def process_profile(
+    config: Config,
+    date: datetime,
+    query_cache: QueryCache = None,
+    metric_source: MetricSource = None,
+    max_concurrent_queries: int = 1,
+    executor: Executor = None,
+    planner: SharedScanPlanner = None,
+    run_dir: str = None,
+    resume: bool = False,
+    profile_dir: str = "profiles",
+    profile_cpu: bool = False,
+    profile_memory: bool = False,
+) -> bool:
+    """
+    Finds the significant dimensions of the profile and issues a report if any are found.  Errors
+    are logged rather than raised so one profile failing does not stop the others.
+    :param executor: the worker processes the dimension sets are evaluated in, see worker_pool.
+    :param planner: hands over the values retrieved by a shared scan, see prefetch_shared_scans.
+    :param run_dir: the output of each stage is checkpointed in this directory, None to not
+     checkpoint.
+    :param resume: the stages checkpointed by a previous run for the date are skipped.
+    :param profile_dir: where the CPU and memory profiles are written, see profiling.
+    :param profile_cpu: profile the processing with cProfile.
+    :param profile_memory: trace the memory allocated by the processing with tracemalloc.
+    :return: True if the profile was processed successfully.
+    """
+    with profile_context(config.analysis_profile.name), profiling(
+        profile_dir,
+        f"{config.analysis_profile.name}_{date.strftime('%Y-%m-%d')}",
+        cpu=profile_cpu,
+        memory=profile_memory,
+    ):
+        logger.info(f"Starting processing: {config.analysis_profile.name}")
+        try:
+            checkpoint = (
+                Checkpoint.for_profile(run_dir, date, config.analysis_profile.name, resume)
+                if run_dir is not None
+                else None
+            )
+            baseline_period, current_period = calculate_date_ranges(
+                dataset_config=config.analysis_profile.dataset, exclusive_end_date=date
+            )
+            metric_lookup = (
+                planner.get_metric_lookup(
+                    profile=config.analysis_profile,
+                    date_ranges={"current": current_period, "baseline": baseline_period},
+                    dimension_sets=get_dimension_sets(
+                        config.analysis_profile, baseline_period, current_period
+                    ),
+                )
+                if planner is not None
+                else None
+            )
+            significant_dims = find_significant_dimensions(
+                profile=config.analysis_profile,
+                baseline_period=baseline_period,
+                current_period=current_period,
+                query_cache=query_cache,
+                metric_source=metric_source,
+                max_concurrent_queries=max_concurrent_queries,
+                executor=executor,
+                metric_lookup=metric_lookup,
+                checkpoint=checkpoint,
+            )
+
+            # TODO GLE removed since requires update to table schema.
+            # insert_processing_info(
+            #     config.analysis_profile,
+            #     baseline_period,
+            #     current_period,
+            #     significant_dims.get("overall_change_calc"),
+            # )
+
+            # nothing significant found.
+            if significant_dims == {}:
+                return True
+
+            issue_report(
+                profile=config.analysis_profile,
+                evaluation=significant_dims,
+                baseline_period=baseline_period,
+                current_period=current_period,
+                notif_config=config.notification,
+                checkpoint=checkpoint,
+            )
+            logger.info(f"Successfully processed: {config.analysis_profile.name}")
+            return True
+        except Exception:
+            logger.error(f"Error processing: {config.analysis_profile.name}", exc_info=1)
+            return False
+
+
+def backfill_profile(
+    profile: AnalysisProfile,
+    dates: List[datetime],
+    metric_lookup: MetricLookupManager,
+    executor: Executor = None,
+) -> Tuple[list, list]:
+    """
+    Finds the significant dimensions of the profile for every date, as run-analysis would, from a
+    single pull of the daily values spanning the date ranges of all the dates (see MetricCube).
+    The top level values are rolled up from the cube too, so only additive metrics can be
+    backfilled.  They are checked against the queried values for the first date processed (see
+    top_level_check_tolerance), a TopLevelMismatchError stops the backfill as the other dates are
+    rolled up from the same daily values.
+    :param executor: the worker processes the dimension sets are evaluated in, see worker_pool.
+    :return: (processing date, baseline, current, results) for each date with significant
+     results, and the dates that could not be processed.
+    """
+    periods = {
+        date: calculate_date_ranges(dataset_config=profile.dataset, exclusive_end_date=date)
+        for date in dates
+    }
+    span = ProcessingDateRange(
+        start_date=min(period.start_date for pair in periods.values() for period in pair),
+        end_date=max(period.end_date for pair in periods.values() for period in pair),
+    )
+
+    metric_lookup = MetricCube(metric_lookup)
+    metric_lookup.load(
+        metric_name=profile.dataset.metric_name,
+        table_name=profile.dataset.table_name,
+        app_name=profile.dataset.app_name,
+        date_ranges={"backfill": span},
+        dimensions=get_cube_dimensions(profile),
+    )
+    # Every lookup is answered by the cube, including the top level values.
+    checked_profile = attr.evolve(
+        profile,
+        dataset=attr.evolve(
+            profile.dataset, fetch_mode="dimension_set", top_level_mode="dimensions"
+        ),
+    )
+    unchecked_profile = attr.evolve(
+        checked_profile,
+        dataset=attr.evolve(checked_profile.dataset, top_level_check_tolerance=None),
+    )
+
+    processing_info = []
+    failed_dates = []
+    checked = profile.dataset.top_level_check_tolerance is None
+    for date, (baseline_period, current_period) in periods.items():
+        logger.info(f"Backfilling date: {date}")
+        try:
+            significant_dims = find_significant_dimensions(
+                profile=unchecked_profile if checked else checked_profile,
+                baseline_period=baseline_period,
+                current_period=current_period,
+                executor=executor,
+                metric_lookup=metric_lookup,
+            )
+        except TopLevelMismatchError:
+            raise
+        except Exception:
+            failed_dates.append(date)
+            logger.error(f"Error backfilling date: {date}", exc_info=1)
+            continue
+        checked = True
+
+        # nothing significant found.
+        if significant_dims == {}:
+            continue
+        processing_info.append(
+            (
+                date.date(),
+                baseline_period,
+                current_period,
+                significant_dims["overall_change_calc"],
+            )
+        )
+    return processing_info, failed_dates
 
 
 class ClickDate(click.ParamType):
@@ -161,55 +545,303 @@ class ClickDate(click.ParamType):
     metavar="YYYY-MM-DD",
     required=True,
 )
-def run_analysis(paths: Iterable[str], date: ClickDate):
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    default=False,
+    help="Always execute queries instead of using results cached by a previous run",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    default="query_cache",
+    show_default=True,
+    help="Directory query results are cached in",
+)
+@click.option(
+    "--cache-ttl-hours",
+    type=float,
+    default=24,
+    show_default=True,
+    help="Cached query results older than this are not used",
+)
+@click.option(
+    "--cache-max-size-mb",
+    type=int,
+    default=1024,
+    show_default=True,
+    help="Least recently used query results are evicted once the cache exceeds this size",
+)
+@click.option(
+    "--local-data-dir",
+    type=click.Path(exists=True, file_okay=False),
+    default=None,
+    help="Run the queries with DuckDB against the Parquet files in this directory instead of"
+    " BigQuery (see DuckDBSource)",
+)
+@click.option(
+    "--max-concurrent-queries",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="Number of dimension queries executed at the same time",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of processes the dimension combinations are evaluated in",
+)
+@click.option(
+    "--parallel-profiles",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of profiles processed at the same time",
+)
+@click.option(
+    "--shared-scans",
+    is_flag=True,
+    default=False,
+    help="Retrieve the dimension values of the profiles reading the same table for the same dates"
+    " with one query",
+)
+@click.option(
+    "--run-dir",
+    type=click.Path(file_okay=False),
+    default="runs",
+    show_default=True,
+    help="Directory the timings summary and, with --checkpoint, the output of each processing"
+    " stage are written to, per date and profile",
+)
+@click.option(
+    "--checkpoint",
+    is_flag=True,
+    default=False,
+    help="Checkpoint the output of each processing stage in the run directory, so an interrupted"
+    " run can be resumed",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Skip the processing stages checkpointed by a previous run for the same date, implies"
+    " --checkpoint",
+)
+@click.option(
+    "--timings",
+    "print_timings",
+    is_flag=True,
+    default=False,
+    help="Print the time taken by each processing stage and query at the end of the run, they are"
+    " always written to a JSON summary in the run directory",
+)
+@click.option(
+    "--profile-cpu",
+    is_flag=True,
+    default=False,
+    help="Profile the processing of each profile with cProfile, written to --profile-dir",
+)
+@click.option(
+    "--profile-memory",
+    is_flag=True,
+    default=False,
+    help="Report the top memory allocations of each profile with tracemalloc, written to"
+    " --profile-dir",
+)
+@click.option(
+    "--profile-dir",
+    type=click.Path(file_okay=False),
+    default="profiles",
+    show_default=True,
+    help="Directory the CPU and memory profiles are written to",
+)
+def run_analysis(
+    paths: Iterable[str],
+    date: ClickDate,
+    no_cache: bool,
+    cache_dir: str,
+    cache_ttl_hours: float,
+    cache_max_size_mb: int,
+    local_data_dir: str,
+    max_concurrent_queries: int,
+    workers: int,
+    parallel_profiles: int,
+    shared_scans: bool,
+    run_dir: str,
+    checkpoint: bool,
+    resume: bool,
+    print_timings: bool,
+    profile_cpu: bool,
+    profile_memory: bool,
+    profile_dir: str,
+):
+    if (profile_cpu or profile_memory) and parallel_profiles > 1:
+        # tracemalloc traces the whole process, the profiles would be mixed.
+        raise click.UsageError(
+            "--profile-cpu and --profile-memory require the profiles to be processed one at a"
+            " time, use --parallel-profiles 1"
+        )
     logger.info(f"Starting analysis for date: {date} (excluded)")
     error_occurred = False
-    for path in paths:
-        configs = Loader.load_all_config_files(path)
-
-        for config in configs:
-            logger.info(f"Starting processing: {config.analysis_profile.name}")
-
-            baseline_period, current_period = calculate_date_ranges(
-                dataset_config=config.analysis_profile.dataset, exclusive_end_date=date
-            )
-            try:
-                significant_dims = find_significant_dimensions(
-                    profile=config.analysis_profile,
-                    baseline_period=baseline_period,
-                    current_period=current_period,
-                )
-
-                # TODO GLE removed since requires update to table schema.
-                # insert_processing_info(
-                #     config.analysis_profile,
-                #     baseline_period,
-                #     current_period,
-                #     significant_dims.get("overall_change_calc"),
-                # )
-
-                # nothing significant found.
-                if significant_dims == {}:
-                    continue
-
-                issue_report(
-                    profile=config.analysis_profile,
-                    evaluation=significant_dims,
-                    baseline_period=baseline_period,
-                    current_period=current_period,
-                    notif_config=config.notification,
+    query_cache = (
+        None
+        if no_cache
+        else QueryCache(
+            directory=cache_dir,
+            ttl_seconds=cache_ttl_hours * 60 * 60,
+            max_size_bytes=cache_max_size_mb * 1024 * 1024,
+        )
+    )
+    metric_source = DuckDBSource(local_data_dir) if local_data_dir else BigQuerySource()
+    # The stage outputs are only written when they may be resumed.
+    checkpoint_dir = run_dir if checkpoint or resume else None
+    planner = (
+        SharedScanPlanner(MetricLookupManager(query_cache=query_cache, source=metric_source))
+        if shared_scans
+        else None
+    )
+    process = partial(
+        process_profile,
+        date=date,
+        query_cache=query_cache,
+        metric_source=metric_source,
+        max_concurrent_queries=max_concurrent_queries,
+        planner=planner,
+        run_dir=checkpoint_dir,
+        resume=resume,
+        profile_dir=profile_dir,
+        profile_cpu=profile_cpu,
+        profile_memory=profile_memory,
+    )
+    timings.clear()
+    started_at = datetime.now(tz=pytz.utc)
+    try:
+        # The worker processes are shared by all the profiles, they are only spawned once.
+        with worker_pool(workers) as executor:
+            process_config = partial(process, executor=executor)
+            for path in paths:
+                configs = Loader.load_all_config_files(path)
+                if planner is not None:
+                    prefetch_shared_scans(planner, configs, date, checkpoint_dir, resume)
+
+                if parallel_profiles <= 1 or len(configs) <= 1:
+                    processed = [process_config(config) for config in configs]
+                else:
+                    # The profiles mostly wait on their queries, so threads are enough to overlap
+                    # them.
+                    with ThreadPoolExecutor(
+                        max_workers=min(parallel_profiles, len(configs)),
+                        thread_name_prefix="profile",
+                    ) as profile_executor:
+                        processed = list(profile_executor.map(process_config, configs))
+
+                if not all(processed):
+                    error_occurred = True
+
+                logger.info(
+                    "Analysis completed"
+                    f" {'successfully' if not error_occurred else 'unsuccessfully'}."
                 )
-                logger.info(f"Successfully processed: {config.analysis_profile.name}")
-            except Exception:
-                error_occurred = True
-                logger.error(f"Error processing: {config.analysis_profile.name}", exc_info=1)
 
-        logger.info(
-            f"Analysis completed {'successfully' if not error_occurred else 'unsuccessfully'}."
+                if error_occurred:
+                    raise Exception("Processing error occurred.")
+    finally:
+        summary_path = timings.write_summary(
+            os.path.join(
+                run_dir,
+                date.strftime("%Y-%m-%d"),
+                f"timings_{started_at.strftime('%Y%m%dT%H%M%S')}.json",
+            ),
+            date=date.strftime("%Y-%m-%d"),
+            started_at=started_at.isoformat(),
+            wall_seconds=(datetime.now(tz=pytz.utc) - started_at).total_seconds(),
         )
+        logger.info(f"Timings written to: {summary_path}")
+        if print_timings:
+            click.echo(timings.table())
 
-        if error_occurred:
-            raise Exception("Processing error occurred.")
+
+@cli.command()
+@click.argument("paths", required=True, type=click.Path(exists=True, file_okay=True), nargs=-1)
+@click.option(
+    "--start",
+    type=ClickDate(),
+    help="First date for which projects should be analyzed",
+    metavar="YYYY-MM-DD",
+    required=True,
+)
+@click.option(
+    "--end",
+    type=ClickDate(),
+    help="Last date for which projects should be analyzed (included)",
+    metavar="YYYY-MM-DD",
+    required=True,
+)
+@click.option(
+    "--output-dir",
+    type=click.Path(file_okay=False),
+    default="backfill",
+    show_default=True,
+    help="Directory the results are written to, one Parquet file per profile",
+)
+@click.option(
+    "--local-data-dir",
+    type=click.Path(exists=True, file_okay=False),
+    default=None,
+    help="Run the queries with DuckDB against the Parquet files in this directory instead of"
+    " BigQuery (see DuckDBSource)",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of processes the dimension combinations are evaluated in",
+)
+def backfill(
+    paths: Iterable[str],
+    start: ClickDate,
+    end: ClickDate,
+    output_dir: str,
+    local_data_dir: str,
+    workers: int,
+):
+    """
+    Analyzes every date from start to end with one query per profile, see backfill_profile.  The
+    results are written to disk, no reports are issued.
+    """
+    if end < start:
+        raise click.BadParameter("--end must not be before --start")
+    dates = [start + timedelta(days=days) for days in range((end - start).days + 1)]
+    logger.info(f"Starting backfill for dates: {start} to {end}")
+    error_occurred = False
+    metric_source = DuckDBSource(local_data_dir) if local_data_dir else BigQuerySource()
+    # The worker processes are shared by all the profiles, they are only spawned once.
+    with worker_pool(workers) as executor:
+        for path in paths:
+            for config in Loader.load_all_config_files(path):
+                profile = config.analysis_profile
+                with profile_context(profile.name):
+                    try:
+                        processing_info, failed_dates = backfill_profile(
+                            profile=profile,
+                            dates=dates,
+                            metric_lookup=MetricLookupManager(source=metric_source),
+                            executor=executor,
+                        )
+                        write_processing_info(profile, processing_info, output_dir)
+                        if failed_dates:
+                            error_occurred = True
+                    except Exception:
+                        error_occurred = True
+                        logger.error(f"Error backfilling: {profile.name}", exc_info=1)
+
+    logger.info(f"Backfill completed {'successfully' if not error_occurred else 'unsuccessfully'}.")
+
+    if error_occurred:
+        raise Exception("Processing error occurred.")
 
 
 @cli.command()
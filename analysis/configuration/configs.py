@@ -1,6 +1,18 @@
+from typing import List
+
 import attr
 
 
+@attr.s(auto_attribs=True)
+class LongTailBucket:
+    dimension: str = attr.ib()
+    # Only the values with the largest share of the dimension total are kept, at most this many.
+    # None for no limit.
+    max_cardinality: int = attr.ib(None)
+    # Only the values with at least this share (0 to 1) of the dimension total are kept.
+    min_share: float = attr.ib(0)
+
+
 @attr.s(auto_attribs=True)
 class PercentChange:
     contrib_to_overall_change_threshold_percent: int = attr.ib()
@@ -11,6 +23,24 @@ class PercentChange:
     results_rounding: int = attr.ib(2)
     limit_results: int = attr.ib(10)
     exclude_dimension_values: list = attr.ib(default=attr.Factory(list))
+    # Combinations of up to this many dimensions are evaluated when
+    # include_dimension_permutations is enabled.  A combination of more than 2 dimensions is only
+    # evaluated when each of its combinations of one less dimension has a dimension value exceeding
+    # contrib_to_overall_change_threshold_percent.
+    max_dimension_depth: int = attr.ib(2, validator=attr.validators.ge(2))
+    # The maximum number of combinations of more than 2 dimensions evaluated per depth, the
+    # combinations whose parents have the largest contribution to overall change are kept.  None for
+    # no limit.
+    max_combinations_per_level: int = attr.ib(None)
+    # When combinations of dimensions are retrieved, the values of these dimensions that are not
+    # kept are folded into a single "Other" value by the query.  This bounds the number of rows of
+    # high cardinality dimensions (e.g. app_version), the totals and so the sum of the contributions
+    # to overall change are unchanged.  The "Other" value is not reported.
+    long_tail_buckets: List[LongTailBucket] = attr.ib(default=attr.Factory(list))
+    # Only evaluate the combinations of dimensions that each have a significant value when
+    # evaluated individually, and only retrieve those values.  The rest of each combination is
+    # reported as a single "Other" value.
+    lazy_dimension_permutations: bool = attr.ib(False)
 
 
 @attr.s(auto_attribs=True)
@@ -22,6 +52,26 @@ class Dataset:
     baseline_period: int = attr.ib()
     app_name: str = attr.ib(None)
     processing_period_offset: int = attr.ib(0)
+    # How dimension values are retrieved:
+    # - "dimension_set": one query per dimension set (e.g. country, country + os).
+    # - "grouping_sets": all dimension sets in one GROUPING SETS query (see
+    #   MetricLookupManager.prefetch_dimension_sets).
+    # - "cube": one query at the finest grain of all dimensions, rolled up locally (see
+    #   MetricCube).  Only valid for additive metrics.
+    fetch_mode: str = attr.ib(
+        "dimension_set",
+        validator=attr.validators.in_(["dimension_set", "grouping_sets", "cube"]),
+    )
+    # How the top level totals are retrieved:
+    # - "query": with a query of their own.
+    # - "dimensions": summed from the values by the excluded dimensions (or by the first dimension
+    #   when none are excluded), rolled up from the cube with fetch_mode "cube".  Without
+    #   excluded dimension values these are the values of the first dimension evaluated, so no
+    #   query is needed for the totals.  Only valid for additive metrics.
+    top_level_mode: str = attr.ib("query", validator=attr.validators.in_(["query", "dimensions"]))
+    # With top_level_mode "dimensions", the totals are also queried and an error is raised when
+    # they differ by more than this fraction.  None to skip the check.
+    top_level_check_tolerance: float = attr.ib(0.001)
 
 
 @attr.s(auto_attribs=True)
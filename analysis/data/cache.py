@@ -0,0 +1,111 @@
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+from pandas import DataFrame
+
+from analysis.logging import logger
+
+
+class QueryCache:
+    """
+    Content addressed on-disk cache of query results.  Results are stored as Parquet files named by
+    the hash of the rendered SQL so a rerun requesting byte-identical SQL (e.g. rerunning
+    `run-analysis` for the same date) does not execute the query again.
+
+    The file modification time records when the result was written (used for the TTL) and the
+    access time records when it was last read (used for the LRU eviction).
+    """
+
+    SUFFIX = ".parquet"
+
+    def __init__(self, directory: str, ttl_seconds: float = None, max_size_bytes: int = None):
+        """
+        :param directory: where the Parquet files are stored, created if it does not exist.
+        :param ttl_seconds: results older than this are not used, None for no expiry.
+        :param max_size_bytes: once exceeded the least recently used results are removed, None for
+         no limit.
+        """
+        self.directory = Path(directory)
+        self.ttl_seconds = ttl_seconds
+        self.max_size_bytes = max_size_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _key(query: str) -> str:
+        return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+    def _path(self, query: str) -> Path:
+        return self.directory / (self._key(query) + self.SUFFIX)
+
+    def _expired(self, path: Path) -> bool:
+        if self.ttl_seconds is None:
+            return False
+        return time.time() - path.stat().st_mtime > self.ttl_seconds
+
+    def get(self, query: str) -> Optional[DataFrame]:
+        """
+        :return: the cached result for the query, None if not cached or expired.
+        """
+        path = self._path(query)
+        if not path.exists():
+            return None
+        if self._expired(path):
+            logger.info(f"query cache entry expired: {path.name}")
+            path.unlink(missing_ok=True)
+            return None
+
+        try:
+            df = pd.read_parquet(path)
+        except Exception:
+            logger.warning(f"unable to read query cache entry: {path.name}", exc_info=1)
+            path.unlink(missing_ok=True)
+            return None
+
+        # Record the access for LRU eviction, the modification time is kept for the TTL.
+        os.utime(path, (time.time(), path.stat().st_mtime))
+        logger.info(f"query cache hit: {path.name}")
+        return df
+
+    def put(self, query: str, df: DataFrame):
+        """Stores the result of the query and evicts old results if the size limit is exceeded."""
+        path = self._path(query)
+        # Write to a temporary file first so an interrupted write does not leave a corrupt entry,
+        # the file is unique to the thread as queries may be executed concurrently.
+        tmp_path = path.with_suffix(f".{os.getpid()}-{threading.get_ident()}.tmp")
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Removes expired results, then the least recently used results until within size."""
+        entries = []
+        for path in self.directory.glob("*" + self.SUFFIX):
+            try:
+                if self._expired(path):
+                    path.unlink(missing_ok=True)
+                else:
+                    stat = path.stat()
+                    entries.append((stat.st_atime, stat.st_size, path))
+            except FileNotFoundError:
+                # Removed by another thread or process.
+                continue
+
+        if self.max_size_bytes is None:
+            return
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            logger.info(f"evicting query cache entry: {path.name}")
+            path.unlink(missing_ok=True)
+            total_size -= size
+
+    def clear(self):
+        for path in self.directory.glob("*" + self.SUFFIX):
+            path.unlink(missing_ok=True)
@@ -0,0 +1,90 @@
+import os
+import pickle
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from analysis.logging import logger
+
+
+class Checkpoint:
+    """
+    Persists the output of each stage of a profile's processing (e.g. the top level evaluation,
+    the report) so a rerun can skip the stages that completed and only redo the stage that failed.
+    The outputs are pickled to one file per stage in the run directory, they are only read back by
+    this tool.
+
+    A checkpoint without a directory runs every stage and persists nothing.
+    """
+
+    SUFFIX = ".pkl"
+
+    def __init__(self, directory: str = None, resume: bool = False):
+        """
+        :param directory: where the stage outputs are stored, created if it does not exist.
+        :param resume: the stages with a stored output are not run again, their output is loaded
+         instead.
+        """
+        self.directory = Path(directory) if directory is not None else None
+        self.resume = resume
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def for_profile(
+        cls, run_dir: str, date: datetime, profile_name: str, resume: bool = False
+    ) -> "Checkpoint":
+        """:return: the checkpoint of the profile in the run directory of the date."""
+        name = re.sub(r"[^\w.-]+", "_", profile_name)
+        return cls(os.path.join(run_dir, date.strftime("%Y-%m-%d"), name), resume=resume)
+
+    def _path(self, stage: str) -> Path:
+        return self.directory / (stage + self.SUFFIX)
+
+    def completed(self, stage: str) -> bool:
+        """:return: True if the stage has a stored output."""
+        return self.directory is not None and self._path(stage).exists()
+
+    def run(
+        self, stage: str, func: Callable[[], Any], is_valid: Callable[[Any], bool] = None
+    ) -> Any:
+        """
+        :param stage: the name of the stage, e.g. "top_level".
+        :param func: runs the stage and returns its output.
+        :param is_valid: when resuming, the stored output is only used if this returns True (e.g.
+         the report file still exists).
+        :return: the output of the stage, loaded from the checkpoint when resuming.
+        """
+        if self.directory is None:
+            return func()
+
+        path = self._path(stage)
+        if self.resume:
+            output = self._load(path)
+            if output is not None and (is_valid is None or is_valid(output[0])):
+                logger.info(f"Resuming stage: {stage} from checkpoint: {path}")
+                return output[0]
+
+        result = func()
+        # Write to a temporary file first so an interrupted write does not leave a corrupt stage.
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as fh:
+            pickle.dump(result, fh)
+        os.replace(tmp_path, path)
+        return result
+
+    @staticmethod
+    def _load(path: Path) -> Optional[tuple]:
+        """
+        :return: a tuple of the stored output, None when the stage has no stored output or it
+         cannot be read (e.g. truncated when the run was killed), the stage is then run again.
+        """
+        try:
+            with open(path, "rb") as fh:
+                return (pickle.load(fh),)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning(f"Ignoring unreadable checkpoint: {path}", exc_info=1)
+            return None
@@ -0,0 +1,70 @@
+import threading
+from typing import Callable, Dict, Optional
+
+from google.cloud import bigquery
+from requests.adapters import HTTPAdapter
+
+# Connections kept open per host.  The default requests pool keeps 10, which makes concurrent
+# query jobs wait on (or discard and reopen) connections.
+DEFAULT_POOL_SIZE = 32
+
+
+class BigQueryClientRegistry:
+    """
+    Process wide registry of BigQuery clients, one per project.  Creating a client repeats the
+    credential discovery and sets up a new HTTP session, sharing one client for the whole run means
+    this (and the TLS handshakes) happens once rather than for every query.
+
+    `bigquery.Client` is safe to share between threads.  Tests can `register` a mock client (or
+    set `factory`) so no credentials are needed.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        factory: Callable[[Optional[str]], bigquery.Client] = None,
+    ):
+        """
+        :param pool_size: the number of HTTP connections kept open, should be at least the number
+         of queries executed concurrently.
+        :param factory: creates the client for a project, defaults to a `bigquery.Client` with a
+         connection pool of `pool_size`.
+        """
+        self.pool_size = pool_size
+        self.factory = factory or self._create_client
+        self._clients: Dict[Optional[str], bigquery.Client] = {}
+        self._lock = threading.Lock()
+
+    def _create_client(self, project_id: Optional[str]) -> bigquery.Client:
+        client = bigquery.Client(project=project_id)
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        client._http.mount("https://", adapter)
+        return client
+
+    def get(self, project_id: str = None) -> bigquery.Client:
+        """
+        :param project_id: the project jobs are run in, None for the default project of the
+         environment.
+        :return: the shared client for the project, created on first use.
+        """
+        with self._lock:
+            if project_id not in self._clients:
+                self._clients[project_id] = self.factory(project_id)
+            return self._clients[project_id]
+
+    def register(self, client: bigquery.Client, project_id: str = None):
+        """Uses the given client for the project, e.g. a mock in tests."""
+        with self._lock:
+            self._clients[project_id] = client
+
+    def clear(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients = {}
+        for client in clients:
+            close = getattr(client, "close", None)
+            if close:
+                close()
+
+
+bigquery_clients = BigQueryClientRegistry()
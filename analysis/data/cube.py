@@ -0,0 +1,442 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from pandas import DataFrame
+import pandas as pd
+
+from analysis.configuration.processing_dates import ProcessingDateRange
+from analysis.data.metric import MetricLookupManager
+from analysis.errors import NoDataFoundForDateRangeError
+from analysis.logging import logger
+
+
+class MetricCube:
+    """
+    Answers dimension lookups from a single pull of the daily metric at the finest grain of all the
+    configured dimensions.  Coarser dimension sets (e.g. country, or country + os) are rolled up
+    in-process, replacing one query per dimension set with one query per profile.  A cube loaded
+    without excluded dimension values applies the exclusions of a lookup itself, it can then also
+    answer the top level lookups (see get_top_level_metrics_from_dimensions).
+
+    The rollups sum the finest grain values so the cube is only valid for additive metrics (e.g.
+    dau, new_profiles).  Lookups the cube cannot answer (e.g. top level values, a dimension that
+    was not loaded) are delegated to the wrapped MetricLookupManager.
+    """
+
+    WINDOW_SIZE = MetricLookupManager.WINDOW_SIZE
+
+    def __init__(self, metric_lookup: MetricLookupManager = None):
+        self.metric_lookup = metric_lookup or MetricLookupManager()
+        self._key = None
+        self._excluded_dimensions = None
+        self._query_date_ranges = {}
+        self._dimensions = []
+
+        # Column store of the finest grain rows, dimension values are integer coded.
+        self._timeframe_codes = np.array([], dtype=np.int64)
+        self._timeframes = np.array([], dtype=object)
+        self._days = np.array([], dtype=np.int64)
+        self._codes = {}
+        self._categories = {}
+        self._metric_values = np.array([], dtype=np.float64)
+        # The day (offset from the earliest start date) the window average is reported on.
+        self._end_days = np.array([], dtype=np.int64)
+
+    @staticmethod
+    def _cube_key(metric_name: str, table_name: str, app_name: str) -> tuple:
+        return metric_name, table_name, app_name
+
+    def load(
+        self,
+        metric_name: str,
+        table_name: str,
+        app_name: str,
+        date_ranges: Dict[str, ProcessingDateRange],
+        dimensions: list,
+        excluded_dimensions: list = None,
+    ):
+        """
+        Retrieves the daily metric grouped by all the dimensions for all the date ranges with a
+        single query and stores it for subsequent lookups.
+        :param date_ranges: dict of timeframe (e.g. "current", "baseline") to date range.
+        :param dimensions: all the dimensions that lookups may request.
+        """
+        df = self.metric_lookup.get_daily_metric_by_dimensions_with_date_ranges(
+            metric_name=metric_name,
+            table_name=table_name,
+            app_name=app_name,
+            date_ranges=date_ranges,
+            dimensions=dimensions,
+            excluded_dimensions=excluded_dimensions,
+        )
+        logger.info(f"loaded {len(df)} rows into cube for dimensions: {dimensions}")
+
+        self._key = self._cube_key(metric_name, table_name, app_name)
+        self._excluded_dimensions = excluded_dimensions
+        self._query_date_ranges = dict(date_ranges)
+        self._dimensions = list(dimensions)
+
+        origin = min(dr.start_date for dr in date_ranges.values()).date()
+        self._timeframes = np.array(list(date_ranges.keys()), dtype=object)
+        self._timeframe_codes = pd.Categorical(
+            df["timeframe"], categories=self._timeframes
+        ).codes.astype(np.int64)
+        self._days = (
+            (pd.to_datetime(df["submission_date"]) - pd.Timestamp(origin))
+            .dt.days.to_numpy()
+            .astype(np.int64)
+        )
+        self._end_days = np.array(
+            [(dr.end_date.date() - origin).days - 1 for dr in date_ranges.values()],
+            dtype=np.int64,
+        )
+        for dim in dimensions:
+            # None is replaced with the text "None" as done by the query based lookups.
+            codes, categories = pd.factorize(MetricLookupManager.fillna_dimension_values(df[dim]))
+            self._codes[dim] = codes.astype(np.int64)
+            self._categories[dim] = np.asarray(categories, dtype=object)
+        self._metric_values = df["metric_value"].to_numpy(dtype=np.float64)
+
+    def _timeframe_mapping(self, date_ranges: Dict[str, ProcessingDateRange]) -> Optional[dict]:
+        """
+        :return: dict of requested timeframe to the loaded timeframe with the same date range, or
+         else the date range containing it.  None if any of the requested date ranges was not
+         loaded.
+        """
+        mapping = {}
+        for timeframe, date_range in date_ranges.items():
+            loaded = [tf for tf, dr in self._query_date_ranges.items() if dr == date_range] or [
+                tf
+                for tf, dr in self._query_date_ranges.items()
+                if dr.start_date <= date_range.start_date and date_range.end_date <= dr.end_date
+            ]
+            if len(loaded) == 0:
+                return None
+            mapping[timeframe] = loaded[0]
+        return mapping
+
+    def _can_answer(
+        self,
+        metric_name: str,
+        table_name: str,
+        app_name: str,
+        dimensions: list,
+        excluded_dimensions: list = None,
+    ) -> bool:
+        if self._key != self._cube_key(metric_name, table_name, app_name) or not all(
+            dim in self._dimensions for dim in dimensions
+        ):
+            return False
+        if (excluded_dimensions or []) == (self._excluded_dimensions or []):
+            return True
+        # The excluded rows were not loaded, other exclusions are applied when rolling up.
+        return not self._excluded_dimensions and all(
+            dim["dimension"] in self._dimensions for dim in excluded_dimensions
+        )
+
+    def _exclusion_masks(self, excluded_dimensions: list) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: boolean masks of the finest grain rows with any of the excluded dimension values,
+         and of the rows missing (None) a value of an excluded dimension.  As with `NOT IN` in the
+         queries, the rows missing a value are not included when the values are excluded.
+        """
+        excluded = np.zeros(len(self._metric_values), dtype=bool)
+        missing = np.zeros(len(self._metric_values), dtype=bool)
+        for dim in excluded_dimensions or []:
+            categories = self._categories[dim["dimension"]]
+            codes = self._codes[dim["dimension"]]
+            excluded |= np.isin(codes, np.flatnonzero(np.isin(categories, dim["dim_values"])))
+            missing |= np.isin(codes, np.flatnonzero(categories == "None"))
+        return excluded, missing
+
+    def _dimension_value_rows(self, dimension_values: list) -> np.ndarray:
+        """
+        :param dimension_values: same format as the excluded dimensions.
+        :return: boolean mask of the finest grain rows with one of the listed values of each of the
+         dimensions.
+        """
+        rows = np.ones(len(self._metric_values), dtype=bool)
+        for dim in dimension_values:
+            categories = self._categories[dim["dimension"]]
+            codes = self._codes[dim["dimension"]]
+            rows &= np.isin(codes, np.flatnonzero(np.isin(categories, dim["dim_values"])))
+        return rows
+
+    def _included_rows(self, excluded_dimensions: list = None) -> Optional[np.ndarray]:
+        """
+        :return: boolean mask of the finest grain rows without the excluded dimension values, None
+         when all the loaded rows are included.
+        """
+        if (excluded_dimensions or []) == (self._excluded_dimensions or []):
+            return None
+        excluded, missing = self._exclusion_masks(excluded_dimensions)
+        return ~excluded & ~missing
+
+    def _date_range_rows(
+        self, loaded_timeframe: str, date_range: ProcessingDateRange
+    ) -> Tuple[np.ndarray, int]:
+        """
+        :return: boolean mask of the finest grain rows of the loaded timeframe within the date
+         range, and the last day of the date range.
+        """
+        origin = min(dr.start_date for dr in self._query_date_ranges.values()).date()
+        start_day = (date_range.start_date.date() - origin).days
+        end_day = (date_range.end_date.date() - origin).days
+        timeframe_code = list(self._timeframes).index(loaded_timeframe)
+        rows = (
+            (self._timeframe_codes == timeframe_code)
+            & (self._days >= start_day)
+            & (self._days < end_day)
+        )
+        return rows, end_day - 1
+
+    def _group_key(self, columns: list) -> np.ndarray:
+        """
+        Combines integer coded columns into a single int64 key with the same sort order as the
+        columns (first column most significant).
+        :param columns: list of (codes, number of distinct codes) tuples.
+        """
+        key = np.zeros(len(self._metric_values), dtype=np.int64)
+        key_size = 1
+        for codes, size in columns:
+            if key_size * size >= 2**62:
+                # Re-number the key densely (preserving order) to avoid overflowing int64.
+                _, key = np.unique(key, return_inverse=True)
+                key = key.astype(np.int64)
+                key_size = int(key.max()) + 1
+            key = key * size + codes
+            key_size *= size
+        return key
+
+    def _folded_codes(self, dimension: str, dim_values: list) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the codes and categories of the dimension with the values that are not listed
+         replaced by OTHER_DIMENSION_VALUE.
+        """
+        categories = self._categories[dimension]
+        kept = np.isin(categories, dim_values)
+        folded_categories = np.append(
+            categories[kept], MetricLookupManager.OTHER_DIMENSION_VALUE
+        ).astype(object)
+        mapping = np.where(kept, np.cumsum(kept) - 1, len(folded_categories) - 1)
+        return mapping[self._codes[dimension]], folded_categories
+
+    def rollup(
+        self,
+        dimensions: list,
+        included: np.ndarray = None,
+        end_day: int = None,
+        folded_dimension_values: list = None,
+    ) -> DataFrame:
+        """
+        Rolls the finest grain values up to the dimensions and applies the window average.
+        :param dimensions: the dimensions to roll up to, empty for the totals.
+        :param included: boolean mask of the finest grain rows rolled up, None for all the rows.
+        :param end_day: the day the window average is reported on, defaults to the last day of
+         each loaded date range.
+        :param folded_dimension_values: the values of these dimensions that are not listed are
+         rolled up into OTHER_DIMENSION_VALUE, see
+         MetricLookupManager.get_metric_by_dimensions_with_date_ranges.
+        :return: Dataframe with columns ['dimension_value_n', 'timeframe', 'metric_value']
+        """
+        codes = {dim: (self._codes[dim], self._categories[dim]) for dim in dimensions}
+        for dim in folded_dimension_values or []:
+            codes[dim["dimension"]] = self._folded_codes(dim["dimension"], dim["dim_values"])
+
+        n_days = int(self._days.max()) + 1 if len(self._days) > 0 else 1
+        key = self._group_key(
+            [(self._timeframe_codes, len(self._timeframes))]
+            + [(codes[dim][0], len(codes[dim][1])) for dim in dimensions]
+            + [(self._days, n_days)]
+        )
+
+        metric_values = self._metric_values
+        if included is not None:
+            positions = np.flatnonzero(included)
+            key, metric_values = key[positions], metric_values[positions]
+
+        # Sum the metric for each (timeframe, dimension values, day).  np.unique sorts the keys so
+        # the rows of each group are contiguous and ordered by day.
+        day_keys, first_rows, inverse = np.unique(key, return_index=True, return_inverse=True)
+        if included is not None:
+            first_rows = positions[first_rows]
+        daily_values = np.bincount(inverse, weights=metric_values)
+        groups = day_keys // n_days
+        days = day_keys % n_days
+
+        # Average the last WINDOW_SIZE days of each group, as done by the window in the templates.
+        _, group_start, group_inverse, group_counts = np.unique(
+            groups, return_index=True, return_inverse=True, return_counts=True
+        )
+        group_last = group_start + group_counts - 1
+        in_window = (group_last[group_inverse] - np.arange(len(day_keys))) < self.WINDOW_SIZE
+        window_sum = np.bincount(
+            group_inverse[in_window], weights=daily_values[in_window], minlength=len(group_last)
+        )
+        window_count = np.bincount(group_inverse[in_window], minlength=len(group_last))
+
+        # Only groups with a value on the last day of their date range are reported.
+        rows = first_rows[group_last]
+        timeframe_codes = self._timeframe_codes[rows]
+        reported = days[group_last] == (
+            self._end_days[timeframe_codes] if end_day is None else end_day
+        )
+
+        rows = rows[reported]
+        result = {
+            f"dimension_value_{i}": codes[dim][1][codes[dim][0][rows]]
+            for i, dim in enumerate(dimensions)
+        }
+        result["timeframe"] = self._timeframes[timeframe_codes[reported]]
+        result["metric_value"] = window_sum[reported] / window_count[reported]
+        return DataFrame(result)
+
+    def _rollup_date_ranges(
+        self,
+        metric_name: str,
+        date_ranges: Dict[str, ProcessingDateRange],
+        mapping: dict,
+        dimensions: list,
+        included: np.ndarray = None,
+        folded_dimension_values: list = None,
+    ) -> DataFrame:
+        """
+        Rolls up the loaded timeframes, labelled with the requested timeframes (see
+        _timeframe_mapping).  A requested date range within a loaded date range is rolled up from
+        the days it covers, so a cube loaded for a span of dates answers every date range in it.
+        """
+        if all(self._query_date_ranges[mapping[tf]] == dr for tf, dr in date_ranges.items()):
+            df = self.rollup(dimensions, included, folded_dimension_values=folded_dimension_values)
+            loaded_mapping = {loaded: timeframe for timeframe, loaded in mapping.items()}
+            df = df[df["timeframe"].isin(loaded_mapping.keys())].reset_index(drop=True)
+            df["timeframe"] = df["timeframe"].map(loaded_mapping)
+        else:
+            frames = []
+            for timeframe, date_range in date_ranges.items():
+                rows, end_day = self._date_range_rows(mapping[timeframe], date_range)
+                if included is not None:
+                    rows &= included
+                frames.append(
+                    self.rollup(dimensions, rows, end_day, folded_dimension_values).assign(
+                        timeframe=timeframe
+                    )
+                )
+            df = pd.concat(frames, ignore_index=True)
+
+        for timeframe, date_range in date_ranges.items():
+            if timeframe not in df["timeframe"].values:
+                raise NoDataFoundForDateRangeError(
+                    metric=metric_name, query=f"cube rollup of {dimensions}", date_range=date_range
+                )
+        return df
+
+    def get_metric_by_dimensions_with_date_ranges(
+        self,
+        metric_name: str,
+        table_name: str,
+        app_name: str,
+        date_ranges: Dict[str, ProcessingDateRange],
+        dimensions: list,  # indicates the permutation of the dimensions to evaluate.
+        excluded_dimensions: list = None,
+        included_dimension_values: list = None,
+        folded_dimension_values: list = None,
+    ) -> DataFrame:
+        mapping = self._timeframe_mapping(date_ranges)
+        if mapping is None or not self._can_answer(
+            metric_name, table_name, app_name, dimensions, excluded_dimensions
+        ):
+            return self.metric_lookup.get_metric_by_dimensions_with_date_ranges(
+                metric_name=metric_name,
+                table_name=table_name,
+                app_name=app_name,
+                date_ranges=date_ranges,
+                dimensions=dimensions,
+                excluded_dimensions=excluded_dimensions,
+                included_dimension_values=included_dimension_values,
+                folded_dimension_values=folded_dimension_values,
+            )
+
+        logger.info(f"rolling up cube for dimensions: {dimensions}")
+        included = self._included_rows(excluded_dimensions)
+        # Filtered before rolling up, the values that are not kept are folded after filtering as
+        # done by the queries.
+        if included_dimension_values:
+            value_rows = self._dimension_value_rows(included_dimension_values)
+            included = value_rows if included is None else included & value_rows
+        df = self._rollup_date_ranges(
+            metric_name, date_ranges, mapping, dimensions, included, folded_dimension_values
+        )
+        return MetricLookupManager._label_dimensions(df, dimensions)
+
+    def get_metric_by_dimensions_with_date_range(
+        self,
+        metric_name: str,
+        table_name: str,
+        app_name: str,
+        date_range: ProcessingDateRange,
+        dimensions: list,  # indicates the permutation of the dimensions to evaluate.
+        excluded_dimensions: list = None,
+    ) -> DataFrame:
+        return self.get_metric_by_dimensions_with_date_ranges(
+            metric_name=metric_name,
+            table_name=table_name,
+            app_name=app_name,
+            date_ranges={MetricLookupManager.SINGLE_TIMEFRAME: date_range},
+            dimensions=dimensions,
+            excluded_dimensions=excluded_dimensions,
+        ).drop(columns="timeframe")
+
+    def get_metric_with_date_ranges(self, **kwargs) -> DataFrame:
+        return self.metric_lookup.get_metric_with_date_ranges(**kwargs)
+
+    def get_metric_with_date_range(self, **kwargs) -> DataFrame:
+        return self.metric_lookup.get_metric_with_date_range(**kwargs)
+
+    def get_top_level_metrics_with_date_ranges(self, **kwargs) -> Dict[str, DataFrame]:
+        return self.metric_lookup.get_top_level_metrics_with_date_ranges(**kwargs)
+
+    def get_top_level_metrics_from_dimensions(
+        self,
+        metric_name: str,
+        table_name: str,
+        app_name: str,
+        date_ranges: Dict[str, ProcessingDateRange],
+        dimensions: list,
+        excluded_dimensions: list = None,
+    ) -> Dict[str, DataFrame]:
+        """
+        Rolls the cube up to the top level totals, the window average is applied to the daily
+        totals as done by the top level queries.  Delegated to the wrapped MetricLookupManager when
+        the cube was not loaded without exclusions for the metric and the excluded dimensions.
+        See MetricLookupManager.get_top_level_metrics_from_dimensions.
+        """
+        mapping = self._timeframe_mapping(date_ranges)
+        excluded_dimension_names = [dim["dimension"] for dim in excluded_dimensions or []]
+        if (
+            mapping is None
+            or self._excluded_dimensions
+            or not self._can_answer(
+                metric_name, table_name, app_name, excluded_dimension_names, excluded_dimensions
+            )
+        ):
+            return self.metric_lookup.get_top_level_metrics_from_dimensions(
+                metric_name=metric_name,
+                table_name=table_name,
+                app_name=app_name,
+                date_ranges=date_ranges,
+                dimensions=dimensions,
+                excluded_dimensions=excluded_dimensions,
+            )
+
+        logger.info("rolling up cube for the top level values")
+        included_rows = {"all": None}
+        if excluded_dimensions:
+            excluded, missing = self._exclusion_masks(excluded_dimensions)
+            included_rows["dimension_values_excluded"] = ~excluded & ~missing
+            included_rows["dimension_values_only"] = excluded
+        return {
+            variant: self._rollup_date_ranges(metric_name, date_ranges, mapping, [], included)[
+                ["timeframe", "metric_value"]
+            ]
+            for variant, included in included_rows.items()
+        }
@@ -1,19 +1,19 @@
 import os
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, List, Tuple
 
 import pandas as pd
-from google.cloud import bigquery
-from google.api_core.exceptions import Forbidden
 from pandas import DataFrame
 
 from jinja2 import Environment, FileSystemLoader, TemplateNotFound
 
+from analysis.data.cache import QueryCache
+from analysis.data.sources import BigQuerySource, MetricSource
 from analysis.logging import logger
+from analysis.logging.timings import timings
 from analysis.configuration.processing_dates import ProcessingDateRange
 from analysis.errors import (
     NoDataFoundForDateRangeError,
-    BigQueryPermissionsError,
     SqlNotDefinedError,
 )
 
@@ -23,6 +23,27 @@ TEMPLATE_FOLDER = PATH / "templates"
 
 class MetricLookupManager:
     SUBMISSION_DATE_FORMAT = "%Y-%m-%d"
+    # Timeframe label used when a single date range is requested, the column is dropped before
+    # the results are returned.
+    SINGLE_TIMEFRAME = "date_range"
+    # The top level metric over all rows, without the excluded dimension values and with only the
+    # excluded dimension values.
+    TOP_LEVEL_VARIANTS = ["all", "dimension_values_excluded", "dimension_values_only"]
+    # Matches `ROWS BETWEEN 6 PRECEDING AND CURRENT ROW` in the query templates.
+    WINDOW_SIZE = 7
+    # The dimension value the values that are not kept are folded into, see LongTailBucket.
+    OTHER_DIMENSION_VALUE = "Other"
+
+    def __init__(self, query_cache: QueryCache = None, source: MetricSource = None):
+        """
+        :param query_cache: when provided, query results are read from and written to the cache.
+        :param source: executes the queries, defaults to BigQuery.
+        """
+        self.query_cache = query_cache
+        self.source = source or BigQuerySource()
+        # Results retrieved ahead of time by prefetch_dimension_sets (or kept by
+        # get_top_level_metrics_from_dimensions), keyed by _prefetch_key.
+        self._prefetched = {}
 
     def _render_sql(self, template_file: str, render_kwargs: Dict[str, Any]):
         """Render and return the SQL from a template."""
@@ -42,32 +63,79 @@ class MetricLookupManager:
         metric: str,
         date_range: ProcessingDateRange,
     ) -> DataFrame:
-        bq_client = bigquery.Client()
-        # TODO GLE wait for complete
-        query_job = bq_client.query(query)
-        try:
-            df = query_job.to_dataframe()
-        except Forbidden as e:
-            raise BigQueryPermissionsError(metric=metric, query=query, msg=e.message)
+        # The source is part of the cache key so results from different sources are not mixed.
+        cache_key = f"-- source: {self.source.name}\n{query}"
+        with timings.measure("query", metric=metric, source=self.source.name) as details:
+            df = self.query_cache.get(cache_key) if self.query_cache is not None else None
+            details["cached"] = df is not None
+            if df is None:
+                df = self.source.run_query(query=query, metric=metric)
+                # Set by the sources that report it, e.g. BigQuery.
+                details["total_bytes_processed"] = df.attrs.get("total_bytes_processed")
+
+                if "submission_date" in df.columns:
+                    df["submission_date"] = pd.to_datetime(df["submission_date"])
+                df = df.rename(columns={"dimension_value": "dimension_value_0"})
 
-        if "submission_date" in df.columns:
-            df["submission_date"] = pd.to_datetime(df["submission_date"])
-        df = df.rename(columns={"dimension_value": "dimension_value_0"})
+                if self.query_cache is not None and not df.empty:
+                    self.query_cache.put(cache_key, df)
+            details["rows"] = len(df)
+            details["bytes"] = int(df.memory_usage(deep=True).sum())
 
         if df.empty:
             raise NoDataFoundForDateRangeError(metric=metric, query=query, date_range=date_range)
         return df
 
-    def get_metric_with_date_range(
+    def _date_range_render_kwargs(self, date_ranges: Dict[str, ProcessingDateRange]) -> dict:
+        """
+        Builds the render kwargs describing the date ranges to scan.
+        :param date_ranges: dict of timeframe (e.g. "current", "baseline") to date range.
+        :return: 'date_ranges' contains one entry per timeframe, 'start_date' and 'end_date' span
+         all of the date ranges so the scanned partitions can be pruned.
+        """
+        return {
+            "date_ranges": [
+                {
+                    "timeframe": timeframe,
+                    "start_date": date_range.start_date.strftime(self.SUBMISSION_DATE_FORMAT),
+                    "end_date": date_range.end_date.strftime(self.SUBMISSION_DATE_FORMAT),
+                }
+                for timeframe, date_range in date_ranges.items()
+            ],
+            "start_date": min(dr.start_date for dr in date_ranges.values()).strftime(
+                self.SUBMISSION_DATE_FORMAT
+            ),
+            "end_date": max(dr.end_date for dr in date_ranges.values()).strftime(
+                self.SUBMISSION_DATE_FORMAT
+            ),
+        }
+
+    @staticmethod
+    def _check_all_timeframes_found(
+        df: DataFrame, metric: str, query: str, date_ranges: Dict[str, ProcessingDateRange]
+    ):
+        """Ensure each of the requested date ranges returned data, not only the combined result."""
+        found = set(df["timeframe"].unique())
+        for timeframe, date_range in date_ranges.items():
+            if timeframe not in found:
+                raise NoDataFoundForDateRangeError(
+                    metric=metric, query=query, date_range=date_range
+                )
+
+    def get_metric_with_date_ranges(
         self,
         metric_name: str,
         table_name: str,
         app_name: str,
-        date_range: ProcessingDateRange,
+        date_ranges: Dict[str, ProcessingDateRange],
         excluded_dimensions: list = None,
         included_dimensions_only: list = None,
     ) -> DataFrame:
-
+        """
+        Retrieves the metric for all the date ranges using a single query.
+        :param date_ranges: dict of timeframe (e.g. "current", "baseline") to date range.
+        :return: Dataframe with columns ['timeframe', 'metric_value'], one row per timeframe.
+        """
         if excluded_dimensions is not None and included_dimensions_only is not None:
             raise ValueError("Cannot include both excluded_dimensions and included_dimensions_only")
 
@@ -75,62 +143,365 @@ class MetricLookupManager:
 
         render_kwargs = {
             "metric": metric_name,
-            "start_date": date_range.start_date.strftime(self.SUBMISSION_DATE_FORMAT),
-            "end_date": date_range.end_date.strftime(self.SUBMISSION_DATE_FORMAT),
             "app_name": app_name,
             "exclude_dimension_values": excluded_dimensions,
             "included_dimensions_only": included_dimensions_only,
+        } | self._date_range_render_kwargs(date_ranges)
+        query = self._render_sql(template_file=file, render_kwargs=render_kwargs)
+
+        df = self.run_query(
+            query=query,
+            metric=metric_name,
+            date_range=list(date_ranges.values())[0],
+        )
+        self._check_all_timeframes_found(df, metric_name, query, date_ranges)
+        return df
+
+    def get_top_level_metrics_with_date_ranges(
+        self,
+        metric_name: str,
+        table_name: str,
+        app_name: str,
+        date_ranges: Dict[str, ProcessingDateRange],
+        excluded_dimensions: list = None,
+    ) -> Dict[str, DataFrame]:
+        """
+        Retrieves the top level metric for all the date ranges, together with the metric excluding
+        and including only the excluded dimension values.  All of them are computed by a single
+        query when the table has a `_top_level.sql` template, otherwise one query is used for each.
+        :param date_ranges: dict of timeframe (e.g. "current", "baseline") to date range.
+        :param excluded_dimensions: the excluded dimension values, when None or empty only the
+         metric over all the rows is retrieved.
+        :return: dict of TOP_LEVEL_VARIANTS to Dataframe with columns ['timeframe', 'metric_value'],
+         one row per timeframe.
+        """
+        variants = self.TOP_LEVEL_VARIANTS if excluded_dimensions else self.TOP_LEVEL_VARIANTS[:1]
+        kwargs = {
+            "metric_name": metric_name,
+            "table_name": table_name,
+            "app_name": app_name,
+            "date_ranges": date_ranges,
         }
+
+        file = table_name + "_top_level.sql"
+        if not (TEMPLATE_FOLDER / file).exists():
+            variant_kwargs = {
+                "all": {},
+                "dimension_values_excluded": {"excluded_dimensions": excluded_dimensions},
+                "dimension_values_only": {"included_dimensions_only": excluded_dimensions},
+            }
+            return {
+                variant: self.get_metric_with_date_ranges(**variant_kwargs[variant], **kwargs)
+                for variant in variants
+            }
+
+        render_kwargs = {
+            "metric": metric_name,
+            "app_name": app_name,
+            "exclude_dimension_values": excluded_dimensions,
+        } | self._date_range_render_kwargs(date_ranges)
         query = self._render_sql(template_file=file, render_kwargs=render_kwargs)
 
-        return self.run_query(
+        df = self.run_query(
             query=query,
             metric=metric_name,
-            date_range=date_range,
+            date_range=list(date_ranges.values())[0],
         )
+        results = {}
+        for variant in variants:
+            column = "metric_value" if variant == "all" else f"metric_value_{variant}"
+            values = df[["timeframe", column]].rename(columns={column: "metric_value"})
+            if variant != "all":
+                # The window average of the other days is returned even when no rows matched on
+                # the last day, a separate query would have returned nothing for the date range.
+                values = values[df[f"rows_{variant}"] > 0]
+            # A total is NULL when no rows matched its condition, as if it was queried separately.
+            values = values.dropna()
+            self._check_all_timeframes_found(values, metric_name, query, date_ranges)
+            results[variant] = values.reset_index(drop=True)
+        return results
 
-    def get_metric_by_dimensions_with_date_range(
+    def get_top_level_metrics_from_dimensions(
+        self,
+        metric_name: str,
+        table_name: str,
+        app_name: str,
+        date_ranges: Dict[str, ProcessingDateRange],
+        dimensions: list,
+        excluded_dimensions: list = None,
+    ) -> Dict[str, DataFrame]:
+        """
+        Sums the daily metric by dimensions up to the daily totals of
+        get_top_level_metrics_with_date_ranges and applies the window average to them, rather than
+        querying the totals.  This is only valid for additive metrics.
+        When there are no excluded dimension values the window averages of the dimension values are
+        kept for the lookup of the same dimensions by the dimension evaluation, so the values do not
+        need a query of their own.
+        :param date_ranges: dict of timeframe (e.g. "current", "baseline") to date range.
+        :param dimensions: the dimensions the metric is retrieved by, must include all the excluded
+         dimensions.
+        :param excluded_dimensions: the excluded dimension values, when None or empty only the
+         metric over all the rows is returned.
+        :return: dict of TOP_LEVEL_VARIANTS to Dataframe with columns ['timeframe', 'metric_value'],
+         one row per timeframe.
+        """
+        # The rows with the excluded values are needed for the totals including them.
+        df = self.get_daily_metric_by_dimensions_with_date_ranges(
+            metric_name=metric_name,
+            table_name=table_name,
+            app_name=app_name,
+            date_ranges=date_ranges,
+            dimensions=dimensions,
+            excluded_dimensions=None,
+        )
+        for dim in dimensions:
+            df[dim] = self.fillna_dimension_values(df[dim])
+        if not excluded_dimensions:
+            key = self._prefetch_key(
+                metric_name, table_name, app_name, date_ranges, dimensions, excluded_dimensions
+            )
+            values = self._window_average(df, date_ranges, dimensions).rename(
+                columns={dim: f"dimension_value_{i}" for i, dim in enumerate(dimensions)}
+            )
+            self._prefetched.setdefault(key, self._label_dimensions(values, dimensions))
+
+        excluded = pd.Series(False, index=df.index)
+        # As with `NOT IN` in the queries, the rows missing a value of an excluded dimension are not
+        # included when the values are excluded.
+        missing = pd.Series(False, index=df.index)
+        for dim in excluded_dimensions or []:
+            excluded |= df[dim["dimension"]].isin(dim["dim_values"])
+            missing |= df[dim["dimension"]] == "None"
+        rows = {"all": pd.Series(True, index=df.index)}
+        if excluded_dimensions:
+            rows["dimension_values_excluded"] = ~excluded & ~missing
+            rows["dimension_values_only"] = excluded
+
+        results = {}
+        for variant, variant_rows in rows.items():
+            values = self._window_average(df[variant_rows], date_ranges)
+            self._check_all_timeframes_found(
+                values, metric_name, f"sum of the daily metric by {dimensions}", date_ranges
+            )
+            results[variant] = values
+        return results
+
+    @classmethod
+    def _window_average(
+        cls, df: DataFrame, date_ranges: Dict[str, ProcessingDateRange], columns: list = None
+    ) -> DataFrame:
+        """
+        Sums the daily metric by the columns and averages the sums over the window, as done by the
+        `ROWS BETWEEN 6 PRECEDING AND CURRENT ROW` window of the query templates.
+        :param df: the daily metric, see get_daily_metric_by_dimensions_with_date_ranges.
+        :param columns: the columns the metric is summed by, None for the totals.
+        :return: Dataframe with the columns, 'timeframe' and 'metric_value', only the sums with a
+         value on the last day of their date range are returned.
+        """
+        keys = ["timeframe"] + (columns or [])
+        daily = (
+            df.groupby(keys + ["submission_date"], observed=True)["metric_value"]
+            .sum()
+            .reset_index()
+        )
+        daily["metric_value"] = (
+            daily.groupby(keys, observed=True)["metric_value"]
+            .rolling(cls.WINDOW_SIZE, min_periods=1)
+            .mean()
+            .reset_index(level=list(range(len(keys))), drop=True)
+        )
+        last_days = {
+            timeframe: pd.Timestamp(date_range.end_date.date()) - pd.Timedelta(days=1)
+            for timeframe, date_range in date_ranges.items()
+        }
+        last_day = daily["submission_date"] == daily["timeframe"].map(last_days)
+        return daily.loc[last_day, (columns or []) + ["timeframe", "metric_value"]].reset_index(
+            drop=True
+        )
+
+    def get_metric_with_date_range(
         self,
         metric_name: str,
         table_name: str,
         app_name: str,
         date_range: ProcessingDateRange,
+        excluded_dimensions: list = None,
+        included_dimensions_only: list = None,
+    ) -> DataFrame:
+        return self.get_metric_with_date_ranges(
+            metric_name=metric_name,
+            table_name=table_name,
+            app_name=app_name,
+            date_ranges={self.SINGLE_TIMEFRAME: date_range},
+            excluded_dimensions=excluded_dimensions,
+            included_dimensions_only=included_dimensions_only,
+        ).drop(columns="timeframe")
+
+    def get_metric_by_dimensions_with_date_ranges(
+        self,
+        metric_name: str,
+        table_name: str,
+        app_name: str,
+        date_ranges: Dict[str, ProcessingDateRange],
         dimensions: list,  # indicates the permutation of the dimensions to evaluate.
         excluded_dimensions: list = None,
+        included_dimension_values: list = None,
+        folded_dimension_values: list = None,
     ) -> DataFrame:
+        """
+        Retrieves the metric by dimensions for all the date ranges using a single query.
+        :param date_ranges: dict of timeframe (e.g. "current", "baseline") to date range.
+        :param included_dimension_values: only the rows with these values are retrieved, same
+         format as the excluded dimensions (e.g. [{"dimension": "country", "dim_values": ["CA"]}]).
+         The dimensions must be in `dimensions`.
+        :param folded_dimension_values: the values of these dimensions that are not listed are
+         folded into a single OTHER_DIMENSION_VALUE value by the query, before the window average.
+         Same format as the included dimension values.
+        :return: Dataframe with columns ['dimension_value_n', 'timeframe', 'metric_value',
+         'dimension_n']
+        """
+        key = self._prefetch_key(
+            metric_name, table_name, app_name, date_ranges, dimensions, excluded_dimensions
+        )
+        if key in self._prefetched:
+            logger.info(f"using prefetched values for dimensions: {dimensions}")
+            return self.fold_dimension_values(
+                self.filter_dimension_values(
+                    self._prefetched[key].copy(), dimensions, included_dimension_values
+                ),
+                dimensions,
+                folded_dimension_values,
+            )
+
         file = table_name + "_by_dims.sql"
 
         dim_value_spec = "@dimension as dimension_value"
         dim_spec = "@dimension"
         full_dim_value_spec = ""
         full_dim_spec = ""
+        # The dimensions as selected and grouped by, the folded dimensions are expressions.
+        dim_expressions = {
+            dim["dimension"]: self._fold_expression(dim["dimension"], dim["dim_values"])
+            for dim in folded_dimension_values or []
+        }
+        full_dim_select_spec = ""
+        full_dim_group_spec = ""
 
         # Build up the list of dimensions=
         for dim in dimensions:
             if len(full_dim_value_spec) > 0:
                 full_dim_value_spec += ","
                 full_dim_spec += ","
+                full_dim_select_spec += ","
+                full_dim_group_spec += ","
             full_dim_value_spec += dim_value_spec.replace("@dimension", dim, 1)
             full_dim_spec += dim_spec.replace("@dimension", dim, 1)
+            if dim in dim_expressions:
+                full_dim_select_spec += f"{dim_expressions[dim]} AS {dim}"
+                full_dim_group_spec += dim_expressions[dim]
+            else:
+                full_dim_select_spec += dim
+                full_dim_group_spec += dim
 
         logger.info(f"processing dimensions: {full_dim_spec}")
 
         render_kwargs = {
             "metric": metric_name,
-            "start_date": date_range.start_date.strftime(self.SUBMISSION_DATE_FORMAT),
-            "end_date": date_range.end_date.strftime(self.SUBMISSION_DATE_FORMAT),
             "app_name": app_name,
             "full_dim_value_spec": full_dim_value_spec,
             "full_dim_spec": full_dim_spec,
+            "full_dim_select_spec": full_dim_select_spec,
+            "full_dim_group_spec": full_dim_group_spec,
             "exclude_dimension_values": excluded_dimensions,
-        }
+            "included_dimension_values": included_dimension_values,
+        } | self._date_range_render_kwargs(date_ranges)
         query = self._render_sql(template_file=file, render_kwargs=render_kwargs)
 
         df = self.run_query(
             query=query,
             metric=metric_name,
-            date_range=date_range,
+            date_range=list(date_ranges.values())[0],
         )
+        self._check_all_timeframes_found(df, metric_name, query, date_ranges)
+
+        return self._label_dimensions(df, dimensions)
+
+    @staticmethod
+    def filter_dimension_values(
+        df: DataFrame, dimensions: list, included_dimension_values: list = None
+    ) -> DataFrame:
+        """
+        Keeps the rows with the included dimension values, as the query does when the values are
+        passed to get_metric_by_dimensions_with_date_ranges.
+        :param df: Dataframe with the 'dimension_value_n' columns of the dimensions.
+        """
+        if not included_dimension_values:
+            return df
+        for dim in included_dimension_values:
+            column = f"dimension_value_{dimensions.index(dim['dimension'])}"
+            df = df[df[column].isin(dim["dim_values"])]
+        return df.reset_index(drop=True)
+
+    @classmethod
+    def _fold_expression(cls, dimension: str, dim_values: list) -> str:
+        """
+        :return: the SQL expression of the dimension with the values that are not listed replaced
+         by OTHER_DIMENSION_VALUE.  As with the included values, "None" keeps the NULL values.
+        """
+        conditions = []
+        if len(dim_values) > 0:
+            conditions.append(
+                f"{dimension} IN (" + ", ".join(f'"{value}"' for value in dim_values) + ")"
+            )
+        if "None" in dim_values:
+            conditions.append(f"{dimension} IS NULL")
+        kept = " OR ".join(conditions) or "FALSE"
+        return f'CASE WHEN {kept} THEN {dimension} ELSE "{cls.OTHER_DIMENSION_VALUE}" END'
+
+    @classmethod
+    def fold_dimension_values(
+        cls, df: DataFrame, dimensions: list, folded_dimension_values: list = None
+    ) -> DataFrame:
+        """
+        Folds the values that are not listed into OTHER_DIMENSION_VALUE, as the query does when the
+        values are passed to get_metric_by_dimensions_with_date_ranges.  The values are already
+        window averages, the averages of the folded values are summed.
+        :param df: Dataframe with the 'dimension_value_n' and 'metric_value' columns.
+        """
+        if not folded_dimension_values or len(df) == 0:
+            return df
+        folded = df
+        for dim in folded_dimension_values:
+            column = f"dimension_value_{dimensions.index(dim['dimension'])}"
+            folded = folded.assign(
+                **{
+                    column: folded[column]
+                    .astype(object)
+                    .where(folded[column].isin(dim["dim_values"]), cls.OTHER_DIMENSION_VALUE)
+                }
+            )
+        group_cols = [col for col in df.columns if col != "metric_value"]
+        return (
+            folded.groupby(group_cols, sort=False, dropna=False, observed=True)["metric_value"]
+            .sum()
+            .reset_index()[df.columns]
+        )
+
+    @staticmethod
+    def fillna_dimension_values(values: pd.Series) -> pd.Series:
+        """
+        Replaces missing dimension values with the text "None".  Dimension values are categorical
+         when retrieved (see arrow_to_dataframe), the category is added before filling.
+        """
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.cat.remove_unused_categories()
+            if values.isna().any() and "None" not in values.cat.categories:
+                values = values.cat.add_categories("None")
+        return values.fillna("None")
+
+    @staticmethod
+    def _label_dimensions(df: DataFrame, dimensions: list) -> DataFrame:
+        """Adds the 'dimension_n' columns and cleans the 'dimension_value_n' columns."""
         # Need to add indexing to the column indicating the dimension.
         i = 0
         result_df = DataFrame()
@@ -140,9 +511,267 @@ class MetricLookupManager:
             # Sometimes the dimension value was None and filtering was dropping it.  This resulted
             # assert checks failing (the contribution to change sum != 100, replacing with the text
             # "None" here so data is not lost.
-            df["dimension_value_" + str(i)] = df["dimension_value_" + str(i)].fillna("None")
+            df["dimension_value_" + str(i)] = MetricLookupManager.fillna_dimension_values(
+                df["dimension_value_" + str(i)]
+            )
             i += 1
 
         result_df = pd.concat([result_df, df])
         result_df = result_df.dropna(axis="rows")
         return result_df
+
+    @staticmethod
+    def _prefetch_key(
+        metric_name: str,
+        table_name: str,
+        app_name: str,
+        date_ranges: Dict[str, ProcessingDateRange],
+        dimensions: list,
+        excluded_dimensions: list = None,
+    ) -> tuple:
+        return (
+            metric_name,
+            table_name,
+            app_name,
+            tuple((timeframe, str(dr)) for timeframe, dr in date_ranges.items()),
+            tuple(dimensions),
+            repr(excluded_dimensions),
+        )
+
+    def prefetch_dimension_sets(
+        self,
+        metric_name: str,
+        table_name: str,
+        app_name: str,
+        date_ranges: Dict[str, ProcessingDateRange],
+        dimension_sets: List[tuple],
+        excluded_dimensions: list = None,
+    ):
+        """
+        Retrieves all the dimension sets with a single query (see
+        get_metric_by_dimension_sets_with_date_ranges).  Subsequent calls to
+        get_metric_by_dimensions_with_date_ranges with matching parameters are answered from the
+        prefetched results instead of issuing a query.
+        """
+        # Dimension sets already retrieved (e.g. by a shared scan) are not retrieved again.
+        dimension_sets = [
+            dim_set
+            for dim_set in dimension_sets
+            if self._prefetch_key(
+                metric_name, table_name, app_name, date_ranges, dim_set, excluded_dimensions
+            )
+            not in self._prefetched
+        ]
+        if not dimension_sets:
+            return
+
+        results = self.get_metric_by_dimension_sets_with_date_ranges(
+            metric_name=metric_name,
+            table_name=table_name,
+            app_name=app_name,
+            date_ranges=date_ranges,
+            dimension_sets=dimension_sets,
+            excluded_dimensions=excluded_dimensions,
+        )
+        self.add_prefetched(
+            metric_name, table_name, app_name, date_ranges, results, excluded_dimensions
+        )
+
+    def add_prefetched(
+        self,
+        metric_name: str,
+        table_name: str,
+        app_name: str,
+        date_ranges: Dict[str, ProcessingDateRange],
+        results: Dict[tuple, DataFrame],
+        excluded_dimensions: list = None,
+    ):
+        """
+        Answers the subsequent calls to get_metric_by_dimensions_with_date_ranges with matching
+        parameters from the results.
+        :param results: dict of dimension set to the values, as returned by
+         get_metric_by_dimension_sets_with_date_ranges.
+        """
+        for dim_set, df in results.items():
+            key = self._prefetch_key(
+                metric_name, table_name, app_name, date_ranges, dim_set, excluded_dimensions
+            )
+            self._prefetched[key] = df
+
+    def get_daily_metric_by_dimensions_with_date_ranges(
+        self,
+        metric_name: str,
+        table_name: str,
+        app_name: str,
+        date_ranges: Dict[str, ProcessingDateRange],
+        dimensions: list,
+        excluded_dimensions: list = None,
+    ) -> DataFrame:
+        """
+        Retrieves the daily metric grouped by all the dimensions for all the date ranges.  No
+        window average is applied, this is the input used to build a MetricCube.
+        :param date_ranges: dict of timeframe (e.g. "current", "baseline") to date range.
+        :return: Dataframe with columns ['submission_date', 'timeframe', <dimensions>,
+         'metric_value']
+        """
+        file = table_name + "_cube.sql"
+
+        render_kwargs = {
+            "metric": metric_name,
+            "app_name": app_name,
+            "dimensions": dimensions,
+            "exclude_dimension_values": excluded_dimensions,
+        } | self._date_range_render_kwargs(date_ranges)
+        query = self._render_sql(template_file=file, render_kwargs=render_kwargs)
+
+        df = self.run_query(
+            query=query,
+            metric=metric_name,
+            date_range=list(date_ranges.values())[0],
+        )
+        self._check_all_timeframes_found(df, metric_name, query, date_ranges)
+        return df
+
+    def get_metric_by_dimension_sets_with_date_ranges(
+        self,
+        metric_name: str,
+        table_name: str,
+        app_name: str,
+        date_ranges: Dict[str, ProcessingDateRange],
+        dimension_sets: List[tuple],
+        excluded_dimensions: list = None,
+    ) -> Dict[tuple, DataFrame]:
+        """
+        Retrieves the metric for every dimension set and every date range using a single
+        GROUPING SETS query.
+        :param date_ranges: dict of timeframe (e.g. "current", "baseline") to date range.
+        :param dimension_sets: list of tuples of dimensions (e.g. [("country",),
+         ("country", "os")]).
+        :return: dict of dimension set to a Dataframe with the same columns as returned by
+         get_metric_by_dimensions_with_date_ranges for that dimension set.
+        """
+        file = table_name + "_grouping_sets.sql"
+
+        # Every dimension referenced by any of the sets, in a stable order.
+        dimensions = list(dict.fromkeys(dim for dim_set in dimension_sets for dim in dim_set))
+        logger.info(f"processing dimension sets: {dimension_sets}")
+
+        render_kwargs = {
+            "metric": metric_name,
+            "app_name": app_name,
+            "dimensions": dimensions,
+            "dimension_sets": dimension_sets,
+            "exclude_dimension_values": excluded_dimensions,
+        } | self._date_range_render_kwargs(date_ranges)
+        query = self._render_sql(template_file=file, render_kwargs=render_kwargs)
+
+        df = self.run_query(
+            query=query,
+            metric=metric_name,
+            date_range=list(date_ranges.values())[0],
+        )
+        return self._split_dimension_sets(
+            df, dimensions, dimension_sets, metric_name, query, date_ranges
+        )
+
+    def _split_dimension_sets(
+        self,
+        df: DataFrame,
+        dimensions: list,
+        dimension_sets: List[tuple],
+        metric_name: str,
+        query: str,
+        date_ranges: Dict[str, ProcessingDateRange],
+    ) -> Dict[tuple, DataFrame]:
+        """
+        :param df: the result of a GROUPING SETS query, with the columns [<dimensions>,
+         'grouping_id', 'timeframe', 'metric_value'].
+        :return: dict of dimension set to its rows, see
+         get_metric_by_dimension_sets_with_date_ranges.
+        """
+        results = {}
+        for dim_set in dimension_sets:
+            # Bit n of grouping_id is set when dimensions[n] has been aggregated over.
+            grouping_id = sum(1 << i for i, dim in enumerate(dimensions) if dim not in dim_set)
+            set_df = df[df["grouping_id"] == grouping_id]
+            set_df = set_df[list(dim_set) + ["timeframe", "metric_value"]].rename(
+                columns={dim: f"dimension_value_{i}" for i, dim in enumerate(dim_set)}
+            )
+            self._check_all_timeframes_found(set_df, metric_name, query, date_ranges)
+            results[tuple(dim_set)] = self._label_dimensions(
+                set_df.reset_index(drop=True), list(dim_set)
+            )
+        return results
+
+    def get_metrics_by_dimension_sets_for_apps_with_date_ranges(
+        self,
+        metric_names: List[str],
+        table_name: str,
+        app_names: List[str],
+        date_ranges: Dict[str, ProcessingDateRange],
+        dimension_sets: List[tuple],
+        excluded_dimensions: list = None,
+    ) -> Dict[Tuple[str, str], Dict[tuple, DataFrame]]:
+        """
+        Retrieves every metric for every app, dimension set and date range using a single
+        GROUPING SETS query, the table is scanned once for all of them.
+        :param metric_names: the metrics, each is aggregated separately.
+        :param app_names: the apps, each is grouped separately.
+        :return: dict of (metric name, app name) to the values of the dimension sets as returned
+         by get_metric_by_dimension_sets_with_date_ranges.  The metrics and apps for which a date
+         range returned no data are left out.
+        """
+        file = table_name + "_shared_grouping_sets.sql"
+
+        dimensions = list(dict.fromkeys(dim for dim_set in dimension_sets for dim in dim_set))
+        logger.info(
+            f"processing dimension sets: {dimension_sets} for metrics: {metric_names} and apps:"
+            f" {app_names}"
+        )
+
+        render_kwargs = {
+            "metrics": metric_names,
+            "app_names": app_names,
+            "dimensions": dimensions,
+            "dimension_sets": dimension_sets,
+            "exclude_dimension_values": excluded_dimensions,
+        } | self._date_range_render_kwargs(date_ranges)
+        query = self._render_sql(template_file=file, render_kwargs=render_kwargs)
+
+        df = self.run_query(
+            query=query,
+            metric=", ".join(metric_names),
+            date_range=list(date_ranges.values())[0],
+        )
+
+        results = {}
+        for app_name, app_df in df.groupby("app_name", sort=False, observed=True):
+            for i, metric_name in enumerate(metric_names):
+                metric_df = app_df.drop(
+                    columns=[f"metric_value_{j}" for j in range(len(metric_names)) if j != i]
+                ).rename(columns={f"metric_value_{i}": "metric_value"})
+                try:
+                    results[(metric_name, app_name)] = self._split_dimension_sets(
+                        metric_df, dimensions, dimension_sets, metric_name, query, date_ranges
+                    )
+                except NoDataFoundForDateRangeError:
+                    logger.info(f"no data for {metric_name} and {app_name} in the shared scan")
+        return results
+
+    def get_metric_by_dimensions_with_date_range(
+        self,
+        metric_name: str,
+        table_name: str,
+        app_name: str,
+        date_range: ProcessingDateRange,
+        dimensions: list,  # indicates the permutation of the dimensions to evaluate.
+        excluded_dimensions: list = None,
+    ) -> DataFrame:
+        return self.get_metric_by_dimensions_with_date_ranges(
+            metric_name=metric_name,
+            table_name=table_name,
+            app_name=app_name,
+            date_ranges={self.SINGLE_TIMEFRAME: date_range},
+            dimensions=dimensions,
+            excluded_dimensions=excluded_dimensions,
+        ).drop(columns="timeframe")
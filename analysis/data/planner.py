@@ -0,0 +1,115 @@
+from typing import Dict, List, Tuple
+
+from pandas import DataFrame
+
+from analysis.configuration.configs import AnalysisProfile
+from analysis.configuration.processing_dates import ProcessingDateRange
+from analysis.data.metric import MetricLookupManager
+from analysis.logging import logger
+
+
+class SharedScanPlanner:
+    """
+    Retrieves the dimension sets of the profiles reading the same table for the same date ranges,
+    dimension sets and excluded dimension values with a single query, instead of one query per
+    profile.  Such profiles only differ in app and metric, the query returns every metric grouped
+    by app and each profile is handed its slice.
+    """
+
+    def __init__(self, metric_lookup: MetricLookupManager):
+        """
+        :param metric_lookup: runs the shared queries, its query cache and source are used by the
+         lookup managers handed to the profiles too.
+        """
+        self.metric_lookup = metric_lookup
+        # (metric name, app name, scan key) to the values of each dimension set.
+        self._results: Dict[tuple, Dict[tuple, DataFrame]] = {}
+
+    @staticmethod
+    def _scan_key(
+        profile: AnalysisProfile,
+        date_ranges: Dict[str, ProcessingDateRange],
+        dimension_sets: List[tuple],
+    ) -> tuple:
+        """:return: the profiles with the same key can be retrieved with a single query."""
+        return (
+            profile.dataset.table_name,
+            tuple((timeframe, str(dr)) for timeframe, dr in date_ranges.items()),
+            tuple(sorted(tuple(dim_set) for dim_set in dimension_sets)),
+            repr(profile.percent_change.exclude_dimension_values),
+        )
+
+    def plan(
+        self,
+        scans: List[Tuple[AnalysisProfile, Dict[str, ProcessingDateRange], List[tuple]]],
+    ) -> List[list]:
+        """
+        :param scans: (profile, date ranges, dimension sets) for each profile.
+        :return: the groups of scans sharing a query, scans that cannot be shared are left out.
+        """
+        groups = {}
+        for scan in scans:
+            groups.setdefault(self._scan_key(*scan), []).append(scan)
+        return [group for group in groups.values() if len(group) > 1]
+
+    def prefetch(
+        self,
+        scans: List[Tuple[AnalysisProfile, Dict[str, ProcessingDateRange], List[tuple]]],
+    ):
+        """
+        Runs one query per group of scans sharing a table, see plan.  When a shared query fails
+        the profiles of the group retrieve their values on their own.
+        :param scans: (profile, date ranges, dimension sets) for each profile.
+        """
+        for group in self.plan(scans):
+            profile, date_ranges, _ = group[0]
+            key = self._scan_key(*group[0])
+            lookup = self.metric_lookup
+            try:
+                results = lookup.get_metrics_by_dimension_sets_for_apps_with_date_ranges(
+                    metric_names=list(dict.fromkeys(p.dataset.metric_name for p, _, _ in group)),
+                    table_name=profile.dataset.table_name,
+                    app_names=list(dict.fromkeys(p.dataset.app_name for p, _, _ in group)),
+                    date_ranges=date_ranges,
+                    dimension_sets=list(key[2]),
+                    excluded_dimensions=profile.percent_change.exclude_dimension_values,
+                )
+            except Exception:
+                logger.warning(
+                    f"Shared scan failed for: {[p.name for p, _, _ in group]}", exc_info=1
+                )
+                continue
+
+            for (metric_name, app_name), values in results.items():
+                self._results[(metric_name, app_name, key)] = values
+
+    def get_metric_lookup(
+        self,
+        profile: AnalysisProfile,
+        date_ranges: Dict[str, ProcessingDateRange],
+        dimension_sets: List[tuple],
+    ) -> MetricLookupManager:
+        """
+        :return: a lookup manager for the profile, answering the dimension sets from the shared
+         scan when the profile was part of one.
+        """
+        metric_lookup = MetricLookupManager(
+            query_cache=self.metric_lookup.query_cache, source=self.metric_lookup.source
+        )
+        key = (
+            profile.dataset.metric_name,
+            profile.dataset.app_name,
+            self._scan_key(profile, date_ranges, dimension_sets),
+        )
+        # Kept for other profiles with the same metric and app, the lookups return copies.
+        values = self._results.get(key)
+        if values is not None:
+            metric_lookup.add_prefetched(
+                metric_name=profile.dataset.metric_name,
+                table_name=profile.dataset.table_name,
+                app_name=profile.dataset.app_name,
+                date_ranges=date_ranges,
+                results=values,
+                excluded_dimensions=profile.percent_change.exclude_dimension_values,
+            )
+        return metric_lookup
@@ -0,0 +1,144 @@
+import re
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from google.api_core.exceptions import Forbidden
+from pandas import DataFrame
+
+from analysis.data.clients import BigQueryClientRegistry, bigquery_clients
+from analysis.errors import BigQueryPermissionsError
+
+# String columns that are not dimension values, these are not dictionary encoded.
+PLAIN_STRING_COLUMNS = ["timeframe"]
+
+
+def arrow_to_dataframe(table: pa.Table) -> DataFrame:
+    """
+    Converts query results to a DataFrame with compact dtypes.  String columns (the dimension
+    values) are dictionary encoded so they arrive as categoricals instead of one Python object per
+    row, dates arrive as datetime64 and numeric columns keep their fixed width types.
+    """
+    columns = [
+        pc.dictionary_encode(column)
+        if (pa.types.is_string(column.type) or pa.types.is_large_string(column.type))
+        and name not in PLAIN_STRING_COLUMNS
+        else column
+        for name, column in zip(table.column_names, table.columns)
+    ]
+    table = pa.Table.from_arrays(columns, names=table.column_names)
+    return table.to_pandas(date_as_object=False)
+
+
+class MetricSource(ABC):
+    """Executes the rendered query templates and returns the results."""
+
+    # Identifies the source (and the data it reads) so cached results are not shared by sources.
+    name: str
+
+    @abstractmethod
+    def run_query(self, query: str, metric: str) -> DataFrame:
+        """
+        :return: the results, the sources reporting the bytes processed by the query set
+         attrs["total_bytes_processed"].
+        """
+
+
+class BigQuerySource(MetricSource):
+    name = "bigquery"
+
+    def __init__(self, use_bqstorage_api: bool = True, clients: BigQueryClientRegistry = None):
+        """
+        :param use_bqstorage_api: download results with the BigQuery Storage Read API, falls back
+         to the REST API if the API is not available.
+        :param clients: where the BigQuery client is taken from, defaults to the process wide
+         registry.
+        """
+        self.use_bqstorage_api = use_bqstorage_api
+        self.clients = clients or bigquery_clients
+
+    def run_query(self, query: str, metric: str) -> DataFrame:
+        bq_client = self.clients.get()
+        # TODO GLE wait for complete
+        query_job = bq_client.query(query)
+        try:
+            table = query_job.to_arrow(create_bqstorage_client=self.use_bqstorage_api)
+            df = arrow_to_dataframe(table)
+            df.attrs["total_bytes_processed"] = query_job.total_bytes_processed
+            return df
+        except Forbidden as e:
+            raise BigQueryPermissionsError(metric=metric, query=query, msg=e.message)
+
+
+class DuckDBSource(MetricSource):
+    """
+    Executes the same query templates against local Parquet files using DuckDB, so the analysis can
+    run without access to BigQuery (e.g. load testing and profiling).
+
+    The templates are written for BigQuery and are transpiled with sqlglot.  Each table referenced
+    by a template (e.g. `moz-fx-data-shared-prod.telemetry.active_users_aggregates`) is read from
+    `<data_dir>/<table reference>.parquet`, or from all the Parquet files in the directory
+    `<data_dir>/<table reference>/` for partitioned data.
+
+    Requires the optional `local` dependencies (`pip install -e ".[local]"`).
+    """
+
+    TABLE_REFERENCE = re.compile(r"`([^`]+)`")
+
+    def __init__(self, data_dir: str):
+        try:
+            import duckdb
+            import sqlglot
+        except ImportError as e:
+            raise ImportError(
+                "DuckDBSource requires duckdb and sqlglot, install with: pip install -e '.[local]'"
+            ) from e
+
+        self._sqlglot = sqlglot
+        self.data_dir = Path(data_dir)
+        self.name = f"duckdb:{self.data_dir.resolve()}"
+        self._connection = duckdb.connect()
+        self._lock = threading.Lock()
+
+    def _table_view(self, table_reference: str) -> str:
+        """Creates (once) a view reading the Parquet file(s) for the table, returns its name."""
+        view = re.sub(r"\W", "_", table_reference)
+        path = self.data_dir / (table_reference + ".parquet")
+        if not path.exists():
+            path = self.data_dir / table_reference / "*.parquet"
+        with self._lock:
+            self._connection.execute(
+                f"CREATE VIEW IF NOT EXISTS {view} AS SELECT * FROM read_parquet('{path}')"
+            )
+        return view
+
+    def run_query(self, query: str, metric: str) -> DataFrame:
+        query = self.TABLE_REFERENCE.sub(lambda m: self._table_view(m.group(1)), query)
+        duckdb_query = self._sqlglot.transpile(query, read="bigquery", write="duckdb")[0]
+        # A cursor is a separate connection to the same database, one is used per query so that
+        # queries can be executed from multiple threads.
+        with self._lock:
+            cursor = self._connection.cursor()
+        result = cursor.execute(duckdb_query).arrow()
+        # Depending on the duckdb version either a Table or a RecordBatchReader is returned.
+        if isinstance(result, pa.RecordBatchReader):
+            result = result.read_all()
+        return arrow_to_dataframe(result.rename_columns(self._unique_names(result.column_names)))
+
+    @staticmethod
+    def _unique_names(names: list) -> list:
+        """
+        BigQuery makes repeated result column names unique by adding a suffix (e.g. the
+        `dimension_value` columns of the multi dimension queries are returned as `dimension_value`
+        and `dimension_value_1`), DuckDB keeps the repeated names.
+        """
+        unique_names = []
+        for name in names:
+            unique_name, i = name, 0
+            while unique_name in unique_names:
+                i += 1
+                unique_name = f"{name}_{i}"
+            unique_names.append(unique_name)
+        return unique_names
@@ -1,26 +1,40 @@
 -- Note that for this query the returned column name must be metric_value for downstream processing
+-- All date ranges are scanned in one pass, each row is labelled with the timeframe of the date
+-- range it falls into (a row may belong to more than one date range if the ranges overlap).
 SELECT
     {{ full_dim_value_spec}},
+    timeframe,
     window_average AS metric_value
 FROM (
     SELECT
         *,
         AVG(metric_value) OVER (
-        PARTITION BY {{ full_dim_spec }} ORDER BY submission_date
+        PARTITION BY timeframe, {{ full_dim_spec }} ORDER BY submission_date
         ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) AS window_average
     FROM (
         SELECT
             submission_date,
-            {{ full_dim_spec }},
+            r.timeframe,
+            r.period_end_date,
+            {{ full_dim_select_spec }},
             SUM({{metric}}) AS metric_value
         FROM
             `moz-fx-data-shared-prod.telemetry.active_users_aggregates` a,
-            `mozdata.static.country_codes_v1` c
+            UNNEST([
+                {% for date_range in date_ranges -%}
+                STRUCT(
+                    "{{ date_range.timeframe }}" AS timeframe,
+                    DATE "{{ date_range.start_date }}" AS period_start_date,
+                    DATE "{{ date_range.end_date }}" AS period_end_date
+                ){{ "," if not loop.last }}
+                {% endfor -%}
+            ]) r
         WHERE
             submission_date >= '{{ start_date }}'
             AND submission_date < '{{ end_date }}'
+            AND submission_date >= r.period_start_date
+            AND submission_date < r.period_end_date
             AND app_name = "{{app_name}}"
-            AND a.country = c.code
             {% if exclude_dimension_values %}
                 {% for dim in exclude_dimension_values -%}
                 AND {{dim.dimension}} NOT IN (
@@ -28,12 +42,24 @@ FROM (
                 )
                 {%- endfor %}
               {% endif %}
+            {% if included_dimension_values %}
+                {% for dim in included_dimension_values -%}
+                AND ({{dim.dimension}} IN (
+                    {{ '\"' + dim.dim_values|join('\", \"') + '\"' }}
+                )
+                {#- NULL values are labelled "None" once retrieved, IN never matches them. #}
+                {%- if "None" in dim.dim_values %} OR {{dim.dimension}} IS NULL{% endif %})
+                {%- endfor %}
+              {% endif %}
         GROUP BY
             submission_date,
-            {{full_dim_spec}}
+            r.timeframe,
+            r.period_end_date,
+            {{ full_dim_group_spec }}
     ) AS t1
     ORDER BY
+        timeframe,
         {{full_dim_spec}},
         submission_date
 )
-where  submission_date = DATE_SUB(DATE "{{end_date}}", INTERVAL 1 DAY)
+where  submission_date = DATE_SUB(period_end_date, INTERVAL 1 DAY)
@@ -0,0 +1,36 @@
+-- Note that for this query the returned column name must be metric_value for downstream processing
+-- Returns the daily metric at the finest grain of all the dimensions (no window average applied),
+-- the rollups to coarser dimension sets and the window average are calculated by MetricCube.
+SELECT
+    submission_date,
+    r.timeframe,
+    {{ dimensions|join(", ") }},
+    SUM({{metric}}) AS metric_value
+FROM
+    `moz-fx-data-shared-prod.telemetry.active_users_aggregates` a,
+    UNNEST([
+        {% for date_range in date_ranges -%}
+        STRUCT(
+            "{{ date_range.timeframe }}" AS timeframe,
+            DATE "{{ date_range.start_date }}" AS period_start_date,
+            DATE "{{ date_range.end_date }}" AS period_end_date
+        ){{ "," if not loop.last }}
+        {% endfor -%}
+    ]) r
+WHERE
+    submission_date >= '{{ start_date }}'
+    AND submission_date < '{{ end_date }}'
+    AND submission_date >= r.period_start_date
+    AND submission_date < r.period_end_date
+    AND app_name = "{{app_name}}"
+    {% if exclude_dimension_values %}
+        {% for dim in exclude_dimension_values -%}
+        AND {{dim.dimension}} NOT IN (
+            {{ '\"' + dim.dim_values|join('\", \"') + '\"' }}
+        )
+        {%- endfor %}
+      {% endif %}
+GROUP BY
+    submission_date,
+    r.timeframe,
+    {{ dimensions|join(", ") }}
@@ -1,25 +1,43 @@
 -- Note that for this query the returned column name must be metric_value for downstream processing
-SELECT window_average AS metric_value from (
+-- All date ranges are scanned in one pass, each row is labelled with the timeframe of the date
+-- range it falls into (a row may belong to more than one date range if the ranges overlap).
+SELECT timeframe, window_average AS metric_value from (
     SELECT
         *,
-        AVG(metric_value) OVER (ORDER BY submission_date
+        AVG(metric_value) OVER (PARTITION BY timeframe ORDER BY submission_date
         ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) AS window_average
     FROM (
         SELECT
             submission_date,
+            r.timeframe,
+            r.period_end_date,
             app_name,
             SUM({{ metric }}) AS metric_value
         FROM
-            `moz-fx-data-shared-prod.telemetry.active_users_aggregates` a
+            `moz-fx-data-shared-prod.telemetry.active_users_aggregates` a,
+            UNNEST([
+                {% for date_range in date_ranges -%}
+                STRUCT(
+                    "{{ date_range.timeframe }}" AS timeframe,
+                    DATE "{{ date_range.start_date }}" AS period_start_date,
+                    DATE "{{ date_range.end_date }}" AS period_end_date
+                ){{ "," if not loop.last }}
+                {% endfor -%}
+            ]) r
         WHERE
             submission_date >= '{{ start_date }}'
             AND submission_date < '{{ end_date }}'
+            AND submission_date >= r.period_start_date
+            AND submission_date < r.period_end_date
             AND app_name="{{ app_name }}"
         GROUP BY
             submission_date,
+            r.timeframe,
+            r.period_end_date,
             app_name
     ) AS t1
     ORDER BY
+    timeframe,
     submission_date
 )
-where  submission_date = DATE_SUB(DATE "{{end_date}}", INTERVAL 1 DAY)
+where  submission_date = DATE_SUB(period_end_date, INTERVAL 1 DAY)
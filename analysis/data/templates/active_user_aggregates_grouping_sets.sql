@@ -0,0 +1,59 @@
+-- Note that for this query the returned column name must be metric_value for downstream processing
+-- Every dimension set is aggregated for all date ranges in a single scan using GROUPING SETS.
+-- 'grouping_id' has bit n set when dimensions[n] is not part of the dimension set for the row, this
+-- distinguishes a NULL dimension value from a dimension that has been aggregated over.
+SELECT
+    {{ dimensions|join(", ") }},
+    grouping_id,
+    timeframe,
+    window_average AS metric_value
+FROM (
+    SELECT
+        *,
+        AVG(metric_value) OVER (
+        PARTITION BY grouping_id, timeframe, {{ dimensions|join(", ") }} ORDER BY submission_date
+        ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) AS window_average
+    FROM (
+        SELECT
+            submission_date,
+            r.timeframe,
+            r.period_end_date,
+            {{ dimensions|join(", ") }},
+            {% for dim in dimensions -%}
+            (GROUPING({{ dim }}) << {{ loop.index0 }}){{ " +" if not loop.last }}
+            {% endfor -%}
+            AS grouping_id,
+            SUM({{metric}}) AS metric_value
+        FROM
+            `moz-fx-data-shared-prod.telemetry.active_users_aggregates` a,
+            UNNEST([
+                {% for date_range in date_ranges -%}
+                STRUCT(
+                    "{{ date_range.timeframe }}" AS timeframe,
+                    DATE "{{ date_range.start_date }}" AS period_start_date,
+                    DATE "{{ date_range.end_date }}" AS period_end_date
+                ){{ "," if not loop.last }}
+                {% endfor -%}
+            ]) r
+        WHERE
+            submission_date >= '{{ start_date }}'
+            AND submission_date < '{{ end_date }}'
+            AND submission_date >= r.period_start_date
+            AND submission_date < r.period_end_date
+            AND app_name = "{{app_name}}"
+            {% if exclude_dimension_values %}
+                {% for dim in exclude_dimension_values -%}
+                AND {{dim.dimension}} NOT IN (
+                    {{ '\"' + dim.dim_values|join('\", \"') + '\"' }}
+                )
+                {%- endfor %}
+              {% endif %}
+        GROUP BY GROUPING SETS (
+            {% for dimension_set in dimension_sets -%}
+            (submission_date, r.timeframe, r.period_end_date, {{ dimension_set|join(", ") }})
+            {{- "," if not loop.last }}
+            {% endfor -%}
+        )
+    ) AS t1
+)
+where  submission_date = DATE_SUB(period_end_date, INTERVAL 1 DAY)
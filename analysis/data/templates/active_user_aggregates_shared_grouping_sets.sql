@@ -0,0 +1,70 @@
+-- Note that for this query the returned column names must be app_name and metric_value_n, one per
+-- metric in metrics, for downstream processing.
+-- The same GROUPING SETS query as active_user_aggregates_grouping_sets.sql for several apps and
+-- metrics in a single scan: every grouping set is also grouped by app_name and every metric is
+-- aggregated in its own column.  'grouping_id' only covers the dimensions, app_name is never
+-- aggregated over.
+SELECT
+    app_name,
+    {{ dimensions|join(", ") }},
+    grouping_id,
+    timeframe,
+    {% for metric in metrics -%}
+    window_average_{{ loop.index0 }} AS metric_value_{{ loop.index0 }}{{ "," if not loop.last }}
+    {% endfor -%}
+FROM (
+    SELECT
+        *,
+        {% for metric in metrics -%}
+        AVG(metric_value_{{ loop.index0 }}) OVER (
+        PARTITION BY app_name, grouping_id, timeframe, {{ dimensions|join(", ") }}
+        ORDER BY submission_date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW
+        ) AS window_average_{{ loop.index0 }}{{ "," if not loop.last }}
+        {% endfor -%}
+    FROM (
+        SELECT
+            submission_date,
+            r.timeframe,
+            r.period_end_date,
+            app_name,
+            {{ dimensions|join(", ") }},
+            {% for dim in dimensions -%}
+            (GROUPING({{ dim }}) << {{ loop.index0 }}){{ " +" if not loop.last }}
+            {% endfor -%}
+            AS grouping_id,
+            {% for metric in metrics -%}
+            SUM({{ metric }}) AS metric_value_{{ loop.index0 }}{{ "," if not loop.last }}
+            {% endfor -%}
+        FROM
+            `moz-fx-data-shared-prod.telemetry.active_users_aggregates` a,
+            UNNEST([
+                {% for date_range in date_ranges -%}
+                STRUCT(
+                    "{{ date_range.timeframe }}" AS timeframe,
+                    DATE "{{ date_range.start_date }}" AS period_start_date,
+                    DATE "{{ date_range.end_date }}" AS period_end_date
+                ){{ "," if not loop.last }}
+                {% endfor -%}
+            ]) r
+        WHERE
+            submission_date >= '{{ start_date }}'
+            AND submission_date < '{{ end_date }}'
+            AND submission_date >= r.period_start_date
+            AND submission_date < r.period_end_date
+            AND app_name IN ({{ '\"' + app_names|join('\", \"') + '\"' }})
+            {% if exclude_dimension_values %}
+                {% for dim in exclude_dimension_values -%}
+                AND {{dim.dimension}} NOT IN (
+                    {{ '\"' + dim.dim_values|join('\", \"') + '\"' }}
+                )
+                {%- endfor %}
+              {% endif %}
+        GROUP BY GROUPING SETS (
+            {% for dimension_set in dimension_sets -%}
+            (submission_date, r.timeframe, r.period_end_date, app_name, {{ dimension_set|join(", ") }})
+            {{- "," if not loop.last }}
+            {% endfor -%}
+        )
+    ) AS t1
+)
+where  submission_date = DATE_SUB(period_end_date, INTERVAL 1 DAY)
@@ -0,0 +1,96 @@
+-- Note that for this query the returned column names must be metric_value (all rows),
+-- metric_value_dimension_values_excluded (rows without the excluded dimension values) and
+-- metric_value_dimension_values_only (rows with one of the excluded dimension values) for downstream
+-- processing.  All the totals are computed in one scan using conditional aggregation, a total is
+-- NULL for a day without matching rows.  rows_dimension_values_excluded and
+-- rows_dimension_values_only count the rows matched on the last day of each date range, a separate
+-- query for the variant would return no row for a date range without any.
+-- All date ranges are scanned in one pass, each row is labelled with the timeframe of the date
+-- range it falls into (a row may belong to more than one date range if the ranges overlap).
+SELECT
+    timeframe,
+    {% if exclude_dimension_values -%}
+    window_average_dimension_values_excluded AS metric_value_dimension_values_excluded,
+    window_average_dimension_values_only AS metric_value_dimension_values_only,
+    rows_dimension_values_excluded,
+    rows_dimension_values_only,
+    {% endif -%}
+    window_average AS metric_value
+FROM (
+    SELECT
+        *,
+        {% if exclude_dimension_values -%}
+        AVG(metric_value_dimension_values_excluded) OVER (PARTITION BY timeframe
+        ORDER BY submission_date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW
+        ) AS window_average_dimension_values_excluded,
+        AVG(metric_value_dimension_values_only) OVER (PARTITION BY timeframe
+        ORDER BY submission_date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW
+        ) AS window_average_dimension_values_only,
+        {% endif -%}
+        AVG(metric_value) OVER (PARTITION BY timeframe ORDER BY submission_date
+        ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) AS window_average
+    FROM (
+        SELECT
+            submission_date,
+            r.timeframe,
+            r.period_end_date,
+            app_name,
+            {% if exclude_dimension_values -%}
+            SUM(IF(
+                {% for dim in exclude_dimension_values -%}
+                {{ "AND " if not loop.first }}{{dim.dimension}} NOT IN (
+                    {{ '\"' + dim.dim_values|join('\", \"') + '\"' }}
+                )
+                {% endfor -%}
+                , {{ metric }}, NULL)) AS metric_value_dimension_values_excluded,
+            COUNTIF(
+                {% for dim in exclude_dimension_values -%}
+                {{ "AND " if not loop.first }}{{dim.dimension}} NOT IN (
+                    {{ '\"' + dim.dim_values|join('\", \"') + '\"' }}
+                )
+                {% endfor -%}
+            ) AS rows_dimension_values_excluded,
+            SUM(IF(
+                {% for dim in exclude_dimension_values -%}
+                {{ "OR " if not loop.first }}{{dim.dimension}} IN (
+                    {{ '\"' + dim.dim_values|join('\", \"') + '\"' }}
+                )
+                {% endfor -%}
+                , {{ metric }}, NULL)) AS metric_value_dimension_values_only,
+            COUNTIF(
+                {% for dim in exclude_dimension_values -%}
+                {{ "OR " if not loop.first }}{{dim.dimension}} IN (
+                    {{ '\"' + dim.dim_values|join('\", \"') + '\"' }}
+                )
+                {% endfor -%}
+            ) AS rows_dimension_values_only,
+            {% endif -%}
+            SUM({{ metric }}) AS metric_value
+        FROM
+            `moz-fx-data-shared-prod.telemetry.active_users_aggregates` a,
+            UNNEST([
+                {% for date_range in date_ranges -%}
+                STRUCT(
+                    "{{ date_range.timeframe }}" AS timeframe,
+                    DATE "{{ date_range.start_date }}" AS period_start_date,
+                    DATE "{{ date_range.end_date }}" AS period_end_date
+                ){{ "," if not loop.last }}
+                {% endfor -%}
+            ]) r
+        WHERE
+            submission_date >= '{{ start_date }}'
+            AND submission_date < '{{ end_date }}'
+            AND submission_date >= r.period_start_date
+            AND submission_date < r.period_end_date
+            AND app_name="{{ app_name }}"
+        GROUP BY
+            submission_date,
+            r.timeframe,
+            r.period_end_date,
+            app_name
+    ) AS t1
+    ORDER BY
+    timeframe,
+    submission_date
+)
+where  submission_date = DATE_SUB(period_end_date, INTERVAL 1 DAY)
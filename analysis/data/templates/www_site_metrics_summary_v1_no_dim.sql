@@ -1,22 +1,41 @@
 -- Note that for this query the returned column name must be metric_value for downstream processing
-SELECT window_average AS metric_value from (
+-- All date ranges are scanned in one pass, each row is labelled with the timeframe of the date
+-- range it falls into (a row may belong to more than one date range if the ranges overlap).
+SELECT timeframe, window_average AS metric_value from (
     SELECT
         *,
-        AVG(metric_value) OVER (ORDER BY submission_date
+        AVG(metric_value) OVER (PARTITION BY timeframe ORDER BY submission_date
         ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) AS window_average
     FROM (
         SELECT
             date as submission_date,
+            r.timeframe,
+            r.period_end_date,
             sum({{ metric }}) AS metric_value
         FROM
-            `moz-fx-data-marketing-prod.ga_derived.www_site_metrics_summary_v1`
+            `moz-fx-data-marketing-prod.ga_derived.www_site_metrics_summary_v1`,
+            UNNEST([
+                {% for date_range in date_ranges -%}
+                STRUCT(
+                    "{{ date_range.timeframe }}" AS timeframe,
+                    DATE "{{ date_range.start_date }}" AS period_start_date,
+                    DATE "{{ date_range.end_date }}" AS period_end_date
+                ){{ "," if not loop.last }}
+                {% endfor -%}
+            ]) r
         WHERE
             date >= '{{ start_date }}'
             AND date < '{{ end_date }}'
-        GROUP BY date
+            AND date >= r.period_start_date
+            AND date < r.period_end_date
+        GROUP BY
+            date,
+            r.timeframe,
+            r.period_end_date
         ORDER BY date desc
     ) AS t1
     ORDER BY
+    timeframe,
     submission_date
 )
-where  submission_date = DATE_SUB(DATE "{{end_date}}", INTERVAL 1 DAY)
+where  submission_date = DATE_SUB(period_end_date, INTERVAL 1 DAY)
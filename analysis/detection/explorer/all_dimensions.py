@@ -1,4 +1,6 @@
 import pandas as pd
+from pandas import DataFrame
+
 from analysis.detection.explorer.dimension_evaluator import DimensionEvaluator
 from analysis.configuration.configs import AnalysisProfile
 
@@ -14,35 +16,48 @@ class AllDimensionEvaluator(DimensionEvaluator):
         self.one_dim_evaluation = (one_dim_evaluation,)
         self.multi_dim_evaluation = (multi_dim_evaluation,)
 
-    def evaluate(self) -> dict:
-
-        all_dim_df = pd.DataFrame()
-
-        for dimension, df in self.one_dim_evaluation[0]["dimension_calc"].items():
-
-            df["dimension"] = df["dimension_0"]
-            df["dimension_value"] = df["dimension_value_0"]
-            all_dim_df = pd.concat([all_dim_df, df])
-            all_dim_df.drop(columns=["dimension_0", "dimension_value_0"], inplace=True)
-
-        for dimension, df in self.multi_dim_evaluation[0]["multi_dimension_calc"].items():
-
-            dimension_cols = DimensionEvaluator.dimension_cols(df)
-            df["dimension"] = df[dimension_cols].apply(
-                lambda row: " | ".join(row.values.astype(str)), axis=1
-            )
-
-            dimension_value_cols = DimensionEvaluator.dimension_value_cols(df)
-            df["dimension_value"] = df[dimension_value_cols].apply(
-                lambda row: " | ".join(row.values.astype(str)), axis=1
-            )
+    @staticmethod
+    def _join_columns(df: DataFrame, columns: list) -> pd.Series:
+        """
+        :return: the values of the columns joined with " | " (e.g. "country | channel"), a column at
+         a time rather than a row at a time.
+        """
+        labels = df[columns[0]].astype(str)
+        if len(columns) > 1:
+            labels = labels.str.cat([df[col].astype(str) for col in columns[1:]], sep=" | ")
+        return labels
+
+    @classmethod
+    def _with_labels(cls, df: DataFrame) -> DataFrame:
+        """
+        :return: df
+            a copy of the results with the 'dimension_n' and 'dimension_value_n' columns replaced
+            by a 'dimension' and a 'dimension_value' column.
+        """
+        dimension_cols = cls.dimension_cols(df)
+        dimension_value_cols = cls.dimension_value_cols(df)
+        return df.drop(columns=dimension_cols + dimension_value_cols).assign(
+            dimension=cls._join_columns(df, dimension_cols),
+            dimension_value=cls._join_columns(df, dimension_value_cols),
+        )
 
-            all_dim_df = pd.concat(
-                [all_dim_df, df.drop(columns=dimension_cols + dimension_value_cols)]
-            )
-
-        all_dim_df.sort_values(by="change_distance", ascending=False, inplace=True)
+    def evaluate(self) -> dict:
+        # Every frame is reshaped first and concatenated once, concatenating inside the loop
+        # copies the rows gathered so far for every frame.
+        frames = [
+            self._with_labels(df)
+            for df in list(self.one_dim_evaluation[0]["dimension_calc"].values())
+            + list(self.multi_dim_evaluation[0]["multi_dimension_calc"].values())
+        ]
+        all_dim_df = pd.concat(frames) if frames else pd.DataFrame()
+
+        if all_dim_df.empty:
+            return {"overall_change_calc": all_dim_df}
 
         # TODO: returning only top 5 results for now.
         #  Perhaps this could be configurable in the future.
-        return {"overall_change_calc": all_dim_df.head(self.profile.percent_change.limit_results)}
+        return {
+            "overall_change_calc": self._largest(
+                all_dim_df, "change_distance", self.profile.percent_change.limit_results
+            )
+        }
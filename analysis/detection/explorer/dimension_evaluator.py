@@ -1,11 +1,67 @@
-import math
+import contextvars
+import multiprocessing
 from abc import ABC, abstractmethod
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, Tuple, Union
 
 import numpy as np
-import pandas as pd
+import pyarrow as pa
 from pandas import DataFrame
 
-from analysis.logging import logger
+from analysis.logging import log_to_queue, logger, profile_context, profile_name, queue_listener
+
+
+def _to_ipc(df: DataFrame) -> bytes:
+    """Serializes the DataFrame as an Arrow IPC stream to hand it to or from a worker process."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _from_ipc(data: bytes) -> DataFrame:
+    return pa.ipc.open_stream(data).read_all().to_pandas()
+
+
+def _init_worker(log_queue, log_level: int):
+    log_to_queue(log_queue, log_level)
+
+
+def _evaluate_in_worker(
+    evaluator_class: type, evaluator_kwargs: dict, profile: Optional[str], values: bytes
+) -> bytes:
+    # The pool is shared by all the evaluators of a run, so the evaluator is created for each
+    # dimension set, only with the state needed by _evaluate_values.
+    with profile_context(profile):
+        evaluator = evaluator_class(**evaluator_kwargs)
+        return _to_ipc(evaluator._evaluate_values(_from_ipc(values)))
+
+
+@contextmanager
+def worker_pool(workers: int) -> Iterator[Optional[Executor]]:
+    """
+    Creates the worker processes the dimension sets are evaluated in, once per run and shared by
+    all its evaluators.  The workers log through this process, see log_to_queue.
+    :param workers: the number of processes, 1 evaluates the dimension sets in this process.
+    :return: the pool of worker processes, None when the dimension sets are evaluated in this
+     process.
+    """
+    if workers <= 1:
+        yield None
+        return
+
+    # Spawned rather than forked, the queries may be running in threads of this process.
+    context = multiprocessing.get_context("spawn")
+    log_queue = context.Queue()
+    with queue_listener(log_queue), ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(log_queue, logger.getEffectiveLevel()),
+    ) as executor:
+        yield executor
 
 
 class DimensionEvaluator(ABC):
@@ -40,68 +96,42 @@ class DimensionEvaluator(ABC):
         return [col for col in df.columns if "dimension_" in col and "dimension_value_" not in col]
 
     @staticmethod
-    def _calculate_percent_change(df: DataFrame) -> DataFrame:
+    def _largest(
+        df: DataFrame, columns: Union[str, list], n: int, key: Callable = None
+    ) -> DataFrame:
         """
+        Selects the rows with the largest values without sorting all the rows, only the rows that
+        can be in the top n (found with a partition of the first column in linear time) are sorted.
         :param df:
-            Expected columns are ['dimension_value_n', 'metric_value', 'dimension_n', 'timeframe']
-            - multiple 'dimension_value_n' columns contain the dimension values (e.g. 'ca').  The
-             'n' is an integer index to account for multi dimensional processing.
-            - 'metric_value' column contains the measure.
-            - multiple 'dimension_n' column contains one value, the name of the dimension (e.g.
-             'country'). The 'n' is an integer index to account for multi dimensional processing.
-            - 'timeframe' column values are either "current" or "baseline".
+        :param columns: the column, or list of columns, to rank the rows by.
+        :param n: the number of rows to return.
+        :param key: applied to each column before ranking, like the `key` of `sort_values`.
         :return: df
-            Columns are ['dimension_value_n', 'percent_change', 'dimension_n']
-            - multiple 'dimension_value_n' columns contain the dimension values (e.g. 'ca') provided
-             in input. Multiple dimension_value columns with numeric indicators may be present if
-              the calculation is completed for multiple dimensions.
-            - 'percent_change' contains the percent change from the baseline value to to current
-             value for each dimension_value
-            - 'dimension_n' columns contain the dimension name (e.g. country). Multiple dimension
-             columns with numeric indicators may be present if the calculation is completed for
-              multiple dimensions.
+            the same rows as
+            `df.sort_values(columns, key=key, ascending=False, kind="stable").head(n)`, rows with
+            equal values keep their order in `df` and NaN values are last.
         """
-        # Find the columns that contain dimension values so they can be set as the index.
-        dimension_value_cols = DimensionEvaluator.dimension_value_cols(df)
-
-        # TODO GLE sorting df to have baseline before current, hacky.
-        prepared_df = (
-            df.set_index(["timeframe"] + dimension_value_cols)["metric_value"]
-            .unstack(dimension_value_cols)
-            .sort_index()
-        )
-        # calc percent change and drop unneeded index, replace and drop np.inf values.
-        # TODO GLE PerformanceWarning: dropping on a non-lexsorted multi-index without a level
-        #  parameter may impact performance.
-        pct_change_df = (
-            prepared_df.pct_change()
-            .dropna(how="all")
-            .reset_index()
-            .drop(columns="timeframe")
-            .replace([np.inf, -np.inf], np.nan)
-            .dropna(axis="columns")
-        )
-        output = pct_change_df.T
-        output.columns = ["percent_change"]
-        # pull dimension value out of index
-        output = output.reset_index()
-
-        # Convert to percent from decimal
-        output["percent_change"] = output["percent_change"].multiply(100)
-        output = output.sort_values(
-            by="percent_change", key=abs, ascending=False, ignore_index=True
-        ).round(4)
-
-        # Carry the dimension label through by getting the columns that contain the dimension names.
-        dimension_cols = DimensionEvaluator.dimension_cols(df)
-        for col in dimension_cols:
-            output[col] = df[col].values[0]
-        return output
-
-    @staticmethod
-    def _calculate_diff(df: DataFrame) -> DataFrame:
+        if n <= 0:
+            return df.iloc[:0]
+        columns = [columns] if isinstance(columns, str) else list(columns)
+        values = [
+            -(df[col] if key is None else key(df[col])).to_numpy(dtype=float) for col in columns
+        ]
+        first = values[0]
+        if n < len(first):
+            filled = np.where(np.isnan(first), np.inf, first)
+            nth = np.partition(filled, n - 1)[n - 1]
+            candidates = np.flatnonzero(filled <= nth)
+        else:
+            candidates = np.arange(len(first))
+        # lexsort is stable and sorts by the last key first.
+        order = candidates[np.lexsort([value[candidates] for value in reversed(values)])]
+        return df.iloc[order[:n]]
+
+    def _calculate_metrics(self, values: DataFrame) -> DataFrame:
         """
-        :param df:
+        Calculates all the metrics for the dimension values with a single pivot of the values.
+        :param values:
             Expected columns are ['dimension_value_n', 'metric_value', 'dimension_n', 'timeframe']
             - multiple 'dimension_value_n' columns contain the dimension values (e.g. 'ca').  The
              'n' is an integer index to account for multi dimensional processing.
@@ -110,51 +140,71 @@ class DimensionEvaluator(ABC):
              'country'). The 'n' is an integer index to account for multi dimensional processing.
             - 'timeframe' column values are either "current" or "baseline".
         :return: df
-            Columns are ['dimension_value_n', 'diff', 'dimension_n']
-            - multiple 'dimension_value_n' columns contain the dimension values (e.g. 'ca') provided
-             in input. Multiple dimension_value columns with numeric indicators may be present if
-              the calculation is completed for multiple dimensions.
-            - 'percent_change' contains the percent change from the baseline value to to current
-             value for each dimension_value
-            - 'dimension_n' columns contain the dimension name (e.g. country). Multiple dimension
-             columns with numeric indicators may be present if the calculation is completed for
-              multiple dimensions.
+            Columns are ['index', 'dimension_n', 'dimension_value_n', 'baseline', 'current',
+             'percent_change', 'diff', 'contrib_to_overall_change', 'change_in_proportion',
+             'change_distance']
+            - one row for each dimension value with both a current and a non zero baseline value,
+             ordered by the dimension values.  'index' is the position of the row.
+            - 'baseline' and 'current' contain the metric values truncated to integers.
         """
-        # Find the columns that contain dimension values so they can be set as the index.
-        dimension_value_cols = DimensionEvaluator.dimension_value_cols(df)
-
-        # TODO GLE sorting df to have baseline before current, hacky.
-        prepared_df = (
-            df.set_index(["timeframe"] + dimension_value_cols)["metric_value"]
-            .unstack(dimension_value_cols)
-            .sort_index()
-        )
-        # calc percent change and drop unneeded index, replace and drop np.inf values.
-        # TODO GLE PerformanceWarning: dropping on a non-lexsorted multi-index without a level
-        #  parameter may impact performance.
-        diff_df = (
-            prepared_df.diff()
-            .dropna(how="all")
-            .reset_index()
-            .drop(columns="timeframe")
-            .replace([np.inf, -np.inf], np.nan)
-            .dropna(axis="columns")
+        dimension_value_cols = DimensionEvaluator.dimension_value_cols(values)
+        dimension_cols = DimensionEvaluator.dimension_cols(values)
+
+        pivoted = (
+            values.set_index(dimension_cols + dimension_value_cols + ["timeframe"])["metric_value"]
+            .unstack("timeframe")
+            .reindex(columns=["baseline", "current"])
         )
-        output = diff_df.T
-        output.columns = ["diff"]
-        # pull dimension value out of index
-        output = output.reset_index()
+        baseline = pivoted["baseline"].to_numpy(dtype="float64")
+        current = pivoted["current"].to_numpy(dtype="float64")
 
-        output = output.sort_values(by="diff", key=abs, ascending=False, ignore_index=True)
+        parent_df_as_cols = self.parent_df.astype({"metric_value": "int64"}).pivot_table(
+            columns=["timeframe"], values="metric_value"
+        )
+        # A dimension value missing from one of the timeframes has a metric value of 0 for the
+        # contribution to overall change and change in proportion.
+        all_values = {
+            "baseline": np.nan_to_num(baseline, nan=0),
+            "current": np.nan_to_num(current, nan=0),
+            "parent_baseline": parent_df_as_cols["baseline"][0],
+            "parent_current": parent_df_as_cols["current"][0],
+        }
+        contrib_to_overall_change = np.round(self._contribution_to_overall_change(all_values), 4)
+        # Rounded to 8 places, the rounding errors of high cardinality dimensions (e.g. app_version)
+        # add up and the sum drifts from 0.
+        change_in_proportion = np.round(self._change_in_proportion(all_values), 8)
+
+        sum = contrib_to_overall_change.sum()
+        logger.info(f"sum of contrib_to_overall_change: {sum} (should = 100)")
+        assert abs(round(sum)) == 100
+        sum = change_in_proportion.sum()
+        logger.info(f"sum of change_in_proportion: {sum} (should = 0)")
+        assert round(sum) == 0
 
-        # Carry the dimension label through by getting the columns that contain the dimension names.
-        dimension_cols = DimensionEvaluator.dimension_cols(df)
-        for col in dimension_cols:
-            output[col] = df[col].values[0]
-        return output
+        # The percent change and diff are only available for the dimension values with a baseline
+        # and current value, the percent change also needs a non zero baseline value.
+        with np.errstate(divide="ignore", invalid="ignore"):
+            percent_change = np.round((current / baseline - 1) * 100, 4)
+        found = np.isfinite(percent_change)
+
+        # Categorical dimension values are converted, the results are small and used as strings.
+        result = pivoted.index[found].to_frame(index=False).astype(object)
+        result.insert(0, "index", np.arange(len(result)))
+        result["baseline"] = np.trunc(baseline[found])
+        result["current"] = np.trunc(current[found])
+        result["percent_change"] = percent_change[found]
+        result["diff"] = current[found] - baseline[found]
+        result["contrib_to_overall_change"] = contrib_to_overall_change[found]
+        result["change_in_proportion"] = change_in_proportion[found]
+        result["change_distance"] = self._change_distance(result).round(4)
+        return result
 
     @staticmethod
-    def _contribution_to_overall_change(row) -> float:
+    def _contribution_to_overall_change(row):
+        """
+        :param row: a row, or a DataFrame to calculate all the rows at once, with the columns
+         'parent_current', 'parent_baseline', 'current' and 'baseline'.
+        """
         parent_current_value = row["parent_current"]
         parent_baseline_value = row["parent_baseline"]
         current_value = row["current"]
@@ -164,79 +214,12 @@ class DimensionEvaluator(ABC):
         ) * 100
         return contribution
 
-    def _calculate_contribution_to_overall_change(self, current_df: DataFrame) -> DataFrame:
+    @staticmethod
+    def _change_in_proportion(row):
         """
-        :param current_df:
-            Expected columns are ['dimension_value_n', 'metric_value', 'dimension_n', 'timeframe']
-            - multiple 'dimension_value_n' columns contain the dimension values (e.g. 'ca').  The
-             'n' is an integer index to account for multi dimensional processing.
-            - 'metric_value' column contains the measure.
-            - multiple 'dimension_n' column contains one value, the name of the dimension (e.g.
-             'country'). The 'n' is an integer index to account for multi dimensional processing.
-            - 'timeframe' column values are either "current" or "baseline".
-
-        :return: df
-            Columns are ['dimension_value', 'contrib_to_overall', 'dimension']
-            - multiple 'dimension_value_n' columns contain the dimension values (e.g. 'ca') provided
-             in input. Multiple dimension_value columns with numeric indicators may be present if
-             the calculation is completed for multiple dimensions.
-            - 'contrib_to_overall' contains the percent any change in the metric for the
-             dimension_value contributed to the overall amount of change in the metric value.
-            - 'dimension_n' columns contain the dimension name (e.g. country). Multiple dimension
-             columns with numeric indicators may be present if the calculation is completed for
-              multiple dimensions.
+        :param row: a row, or a DataFrame to calculate all the rows at once, with the columns
+         'parent_current', 'parent_baseline', 'current' and 'baseline'.
         """
-
-        parent_df_as_cols = self.parent_df.astype({"metric_value": "int64"}).pivot_table(
-            columns=["timeframe"], values="metric_value"
-        )
-        dimension_value_cols = DimensionEvaluator.dimension_value_cols(current_df)
-        dimension_cols = DimensionEvaluator.dimension_cols(current_df)
-
-        current_df_as_cols = current_df.set_index(
-            dimension_value_cols + dimension_cols + ["timeframe"]
-        )["metric_value"].unstack("timeframe")
-
-        # If the dimension value does not exist for both the current and baseline timelines then
-        # Nan is assigned as the missing value during the unstack.  Setting these Nan to 0 since if
-        # the dimension value is not available for that date then 0 represents the metric value
-        # accurately.  app_version is an example of a dimension that may not hae the same value set
-        # for both current and baseline.
-        current_df_as_cols = current_df_as_cols.fillna(0)
-        # Add the parent values to each row of the current_df
-        current_df_as_cols["parent_baseline"] = parent_df_as_cols["baseline"][0]
-        current_df_as_cols["parent_current"] = parent_df_as_cols["current"][0]
-
-        # Calculate the contribution to overall change
-        contrib_to_overall_change = current_df_as_cols.apply(
-            self._contribution_to_overall_change, axis=1
-        ).rename("contrib_to_overall_change")
-
-        # Add the calculation to the current_df and pull dimension value out of index
-        result = pd.merge(
-            current_df_as_cols, contrib_to_overall_change, on=dimension_value_cols
-        ).reset_index()
-        # Carry the dimension label through
-        for col in dimension_cols:
-            result[col] = current_df[col].values[0]
-
-        result = (
-            result[dimension_value_cols + ["contrib_to_overall_change"] + dimension_cols]
-            .sort_values(
-                by="contrib_to_overall_change",
-                key=abs,
-                ascending=False,
-                ignore_index=True,
-            )
-            .round(4)
-        )
-        sum = result["contrib_to_overall_change"].sum()
-        logger.info(f"sum of contrib_to_overall_change: {sum} (should = 100)")
-        assert abs(round(sum)) == 100
-        return result
-
-    @staticmethod
-    def _change_in_proportion(row) -> float:
         # Sum of all should = 0
         parent_current_value = row["parent_current"]
         parent_baseline_value = row["parent_baseline"]
@@ -248,126 +231,112 @@ class DimensionEvaluator(ABC):
         ) * 100
         return change_in_proportion
 
-    def _calculate_change_in_proportion(self, current_df: DataFrame) -> DataFrame:
+    @staticmethod
+    def _change_distance(row):
         """
-        The change in proportion tracks how much the dimension value changed wrt the overall.
-        If the value is negative then the dimension value is contributing less than it was.
-        If it is positive then the dimension value is contributing more than it was.
-        If the the overall percent change is negative, and the change in proportion value is
-        positive that means other dimensions dropped more substantially, such that the positive
-        dimension now makes up a higher percentage of teh overall value (the opposite is also true).
-
-        calculation =100 * (
-            (current_value/parent_current_value) - (baseline_value/parent_baseline_value)
-            )
-
-        :param current_df:
-            Expected columns are ['dimension_value_n', 'metric_value', 'dimension_n', 'timeframe']
-            - multiple 'dimension_value_n' columns contain the dimension values (e.g. 'ca').  The
-             'n' is an integer index to account for multi dimensional processing.
-            - 'metric_value' column contains the measure.
-            - multiple 'dimension_n' column contains one value, the name of the dimension (e.g.
-             'country'). The 'n' is an integer index to account for multi dimensional processing.
-            - 'timeframe' column values are either "current" or "baseline".
-        :return: df
-            Columns are ['dimension_value', 'change_in_proportion', 'dimension']
-            - multiple 'dimension_value_n' columns contain the dimension values (e.g. 'ca') provided
-             in input. Multiple dimension_value columns with numeric indicators may be present if
-              the calculation is completed for multiple dimensions.
-            - 'change_in_proportion' contains the change in proportion of that dimension value to
-               the overall total
-            - 'dimension_n' columns contain the dimension name (e.g. country). Multiple dimension
-             columns with numeric indicators may be present if the calculation is completed for
-              multiple dimensions.
+        :param row: a row, or a DataFrame to calculate all the rows at once, with the columns
+         'change_in_proportion' and 'contrib_to_overall_change'.
         """
-        parent_df_as_cols = self.parent_df.astype({"metric_value": "int64"}).pivot_table(
-            columns=["timeframe"], values="metric_value"
-        )
-        dimension_value_cols = DimensionEvaluator.dimension_value_cols(current_df)
-        dimension_cols = DimensionEvaluator.dimension_cols(current_df)
-
-        current_df_as_cols = current_df.set_index(
-            dimension_value_cols + dimension_cols + ["timeframe"]
-        )["metric_value"].unstack("timeframe")
-        # If the dimension value does not exist for both the current and baseline timelines then
-        # Nan is assigned as the missing value during the unstack.  Setting these Nan to 0 since if
-        # the dimension value is not available for that date then 0 represents the metric value
-        # accurately.  app_version is an example of a dimension that may not hae the same value set
-        # for both current and baseline.
-        current_df_as_cols = current_df_as_cols.fillna(0)
-
-        # Add the parent values to each row of the current_df
-        current_df_as_cols["parent_baseline"] = parent_df_as_cols["baseline"][0]
-        current_df_as_cols["parent_current"] = parent_df_as_cols["current"][0]
-
-        # Calculate the contribution to overall change
-        change_in_proportion = current_df_as_cols.apply(self._change_in_proportion, axis=1).rename(
-            "change_in_proportion"
-        )
-
-        # Add the calculation to the current_df and pull dimension value out of index
-        result = pd.merge(
-            current_df_as_cols, change_in_proportion, on=dimension_value_cols
-        ).reset_index()
-        # Carry the dimension label through
-        for col in dimension_cols:
-            result[col] = current_df[col].values[0]
-
-        result = (
-            result[dimension_value_cols + ["change_in_proportion"] + dimension_cols]
-            .sort_values(
-                by="change_in_proportion",
-                key=abs,
-                ascending=False,
-                ignore_index=True,
-            )
-            .round(8)
-            #  Changed rounding from 4 to 8 due to change_in_proportion for
-            #  country/app_verision summing to 0.2681999999999969  It is a relatively high
-            #  cardinality data set resulting in a cumulative rounding error.
-            #  This will have to be considered in final implementation.
-        )
-
-        sum = result["change_in_proportion"].sum()
-        logger.info(f"sum of change_in_proportion: {sum} (should = 0)")
-        assert round(sum) == 0
-        return result
+        change_in_proportion = row["change_in_proportion"]
+        contrib_to_overall_change = row["contrib_to_overall_change"]
 
-    def _calculate_change_distance(
-        self, contrib_to_overall_change_df: DataFrame, change_in_proportion_df: DataFrame
-    ) -> DataFrame:
-        """
-        The change distance contains the distance from plotting the change_in_proportion against
-               contrib_to_overall_change and calculating the point distance from origin.
-
-        calculation = sqrt((change_in_proportion**2)+(contrib_to_overall_change**2))
-
-        :param contrib_to_overall_change_df:
-           - Expected columns are ['dimension_value_n', 'contrib_to_overall_change', 'dimension_n']
-            - 'contrib_to_overall_change' contains the percent any change in the metric for the
-             dimension_value contributed to the overall amount of change in the metric value.
-        :param change_in_proportion_df:
-            - Expected columns are ['dimension_value', 'change_in_proportion', 'dimension']
-            - 'change_in_proportion' contains the change in contribution of that dimension value
-               to the overall total
-        :return: df
-            Columns are ['dimension_n', 'dimension_value_n', 'change_distance']
-            - 'change_distance' contains the change distance calculated from
-              change_in_proportion_df and contrib_to_overall_change_df
-        """
+        change_distance = np.sqrt((change_in_proportion) ** 2 + (contrib_to_overall_change) ** 2)
 
-        results_df = pd.merge(contrib_to_overall_change_df, change_in_proportion_df)
+        return change_distance
 
-        results_df["change_distance"] = results_df.apply(self._change_distance, axis=1).round(4)
 
-        return results_df.drop(columns=["contrib_to_overall_change", "change_in_proportion"])
+class DimensionSetEvaluator(DimensionEvaluator):
+    """
+    Evaluates dimension sets whose values are retrieved from the metric lookup, the queries may run
+    concurrently and the values may be evaluated in worker processes.
+    """
 
-    @staticmethod
-    def _change_distance(row) -> float:
+    def __init__(
+        self, parent_df: DataFrame, max_concurrent_queries: int = 1, executor: Executor = None
+    ):
+        """
+        :param parent_df: see DimensionEvaluator.
+        :param max_concurrent_queries: the number of dimension sets retrieved at the same time,
+         1 retrieves them one after the other.
+        :param executor: the worker processes the dimension sets are evaluated in (see
+         worker_pool), None evaluates them in this process.
+        """
+        super().__init__(parent_df)
+        self.max_concurrent_queries = max_concurrent_queries
+        self.executor = executor
 
-        change_in_proportion = row["change_in_proportion"]
-        contrib_to_overall_change = row["contrib_to_overall_change"]
+    @abstractmethod
+    def _evaluate_values(self, values: DataFrame) -> DataFrame:
+        """
+        :param values: the current and baseline values of one dimension set.
+        :return: the dimension values with a large contribution to the overall change.
+        """
+        pass
 
-        change_distance = math.sqrt((change_in_proportion) ** 2 + (contrib_to_overall_change) ** 2)
+    @abstractmethod
+    def _worker_kwargs(self) -> dict:
+        """
+        :return: the arguments used to create the evaluator in a worker process, only the state
+         needed by _evaluate_values (e.g. not the metric lookup).
+        """
+        pass
 
-        return change_distance
+    def _evaluate_fetched(self, fetched: Iterator[Tuple[tuple, DataFrame]]) -> dict:
+        """
+        Evaluates the values of each dimension set as they are retrieved.  In worker processes the
+        values and results are handed over as Arrow IPC streams, which is much cheaper than pickling
+        the DataFrames.
+        :param fetched: (dimension set, values) pairs, see _fetch_dimension_sets.
+        :return: dict of dimension set to the result, in the order the values were retrieved.
+        """
+        if self.executor is None:
+            return {
+                dimension_set: self._evaluate_values(values) for dimension_set, values in fetched
+            }
+
+        evaluator_kwargs = self._worker_kwargs()
+        futures = {
+            dimension_set: self.executor.submit(
+                _evaluate_in_worker,
+                type(self),
+                evaluator_kwargs,
+                profile_name.get(),
+                _to_ipc(values),
+            )
+            for dimension_set, values in fetched
+        }
+        return {
+            dimension_set: _from_ipc(future.result()) for dimension_set, future in futures.items()
+        }
+
+    def _fetch_dimension_sets(
+        self, fetch: Callable[[tuple], DataFrame], dimension_sets: list
+    ) -> Iterator[Tuple[tuple, DataFrame]]:
+        """
+        Retrieves the values for every dimension set.  With concurrency enabled all the queries are
+        submitted up front and the values are yielded as each query completes, so the caller's
+        calculations overlap with the queries still running.
+        :param fetch: retrieves the values for one dimension set.
+        :param dimension_sets: the dimension sets to retrieve.
+        :return: (dimension set, values) pairs, in completion order when run concurrently.
+        """
+        if self.max_concurrent_queries <= 1 or len(dimension_sets) <= 1:
+            for dimension_set in dimension_sets:
+                yield dimension_set, fetch(dimension_set)
+            return
+
+        executor = ThreadPoolExecutor(
+            max_workers=min(self.max_concurrent_queries, len(dimension_sets)),
+            thread_name_prefix="dimension-fetch",
+        )
+        try:
+            # Run in a copy of the caller's context so the log lines keep the profile tag.
+            futures = {
+                executor.submit(contextvars.copy_context().run, fetch, dimension_set): dimension_set
+                for dimension_set in dimension_sets
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # Don't start the remaining queries if a query or calculation failed.
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -1,34 +1,51 @@
 import itertools
-from functools import reduce
+from concurrent.futures import Executor
 
 import pandas as pd
 from pandas import DataFrame
 
 from analysis.data.metric import MetricLookupManager
-from analysis.detection.explorer.dimension_evaluator import DimensionEvaluator
+from analysis.detection.explorer.dimension_evaluator import DimensionSetEvaluator
 from analysis.configuration.configs import AnalysisProfile
 from analysis.configuration.processing_dates import ProcessingDateRange
+from analysis.logging import logger
 
 # TODO GLE only doing additive algm not the ratio algm.
 
+# The dimension value the long tail of a dimension is folded into, see LongTailBucket.
+OTHER_DIMENSION_VALUE = MetricLookupManager.OTHER_DIMENSION_VALUE
 
-class MultiDimensionEvaluator(DimensionEvaluator):
+
+class MultiDimensionEvaluator(DimensionSetEvaluator):
     def __init__(
         self,
         profile: AnalysisProfile,
         baseline_period: ProcessingDateRange,
         current_period: ProcessingDateRange,
         parent_df: DataFrame,
+        metric_lookup: MetricLookupManager = None,
+        max_concurrent_queries: int = 1,
+        executor: Executor = None,
     ):
-        super().__init__(parent_df)
+        super().__init__(parent_df, max_concurrent_queries, executor)
         # TODO GLE currently the profile only references percent_change.
         self.profile = profile
         self.baseline_period = baseline_period
         self.current_period = current_period
+        self.metric_lookup = metric_lookup or MetricLookupManager()
 
-    def _get_current_and_baseline_values(self, dimensions: list) -> DataFrame:
+    def _get_current_and_baseline_values(
+        self,
+        dimensions: list,
+        included_dimension_values: list = None,
+        folded_dimension_values: list = None,
+    ) -> DataFrame:
         """
         :param dimensions: list of pairs of dimensions
+        :param included_dimension_values: only the values of the dimensions listed are retrieved,
+         see MetricLookupManager.get_metric_by_dimensions_with_date_ranges.
+        :param folded_dimension_values: the values of the dimensions that are not listed are folded
+         into OTHER_DIMENSION_VALUE, see _long_tail_values.
         :return: Dataframe containing the current and baseline values.  Dataframe columns are
             'dimension_value' column contains the dimension values (e.g. 'ca').
             'dimension_value_1'  etc
@@ -36,101 +53,288 @@ class MultiDimensionEvaluator(DimensionEvaluator):
             'dimension' column contains one value, the name of the dimension (e.g. 'country').
             'timeframe' column values are either "current" or "baseline".
         """
-        current = MetricLookupManager().get_metric_by_dimensions_with_date_range(
+        # Both periods are retrieved with a single query, 'timeframe' is populated by the query.
+        values = self.metric_lookup.get_metric_by_dimensions_with_date_ranges(
             metric_name=self.profile.dataset.metric_name,
             table_name=self.profile.dataset.table_name,
             app_name=self.profile.dataset.app_name,
-            date_range=self.current_period,
+            date_ranges={"current": self.current_period, "baseline": self.baseline_period},
             dimensions=dimensions,
             excluded_dimensions=self.profile.percent_change.exclude_dimension_values,
+            included_dimension_values=included_dimension_values,
+            folded_dimension_values=folded_dimension_values,
         )
-        current["timeframe"] = "current"
-        baseline = MetricLookupManager().get_metric_by_dimensions_with_date_range(
-            metric_name=self.profile.dataset.metric_name,
-            table_name=self.profile.dataset.table_name,
-            app_name=self.profile.dataset.app_name,
-            date_range=self.baseline_period,
-            dimensions=dimensions,
-            excluded_dimensions=self.profile.percent_change.exclude_dimension_values,
-        )
-        baseline["timeframe"] = "baseline"
 
         # the BigQuery package uses type 'Int64' as the type.  For dropna() to work the type needs
         # to be 'int64' (lowercase).  'Int64' handles missing values implicitly so dropna() has no
         # effect
-        df = pd.concat([current, baseline]).astype({"metric_value": "float64"})
+        df = values.astype({"metric_value": "float64"})
         return df
 
-    # TODO GLE Alot of this code can be combined with one_dimension.py
-    def evaluate(self) -> dict:
+    @staticmethod
+    def _significant_values(one_dim_evaluation: dict) -> dict:
         """
-        Runs an evaluation of the specified dimensions individually.
-        :return: a dict containing one dataframe for all evaluated metrics.  The data frame is
-         sorted by percent change results, not dimension resulting in mixed order of dimensions
-          (if more than 1 dimension has been calculated).
+        :param one_dim_evaluation: the evaluation of OneDimensionEvaluator.
+        :return: dict of dimension to the values exceeding the contribution to overall change
+         threshold when the dimension is evaluated individually, dimensions without any are left
+         out.
         """
-        contrib_to_overall_change_threshold = (
-            self.profile.percent_change.contrib_to_overall_change_threshold_percent
+        return {
+            dimension: list(df["dimension_value_0"].astype(str))
+            for dimension, df in one_dim_evaluation["dimension_calc"].items()
+            if len(df) > 0
+        }
+
+    def _get_significant_values(
+        self, dimensions: list, significant_values: dict, folded_dimension_values: list = None
+    ) -> DataFrame:
+        """
+        Retrieves only the significant values of the dimensions.  The difference between the parent
+        totals and the values retrieved is added as an OTHER_DIMENSION_VALUE value of every
+        dimension, so the contributions to overall change still sum to 100.  The remainder is
+        dropped from the results by _evaluate_values.
+        :param dimensions: the dimension set, each dimension must have significant values.
+        :param significant_values: see _significant_values.
+        :param folded_dimension_values: see _get_current_and_baseline_values.
+        """
+        values = self._get_current_and_baseline_values(
+            dimensions=dimensions,
+            included_dimension_values=[
+                {"dimension": dimension, "dim_values": significant_values[dimension]}
+                for dimension in dimensions
+            ],
+            folded_dimension_values=folded_dimension_values,
         )
-        large_contrib_to_change = {}
 
-        # Skip the evaluation if permutation processing is not enabled,
+        remainder = (
+            self.parent_df.groupby("timeframe")["metric_value"]
+            .sum()
+            .sub(values.groupby("timeframe")["metric_value"].sum(), fill_value=0)
+        )
+        if (remainder == 0).all():
+            return values
+
+        other = DataFrame({"timeframe": remainder.index, "metric_value": remainder.to_numpy()})
+        for i, dimension in enumerate(dimensions):
+            other[f"dimension_value_{i}"] = OTHER_DIMENSION_VALUE
+            other[f"dimension_{i}"] = dimension
+        return pd.concat(
+            [values.astype({col: object for col in self.dimension_value_cols(values)}), other],
+            ignore_index=True,
+        )[values.columns]
+
+    def _long_tail_values(self, dimensions: list) -> dict:
+        """
+        Chooses the values kept of the dimensions configured in long_tail_buckets, the other values
+        are folded into a single OTHER_DIMENSION_VALUE value by the queries (or cube rollups) of the
+        dimension sets.  The values kept are the ones with the largest share of the dimension total
+        over both timeframes, the totals per timeframe are unchanged.
+        :param dimensions: the dimensions evaluated, the values of each dimension with a long tail
+         are retrieved on their own (usually already retrieved by the one dimension evaluation).
+        :return: dict of dimension to the values kept, the dimensions without a long tail are left
+         out.
+        """
+        buckets = {
+            bucket.dimension: bucket for bucket in self.profile.percent_change.long_tail_buckets
+        }
+        long_tail_values = {}
+        for dimension in dimensions:
+            bucket = buckets.get(dimension)
+            if bucket is None:
+                continue
+
+            totals = (
+                self._get_current_and_baseline_values(dimensions=[dimension])
+                .groupby("dimension_value_0", observed=True)["metric_value"]
+                .sum()
+                .sort_values(ascending=False, kind="stable")
+            )
+            kept = totals[totals >= bucket.min_share * totals.sum()].index[: bucket.max_cardinality]
+            if len(kept) == len(totals):
+                continue
+
+            logger.info(
+                f"folding {len(totals) - len(kept)} values of {bucket.dimension} into "
+                f"{OTHER_DIMENSION_VALUE}"
+            )
+            long_tail_values[dimension] = list(kept.astype(str))
+        return long_tail_values
+
+    def dimension_sets(self) -> list:
+        """
+        :return: list of the pairs of dimensions evaluated, empty if permutation processing is not
+         enabled.
+        """
         if not self.profile.percent_change.include_dimension_permutations:
-            return {"multi_dimension_calc": large_contrib_to_change}
+            return []
 
         # Get all permutations and filter duplicates (a, b) = (b, a)
         dim_permutations = itertools.permutations(self.profile.percent_change.dimensions, 2)
-        dim_permutations = list(set(tuple(sorted(perm)) for perm in dim_permutations))
-
-        for pair in dim_permutations:
-            values = self._get_current_and_baseline_values(dimensions=list(pair))
-            percent_change_df = self._calculate_percent_change(df=values)
-            diff_df = self._calculate_diff(df=values)
-            contrib_to_overall_change_df = self._calculate_contribution_to_overall_change(
-                current_df=values
+        return list(set(tuple(sorted(perm)) for perm in dim_permutations))
+
+    def _worker_kwargs(self) -> dict:
+        return {
+            "profile": self.profile,
+            "baseline_period": self.baseline_period,
+            "current_period": self.current_period,
+            "parent_df": self.parent_df,
+        }
+
+    def _evaluate_values(self, values: DataFrame) -> DataFrame:
+        """
+        :param values: the current and baseline values of one pair of dimensions.
+        :return: the dimension values with a large contribution to the overall change.
+        """
+        contrib_to_overall_change_threshold = (
+            self.profile.percent_change.contrib_to_overall_change_threshold_percent
+        )
+        result = self._calculate_metrics(values)
+        # The change distance is reported before the other metrics for dimension pairs.
+        metric_cols = [
+            "change_distance",
+            "percent_change",
+            "diff",
+            "contrib_to_overall_change",
+            "change_in_proportion",
+        ]
+        result = result[[col for col in result.columns if col not in metric_cols] + metric_cols]
+        # The long tail (see _long_tail_values) and the remainder of the values not retrieved (see
+        # _get_significant_values) are only needed for the totals, they are not reported or ranked.
+        other = (result[self.dimension_value_cols(result)] == OTHER_DIMENSION_VALUE).any(axis=1)
+        result = result[~other]
+
+        # TODO GLE due to more combinations the threshold here might need to be lower.
+        result = result[
+            abs(result["contrib_to_overall_change"]) > contrib_to_overall_change_threshold
+        ]
+        return (
+            self._largest(
+                result,
+                self.profile.percent_change.sort_by,
+                self.profile.percent_change.limit_results,
+                key=abs,
             )
-            change_in_proportion_df = self._calculate_change_in_proportion(current_df=values)
+            .reset_index(drop=True)
+            .round(self.profile.percent_change.results_rounding)
+        )
 
-            change_distance_df = self._calculate_change_distance(
-                contrib_to_overall_change_df=contrib_to_overall_change_df,
-                change_in_proportion_df=change_in_proportion_df,
+    def _candidate_dimension_sets(self, parent_results: dict, depth: int) -> list:
+        """
+        A combination of dimensions is only a candidate when each of its parent combinations (the
+        combinations with one less dimension) has a dimension value exceeding the contribution to
+        overall change threshold.  If a combination is not significant neither are the
+        combinations containing it.
+        :param parent_results: the results of the combinations of depth - 1 dimensions.
+        :param depth: the number of dimensions in the candidate combinations.
+        :return: the candidate combinations ordered by the smallest of the largest contribution to
+         overall change of their parents, limited to max_combinations_per_level.
+        """
+        significant = {
+            dimension_set: df["contrib_to_overall_change"].abs().max()
+            for dimension_set, df in parent_results.items()
+            if len(df) > 0
+        }
+        candidates = set()
+        for parent in significant:
+            for dimension in self.profile.percent_change.dimensions:
+                if dimension in parent:
+                    continue
+                candidate = tuple(sorted(parent + (dimension,)))
+                if all(
+                    subset in significant for subset in itertools.combinations(candidate, depth - 1)
+                ):
+                    candidates.add(candidate)
+
+        candidates = sorted(
+            candidates,
+            key=lambda candidate: (
+                -min(significant[s] for s in itertools.combinations(candidate, depth - 1)),
+                candidate,
+            ),
+        )
+        limit = self.profile.percent_change.max_combinations_per_level
+        if limit is not None and len(candidates) > limit:
+            logger.info(
+                f"evaluating {limit} of {len(candidates)} combinations of {depth} dimensions"
             )
-            dimension_value_cols = DimensionEvaluator.dimension_value_cols(df=values)
-            dimension_cols = DimensionEvaluator.dimension_cols(df=values)
-            raw_values = values.astype({"metric_value": "int64"}).pivot_table(
-                "timeframe", dimension_cols + dimension_value_cols, "timeframe"
+            candidates = candidates[:limit]
+        return candidates
+
+    def _evaluate_dimension_sets(
+        self,
+        dimension_sets: list,
+        significant_values: dict = None,
+        long_tail_values: dict = None,
+    ) -> dict:
+        """
+        :param significant_values: when provided only these values are retrieved, see
+         _get_significant_values.
+        :param long_tail_values: the values kept of the dimensions with a long tail, see
+         _long_tail_values.
+        """
+
+        def fetch(dimension_set: tuple) -> DataFrame:
+            folded_dimension_values = [
+                {"dimension": dimension, "dim_values": long_tail_values[dimension]}
+                for dimension in dimension_set
+                if dimension in (long_tail_values or {})
+            ] or None
+            if significant_values is None:
+                return self._get_current_and_baseline_values(
+                    dimensions=list(dimension_set), folded_dimension_values=folded_dimension_values
+                )
+            return self._get_significant_values(
+                list(dimension_set), significant_values, folded_dimension_values
             )
 
-            data_frames = [
-                raw_values,
-                change_distance_df,
-                percent_change_df,
-                diff_df,
-                contrib_to_overall_change_df,
-                change_in_proportion_df,
+        results = self._evaluate_fetched(self._fetch_dimension_sets(fetch, dimension_sets))
+
+        # The queries may complete in any order, the results are kept in the order of the sets.
+        return {dimension_set: results[dimension_set] for dimension_set in dimension_sets}
+
+    # TODO GLE Alot of this code can be combined with one_dimension.py
+    def evaluate(self, one_dim_evaluation: dict = None) -> dict:
+        """
+        Runs an evaluation of all the pairs of dimensions, then of the larger combinations up to
+        max_dimension_depth whose parent combinations are significant.
+        :param one_dim_evaluation: the evaluation of OneDimensionEvaluator, when provided only the
+         pairs of dimensions that are both significant individually are evaluated, retrieving only
+         their significant values (see lazy_dimension_permutations).
+        :return: a dict containing one dataframe for all evaluated metrics.  The data frame is
+         sorted by percent change results, not dimension resulting in mixed order of dimensions
+          (if more than 1 dimension has been calculated).
+        """
+        # Skip the evaluation if permutation processing is not enabled,
+        if not self.profile.percent_change.include_dimension_permutations:
+            return {"multi_dimension_calc": {}}
+
+        dimension_sets = self.dimension_sets()
+        significant_values = None
+        if one_dim_evaluation is not None:
+            significant_values = self._significant_values(one_dim_evaluation)
+            dimension_sets = [
+                dimension_set
+                for dimension_set in dimension_sets
+                if all(dimension in significant_values for dimension in dimension_set)
             ]
-            merge_cols = DimensionEvaluator.dimension_cols(
-                percent_change_df
-            ) + DimensionEvaluator.dimension_value_cols(percent_change_df)
-
-            result = reduce(
-                lambda left, right: pd.merge(left, right, on=merge_cols),
-                data_frames,
-            ).reset_index()
-
-            # TODO GLE due to more combinations the threshold here might need to be lower.
-            large_contrib_to_change[pair] = (
-                result[
-                    abs(result["contrib_to_overall_change"]) > contrib_to_overall_change_threshold
-                ]
-                .sort_values(
-                    by=self.profile.percent_change.sort_by,
-                    key=abs,
-                    ascending=False,
-                    ignore_index=True,
-                )
-                .round(self.profile.percent_change.results_rounding)
-                .head(self.profile.percent_change.limit_results)
+            logger.info(
+                f"evaluating {len(dimension_sets)} pairs of dimensions with significant values"
+            )
+
+        long_tail_values = self._long_tail_values(
+            sorted(set(itertools.chain.from_iterable(dimension_sets)))
+        )
+        large_contrib_to_change = self._evaluate_dimension_sets(
+            dimension_sets, significant_values, long_tail_values
+        )
+        level_results = large_contrib_to_change
+        for depth in range(3, self.profile.percent_change.max_dimension_depth + 1):
+            candidates = self._candidate_dimension_sets(level_results, depth)
+            if len(candidates) == 0:
+                break
+            level_results = self._evaluate_dimension_sets(
+                candidates, significant_values, long_tail_values
             )
+            large_contrib_to_change = large_contrib_to_change | level_results
 
         return {"multi_dimension_calc": large_contrib_to_change}
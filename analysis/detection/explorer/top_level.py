@@ -1,9 +1,11 @@
-import pandas as pd
+from typing import Dict
+
 from pandas import DataFrame
 
 from analysis.data.metric import MetricLookupManager
 from analysis.configuration.configs import AnalysisProfile
 from analysis.configuration.processing_dates import ProcessingDateRange
+from analysis.errors import TopLevelMismatchError
 
 
 class TopLevelEvaluator:
@@ -12,68 +14,88 @@ class TopLevelEvaluator:
         profile: AnalysisProfile,
         baseline_period: ProcessingDateRange,
         current_period: ProcessingDateRange,
+        metric_lookup: MetricLookupManager = None,
     ):
         self.profile = profile
         self.baseline_period = baseline_period
         self.current_period = current_period
+        self.metric_lookup = metric_lookup or MetricLookupManager()
+        # The values of all the top level evaluations, retrieved together on first use.
+        self._top_level_values = None
 
-    def _get_current_and_baseline_values(self) -> DataFrame:
-        current_df = MetricLookupManager().get_metric_with_date_range(
-            metric_name=self.profile.dataset.metric_name,
-            table_name=self.profile.dataset.table_name,
-            app_name=self.profile.dataset.app_name,
-            date_range=self.current_period,
+    def _get_top_level_values(self) -> Dict[str, DataFrame]:
+        """
+        Retrieves the current and baseline values including all, excluding and including only the
+        excluded dimension values using a single query, or derives them from the values by
+        dimension (see Dataset.top_level_mode).
+        :return: dict of MetricLookupManager.TOP_LEVEL_VARIANTS to Dataframe with columns
+         ['timeframe', 'metric_value'].  'timeframe' column values are either "current" or
+         "baseline".
+        """
+        if self._top_level_values is None:
+            kwargs = {
+                "metric_name": self.profile.dataset.metric_name,
+                "table_name": self.profile.dataset.table_name,
+                "app_name": self.profile.dataset.app_name,
+                "date_ranges": {"current": self.current_period, "baseline": self.baseline_period},
+                "excluded_dimensions": self.profile.percent_change.exclude_dimension_values,
+            }
+            if self.profile.dataset.top_level_mode == "query":
+                self._top_level_values = self.metric_lookup.get_top_level_metrics_with_date_ranges(
+                    **kwargs
+                )
+            else:
+                self._top_level_values = self.metric_lookup.get_top_level_metrics_from_dimensions(
+                    dimensions=self._top_level_dimensions(), **kwargs
+                )
+                if self.profile.dataset.top_level_check_tolerance is not None:
+                    self._check_top_level_values(
+                        self.metric_lookup.get_top_level_metrics_with_date_ranges(**kwargs)
+                    )
+        return self._top_level_values
+
+    def _top_level_dimensions(self) -> list:
+        """
+        :return: the dimensions the top level values are derived from, the excluded dimensions so
+         the excluded values can be told apart, otherwise the first dimension evaluated.
+        """
+        excluded_dimensions = [
+            dim["dimension"] for dim in self.profile.percent_change.exclude_dimension_values
+        ]
+        return (
+            list(dict.fromkeys(excluded_dimensions)) or self.profile.percent_change.dimensions[:1]
         )
-        current_df["timeframe"] = "current"
 
-        baseline_df = MetricLookupManager().get_metric_with_date_range(
-            metric_name=self.profile.dataset.metric_name,
-            table_name=self.profile.dataset.table_name,
-            app_name=self.profile.dataset.app_name,
-            date_range=self.baseline_period,
-        )
-        baseline_df["timeframe"] = "baseline"
+    def _check_top_level_values(self, queried_values: Dict[str, DataFrame]):
+        """
+        Raises a TopLevelMismatchError when the derived top level values differ from the queried
+        values by more than top_level_check_tolerance.
+        """
+        tolerance = self.profile.dataset.top_level_check_tolerance
+        for variant, values in self._top_level_values.items():
+            derived = values.set_index("timeframe")["metric_value"]
+            for timeframe, queried in (
+                queried_values[variant].set_index("timeframe")["metric_value"].items()
+            ):
+                if abs(derived[timeframe] - queried) > tolerance * abs(queried):
+                    raise TopLevelMismatchError(
+                        metric=self.profile.dataset.metric_name,
+                        variant=variant,
+                        timeframe=timeframe,
+                        derived=derived[timeframe],
+                        queried=queried,
+                    )
 
-        return pd.concat([current_df, baseline_df])
+    def _get_current_and_baseline_values(self) -> DataFrame:
+        return self._get_top_level_values()["all"][["metric_value", "timeframe"]]
 
     def _get_current_and_baseline_values_excluded_dim_values_only(self) -> DataFrame:
-        current_df = MetricLookupManager().get_metric_with_date_range(
-            metric_name=self.profile.dataset.metric_name,
-            table_name=self.profile.dataset.table_name,
-            app_name=self.profile.dataset.app_name,
-            date_range=self.current_period,
-            included_dimensions_only=self.profile.percent_change.exclude_dimension_values,
-        )
-        current_df["timeframe"] = "current"
-
-        baseline_df = MetricLookupManager().get_metric_with_date_range(
-            metric_name=self.profile.dataset.metric_name,
-            table_name=self.profile.dataset.table_name,
-            app_name=self.profile.dataset.app_name,
-            date_range=self.baseline_period,
-            included_dimensions_only=self.profile.percent_change.exclude_dimension_values,
-        )
-        baseline_df["timeframe"] = "baseline"
-        return pd.concat([current_df, baseline_df])
+        return self._get_top_level_values()["dimension_values_only"][["metric_value", "timeframe"]]
 
     def _get_current_and_baseline_values_dim_values_excluded(self) -> DataFrame:
-        current_df = MetricLookupManager().get_metric_with_date_range(
-            metric_name=self.profile.dataset.metric_name,
-            table_name=self.profile.dataset.table_name,
-            app_name=self.profile.dataset.app_name,
-            date_range=self.current_period,
-            excluded_dimensions=self.profile.percent_change.exclude_dimension_values,
-        )
-        current_df["timeframe"] = "current"
-        baseline_df = MetricLookupManager().get_metric_with_date_range(
-            metric_name=self.profile.dataset.metric_name,
-            table_name=self.profile.dataset.table_name,
-            app_name=self.profile.dataset.app_name,
-            date_range=self.baseline_period,
-            excluded_dimensions=self.profile.percent_change.exclude_dimension_values,
-        )
-        baseline_df["timeframe"] = "baseline"
-        return pd.concat([current_df, baseline_df])
+        return self._get_top_level_values()["dimension_values_excluded"][
+            ["metric_value", "timeframe"]
+        ]
 
     @staticmethod
     def _calculate_diff(df: DataFrame) -> float:
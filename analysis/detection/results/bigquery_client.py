@@ -6,6 +6,8 @@ import attr
 from google.cloud import bigquery
 from google.cloud.exceptions import NotFound
 
+from analysis.data.clients import bigquery_clients
+
 
 @attr.s(auto_attribs=True, slots=True)
 class BigQueryClient:
@@ -17,8 +19,8 @@ class BigQueryClient:
 
     @property
     def client(self) -> bigquery.client.Client:
-        """Return BigQuery client instance."""
-        self._client = self._client or bigquery.client.Client(self.project_id)
+        """Return BigQuery client instance, shared with the rest of the run."""
+        self._client = self._client or bigquery_clients.get(self.project_id)
         return self._client
 
     def bq_table_exists(self, table_ref):
@@ -1,3 +1,6 @@
+import os
+from typing import List, Tuple
+
 from analysis.detection.results.bigquery_client import BigQueryClient
 from analysis.logging import logger
 from analysis.configuration.configs import AnalysisProfile
@@ -5,8 +8,9 @@ from analysis.configuration.processing_dates import ProcessingDateRange
 
 from google.cloud.bigquery.schema import SchemaField
 from google.cloud.bigquery.table import Table
+import pandas as pd
 from pandas import DataFrame
-from datetime import datetime
+from datetime import date, datetime
 from google.cloud.bigquery import TimePartitioning, TimePartitioningType
 
 DESTINATION_PROJECT = "automated-analysis-dev"
@@ -53,13 +57,8 @@ def _build_table() -> Table:
     return table
 
 
-def _get_analysis_info_table():
+def _get_analysis_info_table(bigquery: BigQueryClient):
     table = _build_table()
-    bigquery = BigQueryClient(
-        project_id=DESTINATION_PROJECT,
-        dataset=DESTINATION_DATASET,
-    )
-
     _create_bq_table_if_not_exist(bigquery, table)
 
     return table
@@ -70,12 +69,13 @@ def _prepare_df_for_storage(
     baseline: ProcessingDateRange,
     current: ProcessingDateRange,
     insert_data: DataFrame,
+    processing_date: date = None,
 ) -> DataFrame:
 
     prepared_df = insert_data.reset_index(drop=True)
     prepared_df["name"] = profile.name
     prepared_df["app_name"] = profile.dataset.app_name
-    prepared_df["processing_date"] = datetime.now().date()
+    prepared_df["processing_date"] = processing_date or datetime.now().date()
     prepared_df["rank"] = prepared_df.index + 1
     prepared_df["baseline_start_date"] = baseline.start_date.date()
     prepared_df["baseline_end_date"] = baseline.end_date.date()
@@ -83,7 +83,7 @@ def _prepare_df_for_storage(
     prepared_df["current_end_date"] = current.end_date.date()
     prepared_df["table_name"] = profile.dataset.table_name
     prepared_df["metric_name"] = profile.dataset.metric_name
-    prepared_df.drop(["index"], axis=1, inplace=True)
+    prepared_df.drop(["index"], axis=1, inplace=True, errors="ignore")
     return prepared_df
 
 
@@ -95,7 +95,7 @@ def insert_processing_info(
 ):
     bigquery = BigQueryClient(project_id=DESTINATION_PROJECT, dataset=DESTINATION_DATASET)
 
-    processing_table = _get_analysis_info_table()
+    processing_table = _get_analysis_info_table(bigquery)
     prepared_df = _prepare_df_for_storage(profile, baseline, current, insert_data)
     result = bigquery.client.insert_rows_from_dataframe(processing_table, prepared_df)
 
@@ -106,3 +106,26 @@ def insert_processing_info(
         logger.error(str(result))
     else:
         logger.info(f"Processing info inserted into: {PROCESSING_INFO_TABLE}.")
+
+
+def write_processing_info(
+    profile: AnalysisProfile,
+    processing_info: List[Tuple[date, ProcessingDateRange, ProcessingDateRange, DataFrame]],
+    output_dir: str,
+) -> str:
+    """
+    Writes the results of several processing dates to a Parquet file instead of BigQuery, one row
+    per significant dimension value with the same columns as the processing info table.
+    :param processing_info: (processing date, baseline, current, results) for each date.
+    :return: the path of the file written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, profile.name.replace(" ", "_").replace("/", "_") + ".parquet")
+    frames = [
+        _prepare_df_for_storage(profile, baseline, current, insert_data, processing_date)
+        for processing_date, baseline, current, insert_data in processing_info
+    ]
+    df = pd.concat(frames, ignore_index=True) if frames else DataFrame()
+    df.to_parquet(path, index=False)
+    logger.info(f"Processing info for {len(frames)} dates written to: {path}")
+    return path
@@ -13,6 +13,14 @@ class BigQueryPermissionsError(Exception):
         super().__init__(f"Unable to access data for metric: {metric} {msg } query: " f"\n{query} ")
 
 
+class TopLevelMismatchError(Exception):
+    def __init__(self, metric: str, variant: str, timeframe: str, derived: float, queried: float):
+        super().__init__(
+            f"Top level values ({variant}) for metric: {metric} timeframe: {timeframe} derived "
+            f"from the dimensions: {derived} do not match the query: {queried}"
+        )
+
+
 class SqlNotDefinedError(Exception):
     def __init__(self, filename: str):
         super().__init__(f"Sql missing, expected file: {filename}")
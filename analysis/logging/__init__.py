@@ -1,17 +1,77 @@
 import logging
 import sys
 import logging.handlers
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
 
 logger = logging.getLogger("overwatch")
 logger.setLevel(level=logging.INFO)
 
+# The name of the analysis profile being processed, profiles may be processed concurrently so the
+# log lines are tagged with it.
+profile_name: ContextVar[str] = ContextVar("profile_name", default=None)
+
+
+class ProfileFilter(logging.Filter):
+    """Adds the name of the profile being processed to the record, as 'profile'."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # The records of the worker processes carry the name from the worker, see log_to_queue.
+        name = record.__dict__.get("profile_name", profile_name.get())
+        record.profile = f"[{name}] " if name else ""
+        return True
+
+
+def _add_profile_name(record: logging.LogRecord) -> bool:
+    record.profile_name = profile_name.get()
+    return True
+
+
+@contextmanager
+def profile_context(name: str) -> Iterator[None]:
+    """Tags the log lines with the profile name for the duration of the block."""
+    token = profile_name.set(name)
+    try:
+        yield
+    finally:
+        profile_name.reset(token)
+
+
+def log_to_queue(queue, level: int):
+    """
+    Sends the log records of a worker process to the queue rather than to the handlers added on
+    import, so only the parent process writes to the console and overwatch.log (see queue_listener).
+    :param level: the level of the parent process' logger.
+    """
+    queue_handler = logging.handlers.QueueHandler(queue)
+    queue_handler.addFilter(_add_profile_name)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    logger.addHandler(queue_handler)
+    logger.setLevel(level)
+
+
+@contextmanager
+def queue_listener(queue) -> Iterator[None]:
+    """Writes the records sent by the worker processes (see log_to_queue) for the block."""
+    listener = logging.handlers.QueueListener(queue, *logger.handlers, respect_handler_level=True)
+    listener.start()
+    try:
+        yield
+    finally:
+        listener.stop()
+
+
 log_formatter = logging.Formatter(
-    fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    fmt="%(asctime)s - %(name)s - %(levelname)s - %(profile)s%(message)s",
 )
 
 console_handler = logging.StreamHandler(stream=sys.stdout)
 console_handler.setFormatter(log_formatter)
 console_handler.setLevel(level=logging.INFO)
+console_handler.addFilter(ProfileFilter())
 logger.addHandler(console_handler)
 
 rfh = logging.handlers.RotatingFileHandler(
@@ -19,4 +79,5 @@ rfh = logging.handlers.RotatingFileHandler(
 )
 rfh.setFormatter(log_formatter)
 rfh.setLevel(level=logging.INFO)
+rfh.addFilter(ProfileFilter())
 logger.addHandler(rfh)
@@ -0,0 +1,71 @@
+import cProfile
+import os
+import re
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterator
+
+from analysis.logging import logger
+
+# Allocations made by the import machinery and tracemalloc itself are not reported.
+_MEMORY_FILTERS = (
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+)
+
+
+def _memory_report(snapshot: tracemalloc.Snapshot, peak: int, top: int) -> str:
+    statistics = snapshot.filter_traces(_MEMORY_FILTERS).statistics("lineno")
+    lines = [
+        f"Peak traced memory: {peak / 2**20:.1f} MB",
+        f"Memory still allocated: {sum(stat.size for stat in statistics) / 2**20:.1f} MB",
+        f"Top {top} allocations by line:",
+    ]
+    lines.extend(str(stat) for stat in statistics[:top])
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def profiling(
+    directory: str, name: str, cpu: bool = False, memory: bool = False, top: int = 25
+) -> Iterator[None]:
+    """
+    Profiles the block with cProfile and/or tracemalloc and writes the results, even if the block
+    fails.  cProfile only profiles the calling thread and tracemalloc traces the whole process,
+    neither covers the worker processes (see worker_pool).
+    :param directory: where the results are written, <name>.prof for the CPU profile (e.g. for
+     `python -m pstats` or snakeviz) and <name>_memory.txt for the top allocations.
+    :param name: identifies the profiled block, e.g. the profile name and date.
+    :param top: the number of lines allocating the most memory reported.
+    """
+    if not cpu and not memory:
+        yield
+        return
+
+    os.makedirs(directory, exist_ok=True)
+    base_path = os.path.join(directory, re.sub(r"[^\w.-]+", "_", name))
+    profiler = cProfile.Profile() if cpu else None
+    # Tracing started by someone else is left running.
+    stop_tracing = memory and not tracemalloc.is_tracing()
+    if memory:
+        if stop_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(base_path + ".prof")
+            logger.info(f"CPU profile written to: {base_path}.prof")
+        if memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if stop_tracing:
+                tracemalloc.stop()
+            with open(base_path + "_memory.txt", "w") as fh:
+                fh.write(_memory_report(snapshot, peak, top))
+            logger.info(f"Memory profile written to: {base_path}_memory.txt")
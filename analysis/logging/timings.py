@@ -0,0 +1,162 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+import attr
+
+from analysis.logging import profile_name
+
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """:return: the peak resident set size of the process so far, None if not available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux and in bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@attr.s(auto_attribs=True)
+class Timing:
+    """The resources used by one instrumented block, e.g. a query or a processing stage."""
+
+    name: str
+    profile: Optional[str]
+    wall_seconds: float
+    # CPU time of the whole process during the block, including other threads (e.g. other
+    # profiles with run-analysis --parallel-profiles) but not the worker processes.
+    cpu_seconds: float
+    peak_rss_bytes: Optional[int]
+    # e.g. the rows and bytes returned and the bytes processed by a query.
+    details: dict = attr.Factory(dict)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "profile": self.profile,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "peak_rss_bytes": self.peak_rss_bytes,
+        } | self.details
+
+
+class Timings:
+    """
+    Records the wall time, CPU time and peak RSS of the instrumented blocks of a run, each tagged
+    with the profile being processed (see analysis.logging.profile_context).  Blocks may run in
+    several threads at the same time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings: List[Timing] = []
+
+    @contextmanager
+    def measure(self, name: str, **details) -> Iterator[dict]:
+        """
+        :param name: what is measured, e.g. "query" or "top_level".
+        :param details: recorded with the timing, the block can add to the returned dict (e.g. the
+         rows returned by a query).
+        """
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield details
+        except BaseException:
+            details["failed"] = True
+            raise
+        finally:
+            timing = Timing(
+                name=name,
+                profile=profile_name.get(),
+                wall_seconds=time.perf_counter() - wall_start,
+                cpu_seconds=time.process_time() - cpu_start,
+                peak_rss_bytes=peak_rss_bytes(),
+                details=details,
+            )
+            with self._lock:
+                self._timings.append(timing)
+
+    @property
+    def timings(self) -> List[Timing]:
+        with self._lock:
+            return list(self._timings)
+
+    def clear(self):
+        with self._lock:
+            self._timings = []
+
+    def totals(self) -> List[dict]:
+        """
+        :return: the timings summed per profile and name, the slowest first.  The rows and bytes
+         are summed, the peak RSS is the largest.
+        """
+        totals = {}
+        for timing in self.timings:
+            total = totals.setdefault(
+                (timing.profile, timing.name),
+                {
+                    "profile": timing.profile,
+                    "name": timing.name,
+                    "count": 0,
+                    "wall_seconds": 0.0,
+                    "cpu_seconds": 0.0,
+                    "peak_rss_bytes": None,
+                    "rows": 0,
+                    "bytes": 0,
+                    "total_bytes_processed": 0,
+                },
+            )
+            total["count"] += 1
+            total["wall_seconds"] += timing.wall_seconds
+            total["cpu_seconds"] += timing.cpu_seconds
+            if timing.peak_rss_bytes is not None:
+                total["peak_rss_bytes"] = max(total["peak_rss_bytes"] or 0, timing.peak_rss_bytes)
+            for key in ["rows", "bytes", "total_bytes_processed"]:
+                total[key] += timing.details.get(key) or 0
+        return sorted(totals.values(), key=lambda total: total["wall_seconds"], reverse=True)
+
+    def write_summary(self, path: str, **run_info) -> str:
+        """
+        Writes the timings and their totals as JSON.
+        :param run_info: recorded at the top level of the summary, e.g. the processing date.
+        :return: the path of the file written.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        summary = run_info | {
+            "peak_rss_bytes": peak_rss_bytes(),
+            "totals": self.totals(),
+            "timings": [timing.to_dict() for timing in self.timings],
+        }
+        with open(path, "w") as fh:
+            json.dump(summary, fh, indent=2, default=str)
+        return path
+
+    def table(self) -> str:
+        """:return: the totals as a text table, the slowest first."""
+        lines = [
+            f"{'profile':<32}{'name':<16}{'count':>7}{'wall (s)':>11}{'cpu (s)':>11}"
+            f"{'rows':>11}{'processed (MB)':>16}{'peak rss (MB)':>15}"
+        ]
+        for total in self.totals():
+            peak_rss = total["peak_rss_bytes"]
+            lines.append(
+                f"{str(total['profile'] or '-')[:31]:<32}{total['name'][:15]:<16}"
+                f"{total['count']:>7}{total['wall_seconds']:>11.2f}{total['cpu_seconds']:>11.2f}"
+                f"{total['rows']:>11}{total['total_bytes_processed'] / 2**20:>16.1f}"
+                f"{peak_rss / 2**20 if peak_rss is not None else float('nan'):>15.1f}"
+            )
+        return "\n".join(lines)
+
+
+# Records the timings of the whole run.
+timings = Timings()
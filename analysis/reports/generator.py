@@ -1,4 +1,5 @@
 import os
+import threading
 from datetime import datetime
 from pathlib import Path
 
@@ -12,6 +13,10 @@ from adjustText import adjust_text
 
 # TODO GLE A lot more thought needs to be added to the report/notfication.
 
+# pyplot keeps the current figure in global state, reports built concurrently (see
+# run-analysis --parallel-profiles) draw their plots one at a time.
+_plot_lock = threading.Lock()
+
 
 class ReportGenerator:
     def __init__(
@@ -58,8 +63,9 @@ class ReportGenerator:
         p = self.input_path / "templates"
         env = Environment(loader=FileSystemLoader(p))
         template = env.get_template(self.template)
-        abs_bar_plot_path = self.build_png_bar_plot()
-        scatter_plot_paths = self.build_png_scatter_plots()
+        with _plot_lock:
+            abs_bar_plot_path = self.build_png_bar_plot()
+            scatter_plot_paths = self.build_png_scatter_plots()
 
         with open(self.output_html, "w") as fh:
             fh.write(
@@ -97,10 +103,10 @@ class ReportGenerator:
             verbose=True,
         )
 
-        # clean png plots
+        # clean png plots, only this report's as other reports may be being built.
         for filename in os.listdir(self.output_dir):
             file = os.path.join(self.output_dir, filename)
-            if file.endswith("png"):
+            if filename.startswith(self.filename_base) and file.endswith("png"):
                 os.remove(file)
 
         return self.output_pdf
@@ -0,0 +1,60 @@
+"""
+Compares the row by row (`DataFrame.apply(..., axis=1)`) and whole column calculation of the
+contribution to overall change, change in proportion and change distance.
+
+Run from the repository root: python benchmarks/bench_dimension_calculations.py
+"""
+import timeit
+
+import numpy as np
+from pandas import DataFrame
+
+from analysis.detection.explorer.dimension_evaluator import DimensionEvaluator
+
+SIZES = [1_000, 10_000, 100_000]
+REPEAT = 3
+
+CALCULATIONS = {
+    "contribution_to_overall_change": DimensionEvaluator._contribution_to_overall_change,
+    "change_in_proportion": DimensionEvaluator._change_in_proportion,
+    "change_distance": DimensionEvaluator._change_distance,
+}
+
+
+def get_values(size: int) -> DataFrame:
+    """One row per dimension value, in the layout the calculations use."""
+    rng = np.random.default_rng(42)
+    df = DataFrame(
+        {
+            "current": rng.integers(0, 10_000, size),
+            "baseline": rng.integers(0, 10_000, size),
+        }
+    )
+    df["parent_current"] = df["current"].sum()
+    df["parent_baseline"] = df["baseline"].sum()
+    df["contrib_to_overall_change"] = DimensionEvaluator._contribution_to_overall_change(df)
+    df["change_in_proportion"] = DimensionEvaluator._change_in_proportion(df)
+    return df
+
+
+def best_time(func) -> float:
+    return min(timeit.repeat(func, number=1, repeat=REPEAT))
+
+
+def main():
+    print(f"{'calculation':<32}{'values':>10}{'apply (s)':>12}{'columns (s)':>14}{'speedup':>10}")
+    for name, calculation in CALCULATIONS.items():
+        for size in SIZES:
+            df = get_values(size)
+            row_by_row = best_time(lambda: df.apply(calculation, axis=1))
+            whole_column = best_time(lambda: calculation(df))
+            # Squaring a single float (x ** 2) can differ from squaring a column in the last bit.
+            np.testing.assert_allclose(df.apply(calculation, axis=1), calculation(df), rtol=1e-15)
+            print(
+                f"{name:<32}{size:>10}{row_by_row:>12.4f}{whole_column:>14.6f}"
+                f"{row_by_row / whole_column:>9.0f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+Times and memory profiles the one dimension, multi dimension and all dimension evaluators on
+synthetic data, across a grid of dimension counts, dimension cardinalities and skews.  The values
+are served by a stubbed MetricLookupManager so no queries are run, the timings only cover the
+evaluators.  The results are written as JSON, a previous results file can be compared against.
+
+Run from the repository root:
+    python benchmarks/bench_evaluators.py --output before.json
+    python benchmarks/bench_evaluators.py --output after.json --compare before.json
+"""
+import argparse
+import itertools
+import json
+import logging
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from analysis.configuration.configs import AnalysisProfile, Dataset, PercentChange
+from analysis.configuration.processing_dates import ProcessingDateRange
+from analysis.data.metric import MetricLookupManager
+from analysis.data.sources import MetricSource
+from analysis.detection.explorer.all_dimensions import AllDimensionEvaluator
+from analysis.detection.explorer.multiple_dimensions import MultiDimensionEvaluator
+from analysis.detection.explorer.one_dimension import OneDimensionEvaluator
+from analysis.logging import logger
+
+DIMENSIONS = [2, 4, 6]
+CARDINALITIES = [10, 100, 1_000]
+SKEWS = [0.0, 1.5]
+ROWS = 100_000
+REPEAT = 3
+
+BASELINE_PERIOD = ProcessingDateRange(datetime(2022, 4, 2), datetime(2022, 4, 2))
+CURRENT_PERIOD = ProcessingDateRange(datetime(2022, 4, 9), datetime(2022, 4, 9))
+
+
+def generate_facts(
+    dimensions: int, cardinality: int, skew: float, rows: int = ROWS, seed: int = 42
+) -> DataFrame:
+    """
+    :param dimensions: the number of dimensions, named dim_0, dim_1, ...
+    :param cardinality: the number of values of each dimension.
+    :param skew: the k-th value of a dimension is drawn with a weight of 1 / k ** skew, 0 draws the
+     values uniformly and larger skews concentrate the rows on the first values.
+    :return: one row per draw of a value of every dimension (as the value's index), with its
+     'baseline' and 'current' metric values.  The first value of dim_0 drops by half in the
+     current period so there is a change to explain.
+    """
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, cardinality + 1) ** skew
+    weights /= weights.sum()
+    facts = DataFrame(
+        {f"dim_{i}": rng.choice(cardinality, rows, p=weights) for i in range(dimensions)}
+    )
+    facts["baseline"] = rng.integers(1, 1_000, rows)
+    change = rng.normal(1.0, 0.05, rows)
+    change[facts["dim_0"].to_numpy() == 0] *= 0.5
+    facts["current"] = np.rint(facts["baseline"] * change).astype("int64")
+    return facts
+
+
+def get_values(facts: DataFrame, dimensions: list) -> DataFrame:
+    """
+    :return: the current and baseline values by the dimensions, in the layout the queries return
+     them ('dimension_value_n', 'metric_value' and 'timeframe' columns, the dimension values
+     categorical, see arrow_to_dataframe).
+    """
+    cardinality = int(facts[dimensions].max().max()) + 1
+    categories = [f"v{k}" for k in range(cardinality)]
+    totals = facts.groupby(dimensions, sort=False)[["current", "baseline"]].sum().reset_index()
+    frames = []
+    for timeframe in ["current", "baseline"]:
+        frame = DataFrame(
+            {
+                f"dimension_value_{i}": pd.Categorical.from_codes(totals[dim], categories)
+                for i, dim in enumerate(dimensions)
+            }
+        )
+        frame["metric_value"] = totals[timeframe]
+        frame["timeframe"] = timeframe
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+def get_parent_df(facts: DataFrame) -> DataFrame:
+    """:return: the top level values, see DimensionEvaluator."""
+    return DataFrame(
+        {
+            "metric_value": [facts["current"].sum(), facts["baseline"].sum()],
+            "timeframe": ["current", "baseline"],
+        }
+    )
+
+
+class NoQuerySource(MetricSource):
+    """Guards against a query slipping into the benchmark, the values are all synthetic."""
+
+    name = "synthetic"
+
+    def run_query(self, query: str, metric: str) -> DataFrame:
+        raise RuntimeError(
+            "SyntheticMetricLookup must never query, its values are all served from the facts"
+        )
+
+
+class SyntheticMetricLookup(MetricLookupManager):
+    """
+    Serves the values of each dimension set from the synthetic facts.  The values are aggregated
+    once and copied for each lookup, as prefetched values are, so the timings do not include the
+    aggregation.
+    """
+
+    def __init__(self, facts: DataFrame):
+        super().__init__(source=NoQuerySource())
+        self.facts = facts
+        self._values: Dict[tuple, DataFrame] = {}
+        self.lookups = 0
+
+    def get_metric_by_dimensions_with_date_ranges(
+        self,
+        metric_name: str,
+        table_name: str,
+        app_name: str,
+        date_ranges: Dict[str, ProcessingDateRange],
+        dimensions: list,
+        excluded_dimensions: list = None,
+        included_dimension_values: list = None,
+        folded_dimension_values: list = None,
+    ) -> DataFrame:
+        self.lookups += 1
+        key = tuple(dimensions)
+        if key not in self._values:
+            self._values[key] = self._label_dimensions(
+                get_values(self.facts, dimensions), dimensions
+            )
+        return self.fold_dimension_values(
+            self.filter_dimension_values(
+                self._values[key].copy(), dimensions, included_dimension_values
+            ),
+            dimensions,
+            folded_dimension_values,
+        )
+
+
+def get_profile(dimensions: int, lazy: bool = False) -> AnalysisProfile:
+    return AnalysisProfile(
+        name=f"synthetic {dimensions} dimensions",
+        percent_change=PercentChange(
+            contrib_to_overall_change_threshold_percent=1,
+            dimensions=[f"dim_{i}" for i in range(dimensions)],
+            sort_by=["change_distance", "contrib_to_overall_change", "percent_change"],
+            lazy_dimension_permutations=lazy,
+        ),
+        dataset=Dataset(
+            metric_name="synthetic_metric",
+            table_name="synthetic",
+            app_name="synthetic",
+            period_offset=0,
+            current_period=1,
+            baseline_period=7,
+        ),
+    )
+
+
+def measure(func: Callable[[], dict], repeat: int) -> Tuple[float, int]:
+    """
+    :return: the best wall time over the repeats and the peak memory traced by tracemalloc,
+     measured in a separate run as tracing slows the evaluation down.
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(seconds), peak
+
+
+def bench_case(dimensions: int, cardinality: int, skew: float, rows: int, repeat: int) -> list:
+    """:return: one result per evaluator for the grid point."""
+    facts = generate_facts(dimensions, cardinality, skew, rows)
+    parent_df = get_parent_df(facts)
+    metric_lookup = SyntheticMetricLookup(facts)
+
+    def evaluator_kwargs(lazy: bool = False) -> dict:
+        return {
+            "profile": get_profile(dimensions, lazy),
+            "baseline_period": BASELINE_PERIOD,
+            "current_period": CURRENT_PERIOD,
+            "parent_df": parent_df,
+            "metric_lookup": metric_lookup,
+        }
+
+    # Run once to aggregate the values of every dimension set, and for the evaluations the multi
+    # and all dimension evaluators take.
+    one_dim_evaluation = OneDimensionEvaluator(**evaluator_kwargs()).evaluate()
+    multi_dim_evaluation = MultiDimensionEvaluator(**evaluator_kwargs()).evaluate()
+    MultiDimensionEvaluator(**evaluator_kwargs(lazy=True)).evaluate(one_dim_evaluation)
+
+    evaluations = {
+        "one_dimension": lambda: OneDimensionEvaluator(**evaluator_kwargs()).evaluate(),
+        "multi_dimension": lambda: MultiDimensionEvaluator(**evaluator_kwargs()).evaluate(),
+        "multi_dimension_lazy": lambda: MultiDimensionEvaluator(
+            **evaluator_kwargs(lazy=True)
+        ).evaluate(one_dim_evaluation),
+        "all_dimensions": lambda: AllDimensionEvaluator(
+            get_profile(dimensions), one_dim_evaluation, multi_dim_evaluation
+        ).evaluate(),
+    }
+    results = []
+    for evaluator, evaluate in evaluations.items():
+        metric_lookup.lookups = 0
+        seconds, peak = measure(evaluate, repeat)
+        results.append(
+            {
+                "evaluator": evaluator,
+                "dimensions": dimensions,
+                "cardinality": cardinality,
+                "skew": skew,
+                "rows": rows,
+                # Rows of the pairs of dimensions, the largest values evaluated.
+                "pair_values": len(metric_lookup._values[("dim_0", "dim_1")]),
+                "lookups_per_run": metric_lookup.lookups // (repeat + 1),
+                "seconds": seconds,
+                "peak_memory_bytes": peak,
+            }
+        )
+    return results
+
+
+def result_key(result: dict) -> tuple:
+    return tuple(result[key] for key in ["evaluator", "dimensions", "cardinality", "skew", "rows"])
+
+
+def git_commit() -> str:
+    """:return: the commit benchmarked, None outside of a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--dimensions", type=int, nargs="+", default=DIMENSIONS)
+    parser.add_argument("--cardinalities", type=int, nargs="+", default=CARDINALITIES)
+    parser.add_argument("--skews", type=float, nargs="+", default=SKEWS)
+    parser.add_argument("--rows", type=int, default=ROWS, help="synthetic rows per grid point")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--output", help="defaults to bench_evaluators_<commit>.json")
+    parser.add_argument("--compare", help="a previous results file to compare the timings with")
+    args = parser.parse_args()
+    # The evaluators log every dimension set.
+    logger.setLevel(logging.WARNING)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as fh:
+            previous = {result_key(result): result for result in json.load(fh)["results"]}
+
+    print(
+        f"{'evaluator':<22}{'dims':>5}{'card':>7}{'skew':>6}{'pair rows':>11}{'seconds':>10}"
+        f"{'peak (MB)':>11}" + (f"{'speedup':>10}" if previous else "")
+    )
+    results = []
+    for dimensions, cardinality, skew in itertools.product(
+        args.dimensions, args.cardinalities, args.skews
+    ):
+        for result in bench_case(dimensions, cardinality, skew, args.rows, args.repeat):
+            results.append(result)
+            line = (
+                f"{result['evaluator']:<22}{dimensions:>5}{cardinality:>7}{skew:>6.1f}"
+                f"{result['pair_values']:>11}{result['seconds']:>10.4f}"
+                f"{result['peak_memory_bytes'] / 2**20:>11.1f}"
+            )
+            before = previous.get(result_key(result))
+            if before is not None:
+                line += f"{before['seconds'] / result['seconds']:>9.2f}x"
+            print(line)
+
+    commit = git_commit()
+    output = args.output or f"bench_evaluators_{commit or 'unknown'}.json"
+    with open(output, "w") as fh:
+        json.dump(
+            {
+                "commit": commit,
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "pandas": pd.__version__,
+                "repeat": args.repeat,
+                "results": results,
+            },
+            fh,
+            indent=2,
+        )
+    print(f"Results written to: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ from analysis.configuration.processing_dates import ProcessingDateRange
 
 import pytest
 from pandas import DataFrame, concat
+from pandas.testing import assert_series_equal
 from pathlib import Path
 
 FIXTURE_PATH = Path(__file__).with_name("fixtures")
@@ -122,6 +123,28 @@ def multi_dimension_df(mock_current_multi_dimension_values, mock_baseline_multi_
     return concat([mock_current_multi_dimension_values, mock_baseline_multi_dimension_values])
 
 
+@pytest.fixture
+def finest_dimension_df():
+    """The values at the finest grain of the country, channel and os dimensions."""
+    rows = [
+        ["mx", "release", "android", "baseline", 10],
+        ["mx", "release", "android", "current", 20],
+        ["mx", "beta", "ios", "baseline", 10],
+        ["mx", "beta", "ios", "current", 9],
+        ["ca", "release", "ios", "baseline", 10],
+        ["ca", "release", "ios", "current", 12],
+        ["ca", "beta", "android", "baseline", 10],
+        ["ca", "beta", "android", "current", 8],
+    ]
+    cols = ["country", "channel", "os", "timeframe", "metric_value"]
+    return DataFrame(rows, columns=cols)
+
+
+@pytest.fixture
+def finest_parent_df(finest_dimension_df):
+    return finest_dimension_df.groupby("timeframe")["metric_value"].sum().reset_index()
+
+
 @pytest.fixture
 def mock_baseline_period():
     return ProcessingDateRange(
@@ -140,7 +163,29 @@ def mock_current_period():
 
 @pytest.fixture
 def get_mock_get_current_and_baseline_values_func(multi_dimension_df):
-    def mock_get_current_and_baseline_values(dimensions: list):
+    def mock_get_current_and_baseline_values(dimensions: list, folded_dimension_values=None):
         return multi_dimension_df
 
     return mock_get_current_and_baseline_values
+
+
+@pytest.fixture
+def assert_metric_values():
+    def assert_metric_values(result: DataFrame, expected: DataFrame):
+        """
+        Compares the metric in expected with the same metric of the result of
+        DimensionEvaluator._calculate_metrics, by dimension value regardless of the row order.
+        :param expected: 'dimension_value_n' and 'dimension_n' columns and one metric column.
+        """
+        value_cols = [col for col in expected.columns if col.startswith("dimension_value_")]
+        (metric,) = [col for col in expected.columns if not col.startswith("dimension_")]
+        assert_series_equal(
+            result.set_index(value_cols)[metric].sort_index(),
+            expected.set_index(value_cols)[metric].sort_index(),
+            check_dtype=False,
+        )
+        for col in expected.columns:
+            if col.startswith("dimension_") and col not in value_cols:
+                assert list(result[col].unique()) == list(expected[col].unique())
+
+    return assert_metric_values
@@ -12,10 +12,10 @@ def test_change_distance_one_dim(
     dimension_df,
     mock_parent_df,
     mock_analysis_profile,
+    assert_metric_values,
 ):
     # calculation =
     # sqrt((change_in_proportion^2) + (contrib_to_overall_change^2))
-    # sorted by value descending.
     rows = [
         ["mx", "country", 50.0572],
         ["ca", "country", 37.5209],
@@ -23,39 +23,14 @@ def test_change_distance_one_dim(
     ]
 
     cols = ["dimension_value_0", "dimension_0", "change_distance"]
-    expected_df = DataFrame(rows, columns=cols)
-
-    one_dim_evaluation = OneDimensionEvaluator(
+    result = OneDimensionEvaluator(
         profile=mock_analysis_profile,
         baseline_period=mock_baseline_period,
         current_period=mock_current_period,
         parent_df=mock_parent_df,
-    )
+    )._calculate_metrics(dimension_df)
 
-    contr_to_change = one_dim_evaluation._calculate_contribution_to_overall_change(
-        current_df=dimension_df
-    )
-
-    change_in_proportion = one_dim_evaluation._calculate_change_in_proportion(
-        current_df=dimension_df
-    )
-
-    multi_dim_evaluation = MultiDimensionEvaluator(
-        profile=mock_analysis_profile,
-        baseline_period=mock_baseline_period,
-        current_period=mock_current_period,
-        parent_df=mock_parent_df,
-    )
-
-    change_distance_df = AllDimensionEvaluator(
-        profile=mock_analysis_profile,
-        one_dim_evaluation=one_dim_evaluation,
-        multi_dim_evaluation=multi_dim_evaluation,
-    )._calculate_change_distance(
-        contrib_to_overall_change_df=contr_to_change, change_in_proportion_df=change_in_proportion
-    )
-
-    assert_frame_equal(expected_df, change_distance_df)
+    assert_metric_values(result, DataFrame(rows, columns=cols))
 
 
 def test_change_distance_multi_dim(
@@ -64,10 +39,10 @@ def test_change_distance_multi_dim(
     multi_dimension_df,
     mock_parent_df,
     mock_analysis_profile,
+    assert_metric_values,
 ):
     # calculation =
     # sqrt((change_in_proportion^2) + (contrib_to_overall_change^2))
-    # sorted by value descending.
     rows = [
         ["ca", "release", "country", "channel", 87.6447],
         ["us", "release", "country", "channel", 87.5262],
@@ -86,39 +61,14 @@ def test_change_distance_multi_dim(
         "dimension_1",
         "change_distance",
     ]
-    expected_df = DataFrame(rows, columns=cols)
-
-    one_dim_evaluation = OneDimensionEvaluator(
+    result = MultiDimensionEvaluator(
         profile=mock_analysis_profile,
         baseline_period=mock_baseline_period,
         current_period=mock_current_period,
         parent_df=mock_parent_df,
-    )
+    )._calculate_metrics(multi_dimension_df)
 
-    multi_dim_evaluation = MultiDimensionEvaluator(
-        profile=mock_analysis_profile,
-        baseline_period=mock_baseline_period,
-        current_period=mock_current_period,
-        parent_df=mock_parent_df,
-    )
-
-    contr_to_change = multi_dim_evaluation._calculate_contribution_to_overall_change(
-        current_df=multi_dimension_df
-    )
-
-    change_in_proportion = multi_dim_evaluation._calculate_change_in_proportion(
-        current_df=multi_dimension_df
-    )
-
-    change_distance_df = AllDimensionEvaluator(
-        profile=mock_analysis_profile,
-        one_dim_evaluation=one_dim_evaluation,
-        multi_dim_evaluation=multi_dim_evaluation,
-    )._calculate_change_distance(
-        contrib_to_overall_change_df=contr_to_change, change_in_proportion_df=change_in_proportion
-    )
-
-    assert_frame_equal(expected_df, change_distance_df)
+    assert_metric_values(result, DataFrame(rows, columns=cols))
 
 
 def get_mock_get_current_and_baseline_values_one_dim_func(dimension_df):
@@ -129,7 +79,7 @@ def get_mock_get_current_and_baseline_values_one_dim_func(dimension_df):
 
 
 def get_mock_get_current_and_baseline_values_multi_dim_func(multi_dimension_df):
-    def mock_get_current_and_baseline_values(dimensions: list):
+    def mock_get_current_and_baseline_values(dimensions: list, folded_dimension_values=None):
         return multi_dimension_df
 
     return mock_get_current_and_baseline_values
@@ -186,3 +136,62 @@ def test_limit_results(
     all_dim_evaluation = AllDimEvaluator.evaluate()
 
     assert len(all_dim_evaluation.get("overall_change_calc")) == 2
+
+
+def test_evaluate_labels_and_ranking(mock_analysis_profile):
+    mock_analysis_profile.percent_change.limit_results = 3
+
+    one_dim_df = DataFrame(
+        {
+            "dimension_value_0": ["ca", "us"],
+            "dimension_0": ["country", "country"],
+            "percent_change": [10.0, -5.0],
+            "change_distance": [12.5, 40.0],
+        }
+    )
+    multi_dim_df = DataFrame(
+        {
+            "dimension_value_0": ["ca", "mx"],
+            "dimension_value_1": ["release", "beta"],
+            "dimension_0": ["country", "country"],
+            "dimension_1": ["channel", "channel"],
+            "percent_change": [20.0, 1.0],
+            "change_distance": [12.5, 50.0],
+        }
+    )
+    one_dim_evaluation = {"dimension_calc": {"country": one_dim_df.copy()}}
+    multi_dim_evaluation = {"multi_dimension_calc": {("country", "channel"): multi_dim_df.copy()}}
+
+    all_dim_evaluation = AllDimensionEvaluator(
+        profile=mock_analysis_profile,
+        one_dim_evaluation=one_dim_evaluation,
+        multi_dim_evaluation=multi_dim_evaluation,
+    ).evaluate()
+
+    # Equal distances keep their evaluation order, one dimension results first.
+    expected_df = DataFrame(
+        {
+            "percent_change": [1.0, -5.0, 10.0],
+            "change_distance": [50.0, 40.0, 12.5],
+            "dimension": ["country | channel", "country", "country"],
+            "dimension_value": ["mx | beta", "us", "ca"],
+        },
+        index=[1, 1, 0],
+    )
+    assert_frame_equal(expected_df, all_dim_evaluation["overall_change_calc"])
+
+    # The evaluations used for the per dimension results are left as they were.
+    assert_frame_equal(one_dim_df, one_dim_evaluation["dimension_calc"]["country"])
+    assert_frame_equal(
+        multi_dim_df, multi_dim_evaluation["multi_dimension_calc"][("country", "channel")]
+    )
+
+
+def test_largest():
+    df = DataFrame({"value": [1.0, None, 3.0, 1.0, 3.0, 2.0]})
+
+    for n in range(1, 8):
+        assert_frame_equal(
+            AllDimensionEvaluator._largest(df, "value", n),
+            df.sort_values("value", ascending=False, kind="stable").head(n),
+        )
@@ -0,0 +1,57 @@
+import os
+import time
+
+from pandas import DataFrame
+from pandas.testing import assert_frame_equal
+
+from analysis.data.cache import QueryCache
+
+
+def get_mock_df() -> DataFrame:
+    rows = [
+        ["mx", "current", 19.0],
+        [None, "baseline", 15.0],
+    ]
+    cols = ["dimension_value_0", "timeframe", "metric_value"]
+    return DataFrame(rows, columns=cols)
+
+
+def test_get_put(tmp_path):
+    cache = QueryCache(directory=tmp_path)
+    assert cache.get("SELECT 1") is None
+
+    cache.put("SELECT 1", get_mock_df())
+    assert_frame_equal(get_mock_df(), cache.get("SELECT 1"))
+    # The key is the exact SQL.
+    assert cache.get("SELECT  1") is None
+
+
+def test_ttl(tmp_path):
+    cache = QueryCache(directory=tmp_path, ttl_seconds=60)
+    cache.put("SELECT 1", get_mock_df())
+    assert cache.get("SELECT 1") is not None
+
+    # Age the entry beyond the TTL.
+    path = cache._path("SELECT 1")
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    assert cache.get("SELECT 1") is None
+    assert not path.exists()
+
+
+def test_lru_eviction(tmp_path):
+    cache = QueryCache(directory=tmp_path)
+    for i in range(3):
+        cache.put(f"SELECT {i}", get_mock_df())
+        # Make the access order explicit, SELECT 0 is the least recently used.
+        path = cache._path(f"SELECT {i}")
+        os.utime(path, (time.time() - 100 + i, time.time()))
+
+    cache.get("SELECT 0")
+    entry_size = cache._path("SELECT 0").stat().st_size
+    cache.max_size_bytes = 2 * entry_size
+    cache.evict()
+
+    assert cache.get("SELECT 0") is not None
+    assert cache.get("SELECT 1") is None
+    assert cache.get("SELECT 2") is not None
@@ -0,0 +1,59 @@
+from datetime import datetime
+
+from pandas import DataFrame
+from pandas.testing import assert_frame_equal
+
+from analysis.data.checkpoint import Checkpoint
+
+
+def test_run_and_resume(tmp_path):
+    calls = []
+
+    def stage():
+        calls.append(1)
+        return {"dimension_calc": {("country",): DataFrame({"metric_value": [1.0]})}}
+
+    output = Checkpoint(tmp_path).run("one_dim", stage)
+    assert Checkpoint(tmp_path).completed("one_dim")
+
+    # Run again unless resuming.
+    Checkpoint(tmp_path).run("one_dim", stage)
+    assert len(calls) == 2
+    resumed = Checkpoint(tmp_path, resume=True).run("one_dim", stage)
+    assert len(calls) == 2
+    assert_frame_equal(
+        output["dimension_calc"][("country",)], resumed["dimension_calc"][("country",)]
+    )
+
+
+def test_resume_none_output(tmp_path):
+    Checkpoint(tmp_path).run("top_level", lambda: None)
+    assert Checkpoint(tmp_path, resume=True).run("top_level", lambda: {"not": "resumed"}) is None
+
+
+def test_resume_invalid_output(tmp_path):
+    Checkpoint(tmp_path).run("report", lambda: str(tmp_path / "missing.pdf"))
+    output = Checkpoint(tmp_path, resume=True).run(
+        "report", lambda: "rebuilt.pdf", is_valid=lambda path: path.endswith("rebuilt.pdf")
+    )
+    assert output == "rebuilt.pdf"
+
+
+def test_resume_unreadable_output(tmp_path):
+    Checkpoint(tmp_path).run("one_dim", lambda: {"dimension_calc": {}})
+    # Truncated, as if the run was killed while writing it.
+    path = tmp_path / "one_dim.pkl"
+    path.write_bytes(path.read_bytes()[:5])
+
+    assert Checkpoint(tmp_path, resume=True).run("one_dim", lambda: "rerun") == "rerun"
+
+
+def test_without_directory():
+    checkpoint = Checkpoint(resume=True)
+    assert checkpoint.run("top_level", lambda: 1) == 1
+    assert not checkpoint.completed("top_level")
+
+
+def test_for_profile(tmp_path):
+    checkpoint = Checkpoint.for_profile(tmp_path, datetime(2022, 6, 1), "Fenix / DAU")
+    assert checkpoint.directory == tmp_path / "2022-06-01" / "Fenix_DAU"
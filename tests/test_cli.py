@@ -1,6 +1,24 @@
+import copy
+import json
+import logging
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import pytest
+from click.testing import CliRunner
+from pandas import DataFrame
+from pandas.testing import assert_frame_equal
+
+from analysis import cli
 from analysis.cli import exceeds_top_level_percent_change
 from analysis.configuration.configs import Config
 from analysis.configuration.processing_dates import ProcessingDateRange
+from analysis.data.checkpoint import Checkpoint
+from analysis.data.cube import MetricCube
+from analysis.data.metric import MetricLookupManager
+from analysis.data.sources import DuckDBSource
+from analysis.logging import ProfileFilter, profile_context
+from analysis.logging.timings import timings
 
 
 def test_exceeds_top_level_percent_change(
@@ -15,3 +33,266 @@ def test_exceeds_top_level_percent_change(
     assert not exceeds_top_level_percent_change(
         mock_config.analysis_profile, {"top_level_percent_change": 0.1}
     )
+
+
+@pytest.mark.parametrize("parallel_profiles", [1, 3])
+def test_run_analysis_isolates_profile_errors(
+    monkeypatch, tmp_path, mock_config: Config, parallel_profiles
+):
+    configs = []
+    for name in ["desktop", "fenix", "ios"]:
+        config = copy.deepcopy(mock_config)
+        config.analysis_profile.name = name
+        configs.append(config)
+    processed = []
+
+    def mock_find_significant_dimensions(profile, **kwargs):
+        processed.append(profile.name)
+        with timings.measure("top_level"):
+            if profile.name == "fenix":
+                raise ValueError("query failed")
+        return {}
+
+    monkeypatch.setattr(cli.Loader, "load_all_config_files", lambda path: configs)
+    monkeypatch.setattr(cli, "find_significant_dimensions", mock_find_significant_dimensions)
+
+    result = CliRunner().invoke(
+        cli.run_analysis,
+        [
+            str(tmp_path),
+            "--date=2022-06-01",
+            "--no-cache",
+            f"--local-data-dir={tmp_path}",
+            f"--parallel-profiles={parallel_profiles}",
+            f"--run-dir={tmp_path / 'runs'}",
+            "--timings",
+        ],
+    )
+
+    # The other profiles are still processed, the run fails at the end.
+    assert sorted(processed) == ["desktop", "fenix", "ios"]
+    assert str(result.exception) == "Processing error occurred."
+
+    # The timings are written and printed even though the run failed.
+    (summary_path,) = (tmp_path / "runs" / "2022-06-01").glob("timings_*.json")
+    summary = json.loads(summary_path.read_text())
+    assert summary["date"] == "2022-06-01"
+    assert sorted(timing["profile"] for timing in summary["timings"]) == [
+        "desktop",
+        "fenix",
+        "ios",
+    ]
+    assert "wall (s)" in result.output
+
+
+def test_run_analysis_profiling(monkeypatch, tmp_path, mock_config: Config):
+    mock_config.analysis_profile.name = "fenix"
+    monkeypatch.setattr(cli.Loader, "load_all_config_files", lambda path: [mock_config])
+    monkeypatch.setattr(cli, "find_significant_dimensions", lambda profile, **kwargs: {})
+    args = [
+        str(tmp_path),
+        "--date=2022-06-01",
+        "--no-cache",
+        f"--local-data-dir={tmp_path}",
+        f"--run-dir={tmp_path / 'runs'}",
+        f"--profile-dir={tmp_path / 'profiles'}",
+        "--profile-cpu",
+        "--profile-memory",
+    ]
+
+    result = CliRunner().invoke(cli.run_analysis, args)
+
+    assert result.exception is None
+    assert sorted(path.name for path in (tmp_path / "profiles").iterdir()) == [
+        "fenix_2022-06-01.prof",
+        "fenix_2022-06-01_memory.txt",
+    ]
+    # Only the timings summary is written, the stages are not checkpointed unless asked to.
+    (run_path,) = (tmp_path / "runs" / "2022-06-01").iterdir()
+    assert run_path.name.startswith("timings_")
+
+    result = CliRunner().invoke(cli.run_analysis, args + ["--checkpoint"])
+    assert result.exception is None
+    assert (tmp_path / "runs" / "2022-06-01" / "fenix").is_dir()
+
+    # tracemalloc traces the whole process, concurrent profiles cannot be told apart.
+    result = CliRunner().invoke(cli.run_analysis, args + ["--parallel-profiles=2"])
+    assert result.exit_code == 2
+    assert "--parallel-profiles 1" in result.output
+
+
+def test_profile_filter():
+    record = logging.LogRecord("overwatch", logging.INFO, __file__, 1, "message", None, None)
+
+    with profile_context("fenix"):
+        ProfileFilter().filter(record)
+    assert record.profile == "[fenix] "
+
+    ProfileFilter().filter(record)
+    assert record.profile == ""
+
+
+def test_backfill(monkeypatch, tmp_path, mock_config: Config):
+    pytest.importorskip("duckdb")
+    pytest.importorskip("sqlglot")
+    rows = [
+        [date(2022, 5, 1) + timedelta(days=days), "Fenix", "MX", "release", 10 + days]
+        for days in range(40)
+    ]
+    DataFrame(
+        rows, columns=["submission_date", "app_name", "country", "channel", "dau"]
+    ).to_parquet(tmp_path / "moz-fx-data-shared-prod.telemetry.active_users_aggregates.parquet")
+    mock_config.analysis_profile.dataset.table_name = "active_user_aggregates"
+    mock_config.analysis_profile.dataset.app_name = "Fenix"
+    mock_config.analysis_profile.dataset.metric_name = "dau"
+
+    queries = []
+    run_query = DuckDBSource.run_query
+
+    def mock_run_query(self, query, metric):
+        queries.append(query)
+        return run_query(self, query, metric)
+
+    evaluated = []
+
+    def mock_find_significant_dimensions(profile, baseline_period, current_period, **kwargs):
+        # The values are rolled up from the cube, as the nightly run would query them.
+        assert isinstance(kwargs["metric_lookup"], MetricCube)
+        top_level = kwargs["metric_lookup"].get_top_level_metrics_from_dimensions(
+            metric_name="dau",
+            table_name="active_user_aggregates",
+            app_name="Fenix",
+            date_ranges={"current": current_period, "baseline": baseline_period},
+            dimensions=["country"],
+        )["all"]
+        evaluated.append(top_level.set_index("timeframe")["metric_value"].to_dict())
+        # Nothing significant for 2022-06-03.
+        if current_period.end_date.day == 2:
+            return {}
+        return {"overall_change_calc": DataFrame({"dimension": ["country"], "change": [1.0]})}
+
+    monkeypatch.setattr(DuckDBSource, "run_query", mock_run_query)
+    monkeypatch.setattr(cli.Loader, "load_all_config_files", lambda path: [mock_config])
+    monkeypatch.setattr(cli, "find_significant_dimensions", mock_find_significant_dimensions)
+
+    result = CliRunner().invoke(
+        cli.backfill,
+        [
+            str(tmp_path),
+            "--start=2022-06-01",
+            "--end=2022-06-04",
+            f"--output-dir={tmp_path / 'backfill'}",
+            f"--local-data-dir={tmp_path}",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+
+    # One query for all the dates.
+    assert len(queries) == 1
+    # 2022-05-30 (current) and the average of 2022-05-16 to 2022-05-22 (baseline) for 2022-06-01.
+    assert evaluated[0] == {"current": 39.0, "baseline": 28.0}
+    assert len(evaluated) == 4
+
+    df = pd.read_parquet(tmp_path / "backfill" / "Config_with_all_fields.parquet")
+    assert list(df["processing_date"].astype(str)) == ["2022-06-01", "2022-06-02", "2022-06-04"]
+    assert list(df["rank"]) == [1, 1, 1]
+
+
+def test_backfill_matches_run_analysis(monkeypatch, tmp_path, mock_config: Config):
+    pytest.importorskip("duckdb")
+    pytest.importorskip("sqlglot")
+    # NULL and unknown countries, and excluded values (CA and nightly).
+    rows = []
+    for days in range(40):
+        day = date(2022, 5, 1) + timedelta(days=days)
+        for country, channel, dau in [
+            ("MX", "release", 100),
+            ("MX", "beta", 20),
+            ("US", "release", 80),
+            ("US", "nightly", 10),
+            ("CA", "release", 30),
+            ("XX", "beta", 5),
+            (None, "release", 7),
+        ]:
+            # MX release drops in the last days.
+            drop = 40 if country == "MX" and channel == "release" and days >= 28 else 0
+            rows.append([day, "Fenix", country, channel, dau + days % 7 - drop])
+    DataFrame(
+        rows, columns=["submission_date", "app_name", "country", "channel", "dau"]
+    ).to_parquet(tmp_path / "moz-fx-data-shared-prod.telemetry.active_users_aggregates.parquet")
+    mock_config.analysis_profile.dataset.table_name = "active_user_aggregates"
+    mock_config.analysis_profile.dataset.app_name = "Fenix"
+    mock_config.analysis_profile.dataset.metric_name = "dau"
+
+    evaluations = []
+    monkeypatch.setattr(
+        cli, "issue_report", lambda evaluation, **kwargs: evaluations.append(evaluation)
+    )
+    assert cli.process_profile(
+        mock_config, datetime(2022, 6, 1), metric_source=DuckDBSource(tmp_path)
+    )
+    processing_info, failed_dates = cli.backfill_profile(
+        mock_config.analysis_profile,
+        [datetime(2022, 6, 1)],
+        MetricLookupManager(source=DuckDBSource(tmp_path)),
+    )
+
+    assert failed_dates == []
+    ((processing_date, _, _, overall_change_calc),) = processing_info
+    assert processing_date == date(2022, 6, 1)
+    assert len(overall_change_calc) > 0
+    assert_frame_equal(overall_change_calc, evaluations[0]["overall_change_calc"])
+
+
+def test_issue_report_resume(
+    monkeypatch,
+    tmp_path,
+    mock_config: Config,
+    mock_baseline_period: ProcessingDateRange,
+    mock_current_period: ProcessingDateRange,
+):
+    built = []
+    published = []
+
+    class MockReportGenerator:
+        def __init__(self, **kwargs):
+            pass
+
+        def build_pdf_report(self):
+            path = tmp_path / "report.pdf"
+            path.write_text("report")
+            built.append(path)
+            return str(path)
+
+    class MockSlackNotifier:
+        fail = True
+
+        def __init__(self, output_pdf, config):
+            self.output_pdf = output_pdf
+
+        def publish_pdf_report(self):
+            if self.fail:
+                raise ConnectionError("Slack is down")
+            published.append(self.output_pdf)
+
+    monkeypatch.setattr(cli, "ReportGenerator", MockReportGenerator)
+    monkeypatch.setattr(cli, "SlackNotifier", MockSlackNotifier)
+    kwargs = {
+        "profile": mock_config.analysis_profile,
+        "notif_config": mock_config.notification,
+        "evaluation": {},
+        "baseline_period": mock_baseline_period,
+        "current_period": mock_current_period,
+    }
+
+    with pytest.raises(ConnectionError):
+        cli.issue_report(checkpoint=Checkpoint(tmp_path / "run"), **kwargs)
+
+    # Only the failed stage is run again.
+    MockSlackNotifier.fail = False
+    cli.issue_report(checkpoint=Checkpoint(tmp_path / "run", resume=True), **kwargs)
+    assert len(built) == 1
+    assert published == [str(tmp_path / "report.pdf")]
+
+    cli.issue_report(checkpoint=Checkpoint(tmp_path / "run", resume=True), **kwargs)
+    assert len(published) == 1
@@ -0,0 +1,49 @@
+from unittest.mock import MagicMock
+
+import pyarrow as pa
+
+from analysis.data.clients import BigQueryClientRegistry
+from analysis.data.sources import BigQuerySource
+from analysis.detection.results.bigquery_client import BigQueryClient
+
+
+def test_one_client_per_project():
+    created = []
+
+    def factory(project_id):
+        created.append(project_id)
+        return MagicMock()
+
+    clients = BigQueryClientRegistry(factory=factory)
+    assert clients.get() is clients.get()
+    assert clients.get("project-a") is clients.get("project-a")
+    assert clients.get("project-a") is not clients.get()
+    assert created == [None, "project-a"]
+
+    clients.clear()
+    clients.get()
+    assert created == [None, "project-a", None]
+
+
+def test_source_uses_registered_client():
+    client = MagicMock()
+    client.query.return_value.to_arrow.return_value = pa.table({"metric_value": [1.0, 2.0]})
+    clients = BigQueryClientRegistry(factory=lambda project_id: None)
+    clients.register(client)
+
+    source = BigQuerySource(clients=clients)
+    source.run_query("SELECT 1", "dau")
+    df = source.run_query("SELECT 2", "dau")
+
+    assert list(df["metric_value"]) == [1.0, 2.0]
+    assert [call.args[0] for call in client.query.call_args_list] == ["SELECT 1", "SELECT 2"]
+
+
+def test_results_client_uses_registry(monkeypatch):
+    client = MagicMock()
+    clients = BigQueryClientRegistry(factory=lambda project_id: client)
+    monkeypatch.setattr("analysis.detection.results.bigquery_client.bigquery_clients", clients)
+
+    bigquery = BigQueryClient(project_id="automated-analysis-dev", dataset="overwatch")
+    assert bigquery.client is client
+    assert BigQueryClient(project_id="automated-analysis-dev", dataset="other").client is client
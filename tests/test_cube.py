@@ -0,0 +1,109 @@
+from datetime import datetime
+
+from pandas import DataFrame
+
+from analysis.configuration.processing_dates import ProcessingDateRange
+from analysis.data.cube import MetricCube
+from analysis.data.metric import MetricLookupManager
+
+
+def get_mock_cube(rows: list, date_ranges: dict, queries: list) -> MetricCube:
+    cols = ["submission_date", "timeframe", "country", "channel", "metric_value"]
+
+    def mock_run_query(query, metric, date_range):
+        queries.append(query)
+        return DataFrame(rows, columns=cols)
+
+    metric_lookup = MetricLookupManager()
+    metric_lookup.run_query = mock_run_query
+    cube = MetricCube(metric_lookup)
+    cube.load(
+        metric_name="dau",
+        table_name="active_user_aggregates",
+        app_name="Fenix",
+        date_ranges=date_ranges,
+        dimensions=["country", "channel"],
+    )
+    return cube
+
+
+def test_rollup_single_day():
+    current = ProcessingDateRange(
+        start_date=datetime.strptime("2022-04-09", "%Y-%m-%d"),
+        end_date=datetime.strptime("2022-04-10", "%Y-%m-%d"),
+    )
+    baseline = ProcessingDateRange(
+        start_date=datetime.strptime("2022-04-02", "%Y-%m-%d"),
+        end_date=datetime.strptime("2022-04-03", "%Y-%m-%d"),
+    )
+    rows = [
+        ["2022-04-09", "current", "mx", "release", 10],
+        ["2022-04-09", "current", "mx", "beta", 9],
+        ["2022-04-09", "current", "ca", "release", 24],
+        ["2022-04-09", "current", "us", None, 81],
+        ["2022-04-02", "baseline", "mx", "release", 15],
+        ["2022-04-02", "baseline", "ca", "release", 21],
+        ["2022-04-02", "baseline", "us", None, 80],
+    ]
+    queries = []
+    cube = get_mock_cube(rows, {"current": current, "baseline": baseline}, queries)
+
+    df = cube.get_metric_by_dimensions_with_date_ranges(
+        metric_name="dau",
+        table_name="active_user_aggregates",
+        app_name="Fenix",
+        date_ranges={"current": current, "baseline": baseline},
+        dimensions=["country"],
+    )
+    values = df.set_index(["timeframe", "dimension_value_0"])["metric_value"].to_dict()
+    assert values == {
+        ("current", "mx"): 19,
+        ("current", "ca"): 24,
+        ("current", "us"): 81,
+        ("baseline", "mx"): 15,
+        ("baseline", "ca"): 21,
+        ("baseline", "us"): 80,
+    }
+    assert list(df["dimension_0"].unique()) == ["country"]
+
+    df = cube.get_metric_by_dimensions_with_date_range(
+        metric_name="dau",
+        table_name="active_user_aggregates",
+        app_name="Fenix",
+        date_range=current,
+        dimensions=["channel", "country"],
+    )
+    values = df.set_index(["dimension_value_0", "dimension_value_1"])["metric_value"].to_dict()
+    assert values == {
+        ("release", "mx"): 10,
+        ("beta", "mx"): 9,
+        ("release", "ca"): 24,
+        ("None", "us"): 81,
+    }
+
+    # All the rollups are answered by the query used to load the cube.
+    assert len(queries) == 1
+
+
+def test_rollup_window_average():
+    current = ProcessingDateRange(
+        start_date=datetime.strptime("2022-04-01", "%Y-%m-%d"),
+        end_date=datetime.strptime("2022-04-10", "%Y-%m-%d"),
+    )
+    rows = [
+        # mx has 9 days of values, only the last 7 are averaged.
+        ["2022-04-0" + str(day), "current", "mx", "release", day]
+        for day in range(1, 10)
+    ] + [
+        # ca has no value on the last day of the range so is not reported.
+        ["2022-04-07", "current", "ca", "release", 5],
+        # us is missing days, the last 7 rows (not days) are averaged.
+        ["2022-04-01", "current", "us", "release", 2],
+        ["2022-04-09", "current", "us", "release", 4],
+        ["2022-04-09", "current", "us", "beta", 6],
+    ]
+    cube = get_mock_cube(rows, {"current": current}, [])
+
+    df = cube.rollup(["country"])
+    values = df.set_index("dimension_value_0")["metric_value"].to_dict()
+    assert values == {"mx": sum(range(3, 10)) / 7, "us": (2 + 10) / 2}
@@ -1,4 +1,4 @@
-from analysis.configuration.configs import Config
+from analysis.configuration.configs import Config, LongTailBucket
 
 
 def test_load_config(mock_config: Config):
@@ -31,6 +31,7 @@ def test_load_config(mock_config: Config):
     assert mock_config.analysis_profile.dataset.period_offset == 14
     assert mock_config.analysis_profile.dataset.current_period == 1
     assert mock_config.analysis_profile.dataset.baseline_period == 7
+    assert mock_config.analysis_profile.dataset.fetch_mode == "dimension_set"
 
     assert len(mock_config.analysis_profile.percent_change.exclude_dimension_values) == 2
     excl = mock_config.analysis_profile.percent_change.exclude_dimension_values[0]
@@ -48,6 +49,10 @@ def test_load_config(mock_config: Config):
     assert excl["exclusion_short_desc"] == "Ignore nightly channel"
     assert excl["exclusion_reason"] == "Only need to monitor major releases."
 
+    assert mock_config.analysis_profile.percent_change.long_tail_buckets == [
+        LongTailBucket(dimension="app_version", max_cardinality=20, min_share=0.001)
+    ]
+
     assert mock_config.notification
     assert mock_config.notification.report
     assert mock_config.notification.report.template == "report_version2.html.j2"
@@ -0,0 +1,165 @@
+import pytest
+from pandas import DataFrame
+
+from analysis.data.metric import MetricLookupManager
+from analysis.errors import NoDataFoundForDateRangeError
+
+
+def get_mock_run_query_func(df: DataFrame, queries: list):
+    def mock_run_query(query, metric, date_range):
+        queries.append(query)
+        return df.copy()
+
+    return mock_run_query
+
+
+def test_get_metric_by_dimensions_with_date_ranges(mock_baseline_period, mock_current_period):
+    rows = [
+        ["mx", "current", 19],
+        ["mx", "baseline", 15],
+        [None, "current", 3],
+    ]
+    cols = ["dimension_value_0", "timeframe", "metric_value"]
+    queries = []
+    manager = MetricLookupManager()
+    manager.run_query = get_mock_run_query_func(DataFrame(rows, columns=cols), queries)
+
+    df = manager.get_metric_by_dimensions_with_date_ranges(
+        metric_name="dau",
+        table_name="active_user_aggregates",
+        app_name="Fenix",
+        date_ranges={"current": mock_current_period, "baseline": mock_baseline_period},
+        dimensions=["country"],
+    )
+
+    # Both date ranges are scanned by a single query.
+    assert len(queries) == 1
+    assert '"current" AS timeframe' in queries[0]
+    assert '"baseline" AS timeframe' in queries[0]
+    assert list(df["timeframe"]) == ["current", "baseline", "current"]
+    assert list(df["dimension_0"].unique()) == ["country"]
+    assert list(df["dimension_value_0"]) == ["mx", "mx", "None"]
+
+
+def test_get_metric_with_date_ranges_missing_timeframe(mock_baseline_period, mock_current_period):
+    queries = []
+    manager = MetricLookupManager()
+    manager.run_query = get_mock_run_query_func(
+        DataFrame([["current", 124]], columns=["timeframe", "metric_value"]), queries
+    )
+
+    with pytest.raises(NoDataFoundForDateRangeError):
+        manager.get_metric_with_date_ranges(
+            metric_name="dau",
+            table_name="active_user_aggregates",
+            app_name="Fenix",
+            date_ranges={"current": mock_current_period, "baseline": mock_baseline_period},
+        )
+
+
+def test_get_metric_by_dimension_sets_with_date_ranges(mock_baseline_period, mock_current_period):
+    # grouping_id has bit n set when dimension n is aggregated over:
+    # country = 2 (channel aggregated), channel = 1 (country aggregated), country/channel = 0
+    rows = [
+        ["mx", None, 2, "current", 19],
+        ["mx", None, 2, "baseline", 15],
+        [None, "beta", 1, "current", 10],
+        [None, "beta", 1, "baseline", 12],
+        ["mx", "beta", 0, "current", 5],
+        ["mx", "beta", 0, "baseline", 3],
+        ["mx", None, 0, "current", 1],
+        ["mx", None, 0, "baseline", 1],
+    ]
+    cols = ["country", "channel", "grouping_id", "timeframe", "metric_value"]
+    queries = []
+    manager = MetricLookupManager()
+    manager.run_query = get_mock_run_query_func(DataFrame(rows, columns=cols), queries)
+
+    dimension_sets = [("country",), ("channel",), ("channel", "country")]
+    manager.prefetch_dimension_sets(
+        metric_name="dau",
+        table_name="active_user_aggregates",
+        app_name="Fenix",
+        date_ranges={"current": mock_current_period, "baseline": mock_baseline_period},
+        dimension_sets=dimension_sets,
+    )
+    assert len(queries) == 1
+    assert "GROUPING SETS" in queries[0]
+
+    for dim_set in dimension_sets:
+        df = manager.get_metric_by_dimensions_with_date_ranges(
+            metric_name="dau",
+            table_name="active_user_aggregates",
+            app_name="Fenix",
+            date_ranges={"current": mock_current_period, "baseline": mock_baseline_period},
+            dimensions=list(dim_set),
+        )
+        for i, dim in enumerate(dim_set):
+            assert list(df[f"dimension_{i}"].unique()) == [dim]
+        assert "grouping_id" not in df.columns
+
+    # Answered from the prefetched results, no further queries issued.
+    assert len(queries) == 1
+    assert list(df["dimension_value_0"]) == ["beta", "beta", "None", "None"]
+    assert list(df["dimension_value_1"]) == ["mx", "mx", "mx", "mx"]
+    assert list(df["metric_value"]) == [5, 3, 1, 1]
+
+
+def test_get_top_level_metrics_with_date_ranges(mock_baseline_period, mock_current_period):
+    rows = [
+        ["current", 105.0, 19.0, 3, 1, 124.0],
+        ["baseline", 101.0, None, 3, 0, 116.0],
+    ]
+    cols = [
+        "timeframe",
+        "metric_value_dimension_values_excluded",
+        "metric_value_dimension_values_only",
+        "rows_dimension_values_excluded",
+        "rows_dimension_values_only",
+        "metric_value",
+    ]
+    queries = []
+    manager = MetricLookupManager()
+    manager.run_query = get_mock_run_query_func(DataFrame(rows, columns=cols), queries)
+    kwargs = {
+        "metric_name": "dau",
+        "table_name": "active_user_aggregates",
+        "app_name": "Fenix",
+        "date_ranges": {"current": mock_current_period, "baseline": mock_baseline_period},
+    }
+
+    values = manager.get_top_level_metrics_with_date_ranges(**kwargs)
+    assert list(values.keys()) == ["all"]
+    assert "SUM(IF(" not in queries[0]
+
+    # The variants are all computed by one query, a variant missing a timeframe is an error.
+    excluded_dimensions = [{"dimension": "country", "dim_values": ["MX"]}]
+    with pytest.raises(NoDataFoundForDateRangeError):
+        manager.get_top_level_metrics_with_date_ranges(
+            excluded_dimensions=excluded_dimensions, **kwargs
+        )
+    assert len(queries) == 2
+    assert "SUM(IF(" in queries[1]
+
+    # The window average of the previous days is not used when no rows matched on the last day.
+    rows[1][2] = 15.0
+    manager.run_query = get_mock_run_query_func(DataFrame(rows, columns=cols), queries)
+    with pytest.raises(NoDataFoundForDateRangeError):
+        manager.get_top_level_metrics_with_date_ranges(
+            excluded_dimensions=excluded_dimensions, **kwargs
+        )
+
+    rows[1][4] = 1
+    manager.run_query = get_mock_run_query_func(DataFrame(rows, columns=cols), queries)
+    values = manager.get_top_level_metrics_with_date_ranges(
+        excluded_dimensions=excluded_dimensions, **kwargs
+    )
+    assert len(queries) == 4
+    assert {
+        variant: df.set_index("timeframe")["metric_value"].to_dict()
+        for variant, df in values.items()
+    } == {
+        "all": {"current": 124.0, "baseline": 116.0},
+        "dimension_values_excluded": {"current": 105.0, "baseline": 101.0},
+        "dimension_values_only": {"current": 19.0, "baseline": 15.0},
+    }
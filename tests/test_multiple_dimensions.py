@@ -1,7 +1,14 @@
+import logging
+
+import pandas as pd
 from pandas import DataFrame
 from pandas._testing import assert_frame_equal
 
+from analysis.configuration.configs import LongTailBucket
+from analysis.data.metric import MetricLookupManager
+from analysis.detection.explorer.dimension_evaluator import worker_pool
 from analysis.detection.explorer.multiple_dimensions import MultiDimensionEvaluator
+from analysis.logging import logger, profile_context
 
 
 def test_percent_change(
@@ -10,6 +17,7 @@ def test_percent_change(
     mock_current_period,
     multi_dimension_df,
     mock_analysis_profile,
+    assert_metric_values,
 ):
     rows = [
         ["mx", "nightly", 100.0, "country", "channel"],
@@ -29,15 +37,13 @@ def test_percent_change(
         "dimension_0",
         "dimension_1",
     ]
-    expected_df = DataFrame(rows, columns=cols)
-
-    percent_change = MultiDimensionEvaluator(
+    result = MultiDimensionEvaluator(
         profile=mock_analysis_profile,
         baseline_period=mock_baseline_period,
         current_period=mock_current_period,
         parent_df=mock_parent_df,
-    )._calculate_percent_change(df=multi_dimension_df)
-    assert_frame_equal(expected_df, percent_change)
+    )._calculate_metrics(multi_dimension_df)
+    assert_metric_values(result, DataFrame(rows, columns=cols))
 
 
 def test_calculate_contribution_to_overall_change(
@@ -46,6 +52,7 @@ def test_calculate_contribution_to_overall_change(
     multi_dimension_df,
     mock_parent_df,
     mock_analysis_profile,
+    assert_metric_values,
 ):
     # calculation =
     # 100 * (current_value - baseline_value) / abs(parent_baseline_value - parent_current_value)
@@ -67,16 +74,14 @@ def test_calculate_contribution_to_overall_change(
         "dimension_0",
         "dimension_1",
     ]
-    expected_df = DataFrame(rows, columns=cols)
-
-    contr_to_change = MultiDimensionEvaluator(
+    result = MultiDimensionEvaluator(
         profile=mock_analysis_profile,
         baseline_period=mock_baseline_period,
         current_period=mock_current_period,
         parent_df=mock_parent_df,
-    )._calculate_contribution_to_overall_change(current_df=multi_dimension_df)
+    )._calculate_metrics(multi_dimension_df)
 
-    assert_frame_equal(expected_df, contr_to_change)
+    assert_metric_values(result, DataFrame(rows, columns=cols))
 
 
 def test_change_in_proportion(
@@ -85,10 +90,10 @@ def test_change_in_proportion(
     multi_dimension_df,
     mock_parent_df,
     mock_analysis_profile,
+    assert_metric_values,
 ):
     # calculation =
     # 100 * ((current_value/parent_current_value) - (baseline_value/parent_baseline_value))
-    # sorted by abs value.
     rows = [
         ["ca", "release", 5.03337041, "country", "channel"],
         ["us", "nightly", -3.50389321, "country", "channel"],
@@ -108,16 +113,14 @@ def test_change_in_proportion(
         "dimension_0",
         "dimension_1",
     ]
-    expected_df = DataFrame(rows, columns=cols)
-
-    change_in_proportion = MultiDimensionEvaluator(
+    result = MultiDimensionEvaluator(
         profile=mock_analysis_profile,
         baseline_period=mock_baseline_period,
         current_period=mock_current_period,
         parent_df=mock_parent_df,
-    )._calculate_change_in_proportion(current_df=multi_dimension_df)
+    )._calculate_metrics(multi_dimension_df)
 
-    assert_frame_equal(expected_df, change_in_proportion)
+    assert_metric_values(result, DataFrame(rows, columns=cols))
 
 
 def test_dimension_permutation(
@@ -160,6 +163,7 @@ def test_diff(
     multi_dimension_df,
     mock_parent_df,
     mock_analysis_profile,
+    assert_metric_values,
 ):
     rows = [
         ["ca", "release", 7.0, "country", "channel"],
@@ -180,13 +184,251 @@ def test_diff(
         "dimension_0",
         "dimension_1",
     ]
-    expected_df = DataFrame(rows, columns=cols)
-
-    diff = MultiDimensionEvaluator(
+    result = MultiDimensionEvaluator(
         profile=mock_analysis_profile,
         baseline_period=mock_baseline_period,
         current_period=mock_current_period,
         parent_df=mock_parent_df,
-    )._calculate_diff(df=multi_dimension_df)
+    )._calculate_metrics(multi_dimension_df)
+
+    assert_metric_values(result, DataFrame(rows, columns=cols))
+
+
+def get_mock_get_values_by_dimensions_func(finest_df: DataFrame, fetched: list):
+    def mock_get_current_and_baseline_values(dimensions: list, folded_dimension_values=None):
+        fetched.append(tuple(dimensions))
+        df = (
+            finest_df.groupby(dimensions + ["timeframe"])["metric_value"]
+            .sum()
+            .reset_index()
+            .rename(columns={dim: f"dimension_value_{i}" for i, dim in enumerate(dimensions)})
+        )
+        for i, dim in enumerate(dimensions):
+            df[f"dimension_{i}"] = dim
+        df = MetricLookupManager.fold_dimension_values(df, dimensions, folded_dimension_values)
+        return df.astype({"metric_value": "float64"})
+
+    return mock_get_current_and_baseline_values
+
+
+def test_evaluate_dimension_depth(
+    mock_baseline_period,
+    mock_current_period,
+    mock_analysis_profile,
+    finest_dimension_df,
+    finest_parent_df,
+):
+    mock_analysis_profile.percent_change.dimensions = ["country", "channel", "os"]
+    mock_analysis_profile.percent_change.max_dimension_depth = 3
+    fetched = []
+    evaluator = MultiDimensionEvaluator(
+        profile=mock_analysis_profile,
+        baseline_period=mock_baseline_period,
+        current_period=mock_current_period,
+        parent_df=finest_parent_df,
+    )
+    evaluator._get_current_and_baseline_values = get_mock_get_values_by_dimensions_func(
+        finest_dimension_df, fetched
+    )
+    result = evaluator.evaluate()["multi_dimension_calc"]
+
+    # All the pairs are significant so their combination is evaluated.
+    assert len(fetched) == 4
+    assert sorted(result.keys(), key=len)[-1] == ("channel", "country", "os")
+    triple = result[("channel", "country", "os")]
+    assert list(triple.columns[:6]) == [
+        "index",
+        "dimension_0",
+        "dimension_1",
+        "dimension_2",
+        "dimension_value_0",
+        "dimension_value_1",
+    ]
+    assert triple.loc[0, "contrib_to_overall_change"] == 111.11
+
+
+def test_candidate_dimension_sets(mock_baseline_period, mock_current_period, mock_analysis_profile):
+    mock_analysis_profile.percent_change.dimensions = ["a", "b", "c", "d"]
+    evaluator = MultiDimensionEvaluator(
+        profile=mock_analysis_profile,
+        baseline_period=mock_baseline_period,
+        current_period=mock_current_period,
+        parent_df=DataFrame(),
+    )
+
+    def contrib(*values):
+        return DataFrame({"contrib_to_overall_change": list(values)})
+
+    pair_results = {
+        ("a", "b"): contrib(50.0, -10.0),
+        ("a", "c"): contrib(-60.0),
+        ("b", "c"): contrib(40.0),
+        ("a", "d"): contrib(20.0),
+        ("b", "d"): contrib(30.0),
+        # Nothing exceeded the threshold, no combination containing c and d is evaluated.
+        ("c", "d"): contrib(),
+    }
+    assert evaluator._candidate_dimension_sets(pair_results, 3) == [
+        ("a", "b", "c"),
+        ("a", "b", "d"),
+    ]
+
+    # The candidates with the most significant parents are kept.
+    mock_analysis_profile.percent_change.max_combinations_per_level = 1
+    assert evaluator._candidate_dimension_sets(pair_results, 3) == [("a", "b", "c")]
 
-    assert_frame_equal(expected_df, diff)
+
+def test_evaluate_workers(
+    mock_baseline_period,
+    mock_current_period,
+    mock_analysis_profile,
+    finest_dimension_df,
+    finest_parent_df,
+):
+    mock_analysis_profile.percent_change.dimensions = ["country", "channel", "os"]
+    mock_analysis_profile.percent_change.max_dimension_depth = 3
+
+    def get_evaluation(executor=None) -> dict:
+        evaluator = MultiDimensionEvaluator(
+            profile=mock_analysis_profile,
+            baseline_period=mock_baseline_period,
+            current_period=mock_current_period,
+            parent_df=finest_parent_df,
+            executor=executor,
+        )
+        evaluator._get_current_and_baseline_values = get_mock_get_values_by_dimensions_func(
+            finest_dimension_df, []
+        )
+        return evaluator.evaluate()["multi_dimension_calc"]
+
+    class Records(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.records = []
+
+        def emit(self, record: logging.LogRecord):
+            self.records.append(record)
+
+    expected = get_evaluation()
+    handler = Records()
+    logger.addHandler(handler)
+    try:
+        # The pool is shared by the evaluations, the workers log through this process.
+        with worker_pool(2) as executor, profile_context("workers"):
+            results = [get_evaluation(executor), get_evaluation(executor)]
+    finally:
+        logger.removeHandler(handler)
+
+    for result in results:
+        assert list(result.keys()) == list(expected.keys())
+        for dimension_set in expected:
+            assert_frame_equal(expected[dimension_set], result[dimension_set])
+
+    worker_records = [record for record in handler.records if record.processName != "MainProcess"]
+    assert worker_records
+    assert all(record.profile_name == "workers" for record in worker_records)
+
+
+def test_evaluate_long_tail(mock_baseline_period, mock_current_period, mock_analysis_profile):
+    versions = {"100": (50, 60), "99": (30, 20), "98": (10, 6), "97": (5, 7), "96": (4, 1)}
+    rows = []
+    for country, scale in [("ca", 1), ("mx", 2)]:
+        for version, (baseline, current) in versions.items():
+            rows.append([country, version, "baseline", baseline * scale])
+            rows.append([country, version, "current", current * scale])
+    finest_df = DataFrame(rows, columns=["country", "app_version", "timeframe", "metric_value"])
+    parent_df = finest_df.groupby("timeframe")["metric_value"].sum().reset_index()
+
+    mock_analysis_profile.percent_change.dimensions = ["country", "app_version"]
+    mock_analysis_profile.percent_change.contrib_to_overall_change_threshold_percent = 0
+    mock_analysis_profile.percent_change.limit_results = 100
+    mock_analysis_profile.percent_change.long_tail_buckets = [
+        LongTailBucket(dimension="app_version", max_cardinality=3, min_share=0.1)
+    ]
+    evaluator = MultiDimensionEvaluator(
+        profile=mock_analysis_profile,
+        baseline_period=mock_baseline_period,
+        current_period=mock_current_period,
+        parent_df=parent_df,
+    )
+    get_values = get_mock_get_values_by_dimensions_func(finest_df, [])
+    fetched = []
+
+    def mock_get_current_and_baseline_values(dimensions: list, folded_dimension_values=None):
+        fetched.append((tuple(dimensions), folded_dimension_values))
+        # The dimension values are categorical when retrieved, with categories that may be unused.
+        df = get_values(dimensions)
+        for col in evaluator.dimension_value_cols(df):
+            df[col] = pd.Categorical(df[col], categories=list(df[col].unique()) + ["unused"])
+        return MetricLookupManager.fold_dimension_values(df, dimensions, folded_dimension_values)
+
+    evaluator._get_current_and_baseline_values = mock_get_current_and_baseline_values
+
+    result = evaluator.evaluate()["multi_dimension_calc"][("app_version", "country")]
+
+    # 98 has less than 10% of the total, 97 and 96 are not in the 3 largest.  The values kept are
+    # chosen from the values of app_version on its own, the rest is folded by the lookup.
+    assert fetched == [
+        (("app_version",), None),
+        (("app_version", "country"), [{"dimension": "app_version", "dim_values": ["100", "99"]}]),
+    ]
+    # The long tail counts towards the totals but is not reported.
+    assert sorted(result["dimension_value_0"].unique()) == ["100", "99"]
+    row = result[(result["dimension_value_0"] == "99") & (result["dimension_value_1"] == "mx")]
+    # The overall change is 3 * (94 - 99), the totals include the long tail.
+    assert row["contrib_to_overall_change"].iloc[0] == -133.33
+
+
+def test_evaluate_lazy(
+    mock_baseline_period,
+    mock_current_period,
+    mock_analysis_profile,
+    finest_dimension_df,
+    finest_parent_df,
+):
+    mock_analysis_profile.percent_change.dimensions = ["country", "channel", "os"]
+    mock_analysis_profile.percent_change.contrib_to_overall_change_threshold_percent = 0
+
+    fetched = []
+
+    def mock_get_current_and_baseline_values(
+        dimensions: list, included_dimension_values=None, folded_dimension_values=None
+    ):
+        fetched.append((tuple(dimensions), included_dimension_values))
+        df = finest_dimension_df
+        for included in included_dimension_values:
+            df = df[df[included["dimension"]].isin(included["dim_values"])]
+        return get_mock_get_values_by_dimensions_func(df, [])(dimensions)
+
+    evaluator = MultiDimensionEvaluator(
+        profile=mock_analysis_profile,
+        baseline_period=mock_baseline_period,
+        current_period=mock_current_period,
+        parent_df=finest_parent_df,
+    )
+    evaluator._get_current_and_baseline_values = mock_get_current_and_baseline_values
+    one_dim_evaluation = {
+        "dimension_calc": {
+            "country": DataFrame({"dimension_value_0": ["mx"]}),
+            "channel": DataFrame({"dimension_value_0": ["release"]}),
+            # No significant values, none of the pairs with os are evaluated.
+            "os": DataFrame({"dimension_value_0": []}),
+        }
+    }
+    result = evaluator.evaluate(one_dim_evaluation)["multi_dimension_calc"]
+
+    assert list(result.keys()) == [("channel", "country")]
+    assert fetched == [
+        (
+            ("channel", "country"),
+            [
+                {"dimension": "channel", "dim_values": ["release"]},
+                {"dimension": "country", "dim_values": ["mx"]},
+            ],
+        )
+    ]
+    values = result[("channel", "country")].set_index(["dimension_value_0", "dimension_value_1"])
+    # The values not retrieved count towards the totals, but are not reported.
+    assert values.loc[("release", "mx"), "contrib_to_overall_change"] == 111.11
+    assert ("Other", "Other") not in values.index
+    assert len(values) == 1
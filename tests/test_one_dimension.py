@@ -1,3 +1,6 @@
+import threading
+import time
+
 from pandas import DataFrame
 from pandas.testing import assert_frame_equal
 
@@ -5,7 +8,12 @@ from analysis.detection.explorer.one_dimension import OneDimensionEvaluator
 
 
 def test_percent_change(
-    mock_parent_df, mock_baseline_period, mock_current_period, dimension_df, mock_analysis_profile
+    mock_parent_df,
+    mock_baseline_period,
+    mock_current_period,
+    dimension_df,
+    mock_analysis_profile,
+    assert_metric_values,
 ):
     rows = [
         ["mx", 26.6667, "country"],
@@ -13,15 +21,13 @@ def test_percent_change(
         ["us", 1.25, "country"],
     ]
     cols = ["dimension_value_0", "percent_change", "dimension_0"]
-    expected_df = DataFrame(rows, columns=cols)
-
-    percent_change = OneDimensionEvaluator(
+    result = OneDimensionEvaluator(
         profile=mock_analysis_profile,
         baseline_period=mock_baseline_period,
         current_period=mock_current_period,
         parent_df=mock_parent_df,
-    )._calculate_percent_change(df=dimension_df)
-    assert_frame_equal(expected_df, percent_change)
+    )._calculate_metrics(dimension_df)
+    assert_metric_values(result, DataFrame(rows, columns=cols))
 
 
 def test_calculate_contribution_to_overall_change(
@@ -30,6 +36,7 @@ def test_calculate_contribution_to_overall_change(
     dimension_df,
     mock_parent_df,
     mock_analysis_profile,
+    assert_metric_values,
 ):
     # calculation =
     # 100 * (current_value - baseline_value) / abs((parent_baseline_value - parent_current_value))
@@ -39,16 +46,14 @@ def test_calculate_contribution_to_overall_change(
         ["us", 12.50, "country"],
     ]
     cols = ["dimension_value_0", "contrib_to_overall_change", "dimension_0"]
-    expected_df = DataFrame(rows, columns=cols)
-
-    contr_to_change = OneDimensionEvaluator(
+    result = OneDimensionEvaluator(
         profile=mock_analysis_profile,
         baseline_period=mock_baseline_period,
         current_period=mock_current_period,
         parent_df=mock_parent_df,
-    )._calculate_contribution_to_overall_change(current_df=dimension_df)
+    )._calculate_metrics(dimension_df)
 
-    assert_frame_equal(expected_df, contr_to_change)
+    assert_metric_values(result, DataFrame(rows, columns=cols))
 
 
 def test_change_in_proportion(
@@ -57,10 +62,10 @@ def test_change_in_proportion(
     dimension_df,
     mock_parent_df,
     mock_analysis_profile,
+    assert_metric_values,
 ):
     # calculation =
     # 100 * ((current_value/parent_current_value) - (baseline_value/parent_baseline_value))
-    # sorted by abs value.
     rows = [
         ["us", -3.6429366, "country"],
         ["mx", 2.39154616, "country"],
@@ -68,16 +73,14 @@ def test_change_in_proportion(
     ]
 
     cols = ["dimension_value_0", "change_in_proportion", "dimension_0"]
-    expected_df = DataFrame(rows, columns=cols)
-
-    change_in_proportion = OneDimensionEvaluator(
+    result = OneDimensionEvaluator(
         profile=mock_analysis_profile,
         baseline_period=mock_baseline_period,
         current_period=mock_current_period,
         parent_df=mock_parent_df,
-    )._calculate_change_in_proportion(current_df=dimension_df)
+    )._calculate_metrics(dimension_df)
 
-    assert_frame_equal(expected_df, change_in_proportion)
+    assert_metric_values(result, DataFrame(rows, columns=cols))
 
 
 def test_diff(
@@ -86,6 +89,7 @@ def test_diff(
     dimension_df,
     mock_parent_df,
     mock_analysis_profile,
+    assert_metric_values,
 ):
     rows = [
         ["mx", 4.0, "country"],
@@ -94,13 +98,103 @@ def test_diff(
     ]
 
     cols = ["dimension_value_0", "diff", "dimension_0"]
-    expected_df = DataFrame(rows, columns=cols)
-
-    diff = OneDimensionEvaluator(
+    result = OneDimensionEvaluator(
         profile=mock_analysis_profile,
         baseline_period=mock_baseline_period,
         current_period=mock_current_period,
         parent_df=mock_parent_df,
-    )._calculate_diff(df=dimension_df)
+    )._calculate_metrics(dimension_df)
 
-    assert_frame_equal(expected_df, diff)
+    assert_metric_values(result, DataFrame(rows, columns=cols))
+
+
+def test_evaluate_concurrent(
+    mock_parent_df, mock_baseline_period, mock_current_period, dimension_df, mock_analysis_profile
+):
+    def get_evaluation(max_concurrent_queries: int, barrier: threading.Barrier = None) -> dict:
+        def mock_get_current_and_baseline_values(dimension: str):
+            if barrier:
+                # Only passes once both queries are running at the same time.
+                barrier.wait()
+            # The first dimension completes last.
+            time.sleep(0.1 if dimension == "country" else 0)
+            return dimension_df.assign(dimension_0=dimension)
+
+        evaluator = OneDimensionEvaluator(
+            profile=mock_analysis_profile,
+            baseline_period=mock_baseline_period,
+            current_period=mock_current_period,
+            parent_df=mock_parent_df,
+            max_concurrent_queries=max_concurrent_queries,
+        )
+        evaluator._get_current_and_baseline_values = mock_get_current_and_baseline_values
+        return evaluator.evaluate()["dimension_calc"]
+
+    expected = get_evaluation(max_concurrent_queries=1)
+    result = get_evaluation(max_concurrent_queries=2, barrier=threading.Barrier(2, timeout=5))
+
+    assert list(result.keys()) == ["country", "channel"]
+    for dimension in expected:
+        assert_frame_equal(expected[dimension], result[dimension])
+
+
+def test_calculations_match_row_by_row():
+    df = DataFrame(
+        {
+            "current": [19, 24, 81, 0],
+            "baseline": [15, 21, 80, 3],
+            "parent_current": 124,
+            "parent_baseline": 119,
+        }
+    )
+    for calculation in [
+        OneDimensionEvaluator._contribution_to_overall_change,
+        OneDimensionEvaluator._change_in_proportion,
+    ]:
+        assert list(calculation(df)) == list(df.apply(calculation, axis=1))
+
+    df["contrib_to_overall_change"] = OneDimensionEvaluator._contribution_to_overall_change(df)
+    df["change_in_proportion"] = OneDimensionEvaluator._change_in_proportion(df)
+    assert list(OneDimensionEvaluator._change_distance(df).round(4)) == list(
+        df.apply(OneDimensionEvaluator._change_distance, axis=1).round(4)
+    )
+
+
+def test_calculate_metrics(
+    mock_parent_df, mock_baseline_period, mock_current_period, dimension_df, mock_analysis_profile
+):
+    evaluator = OneDimensionEvaluator(
+        profile=mock_analysis_profile,
+        baseline_period=mock_baseline_period,
+        current_period=mock_current_period,
+        parent_df=mock_parent_df,
+    )
+    result = evaluator._calculate_metrics(dimension_df)
+
+    # One row per dimension value ordered by dimension value.
+    assert list(result["index"]) == [0, 1, 2]
+    assert list(result["dimension_value_0"]) == ["ca", "mx", "us"]
+    assert list(result["dimension_0"]) == ["country"] * 3
+    assert list(result["baseline"]) == [21.0, 15.0, 80.0]
+    assert list(result["current"]) == [24.0, 19.0, 81.0]
+    assert list(result["diff"]) == [3.0, 4.0, 1.0]
+    assert list(result["percent_change"]) == [14.2857, 26.6667, 1.25]
+    assert list(result["contrib_to_overall_change"]) == [37.5, 50.0, 12.5]
+    assert list(result["change_in_proportion"]) == [1.25139043, 2.39154616, -3.6429366]
+    assert list(result["change_distance"]) == [37.5209, 50.0572, 13.02]
+
+
+def test_largest_by_sort_keys():
+    df = DataFrame(
+        {
+            "contrib_to_overall_change": [-5.0, 2.0, 5.0, None, -2.0, 5.0, 1.0],
+            "percent_change": [1.0, -3.0, 1.0, 4.0, 3.0, -2.0, 9.0],
+        }
+    )
+    sort_by = ["contrib_to_overall_change", "percent_change"]
+
+    for n in range(1, len(df) + 2):
+        assert_frame_equal(
+            OneDimensionEvaluator._largest(df, sort_by, n, key=abs),
+            df.sort_values(by=sort_by, key=abs, ascending=False, kind="stable").head(n),
+        )
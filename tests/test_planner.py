@@ -0,0 +1,86 @@
+import copy
+
+from pandas import DataFrame
+
+from analysis.data.metric import MetricLookupManager
+from analysis.data.planner import SharedScanPlanner
+
+
+def get_profiles(mock_analysis_profile) -> list:
+    profiles = []
+    for app_name, metric_name in [("Fenix", "dau"), ("Focus", "dau"), ("Fenix", "new_profiles")]:
+        profile = copy.deepcopy(mock_analysis_profile)
+        profile.name = f"{app_name} {metric_name}"
+        profile.dataset.table_name = "active_user_aggregates"
+        profile.dataset.app_name = app_name
+        profile.dataset.metric_name = metric_name
+        profile.percent_change.dimensions = ["country"]
+        profile.percent_change.include_dimension_permutations = False
+        profiles.append(profile)
+    return profiles
+
+
+def test_plan(mock_analysis_profile, mock_baseline_period, mock_current_period):
+    date_ranges = {"current": mock_current_period, "baseline": mock_baseline_period}
+    fenix_dau, focus_dau, fenix_new_profiles = get_profiles(mock_analysis_profile)
+    other_table = copy.deepcopy(fenix_dau)
+    other_table.dataset.table_name = "www_site_metrics_summary_v1"
+
+    groups = SharedScanPlanner(MetricLookupManager()).plan(
+        [
+            (fenix_dau, date_ranges, [("country",)]),
+            (other_table, date_ranges, [("country",)]),
+            (focus_dau, date_ranges, [("country",)]),
+            (fenix_new_profiles, date_ranges, [("country",)]),
+            (fenix_dau, date_ranges, [("country",), ("channel",)]),
+        ]
+    )
+
+    assert [[profile.name for profile, _, _ in group] for group in groups] == [
+        ["Fenix dau", "Focus dau", "Fenix new_profiles"]
+    ]
+
+
+def test_prefetch(mock_analysis_profile, mock_baseline_period, mock_current_period):
+    date_ranges = {"current": mock_current_period, "baseline": mock_baseline_period}
+    profiles = get_profiles(mock_analysis_profile)
+    rows = [
+        ["Fenix", "mx", 0, "current", 19, 3],
+        ["Fenix", "mx", 0, "baseline", 15, 1],
+        ["Focus", "mx", 0, "current", 1000, 5],
+        ["Focus", "mx", 0, "baseline", 900, 6],
+    ]
+    cols = ["app_name", "country", "grouping_id", "timeframe", "metric_value_0", "metric_value_1"]
+    queries = []
+
+    def mock_run_query(query, metric, date_range):
+        queries.append(query)
+        return DataFrame(rows, columns=cols)
+
+    metric_lookup = MetricLookupManager()
+    metric_lookup.run_query = mock_run_query
+    planner = SharedScanPlanner(metric_lookup)
+    planner.prefetch([(profile, date_ranges, [("country",)]) for profile in profiles])
+    assert len(queries) == 1
+    assert 'app_name IN ("Fenix", "Focus")' in queries[0]
+
+    values = {}
+    for profile in profiles:
+        df = planner.get_metric_lookup(
+            profile, date_ranges, [("country",)]
+        ).get_metric_by_dimensions_with_date_ranges(
+            metric_name=profile.dataset.metric_name,
+            table_name=profile.dataset.table_name,
+            app_name=profile.dataset.app_name,
+            date_ranges=date_ranges,
+            dimensions=["country"],
+            excluded_dimensions=profile.percent_change.exclude_dimension_values,
+        )
+        values[profile.name] = df.set_index("timeframe")["metric_value"].to_dict()
+    # Answered from the shared scan.
+    assert len(queries) == 1
+    assert values == {
+        "Fenix dau": {"current": 19, "baseline": 15},
+        "Focus dau": {"current": 1000, "baseline": 900},
+        "Fenix new_profiles": {"current": 3, "baseline": 1},
+    }
@@ -0,0 +1,34 @@
+import pstats
+import tracemalloc
+
+import pytest
+
+from analysis.logging.profiling import profiling
+
+
+def test_profiling(tmp_path):
+    with profiling(str(tmp_path), "fenix dau_2022-06-01", cpu=True, memory=True):
+        values = [list(range(100)) for _ in range(1000)]
+    assert len(values) == 1000
+
+    stats = pstats.Stats(str(tmp_path / "fenix_dau_2022-06-01.prof"))
+    assert stats.total_calls > 0
+    report = (tmp_path / "fenix_dau_2022-06-01_memory.txt").read_text()
+    assert report.startswith("Peak traced memory:")
+    assert "test_profiling.py" in report
+    assert not tracemalloc.is_tracing()
+
+
+def test_profiling_written_on_error(tmp_path):
+    with pytest.raises(ValueError):
+        with profiling(str(tmp_path), "fenix", memory=True):
+            raise ValueError("query failed")
+
+    assert [path.name for path in tmp_path.iterdir()] == ["fenix_memory.txt"]
+
+
+def test_profiling_disabled(tmp_path):
+    with profiling(str(tmp_path / "profiles"), "fenix"):
+        pass
+
+    assert not (tmp_path / "profiles").exists()
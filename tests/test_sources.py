@@ -0,0 +1,458 @@
+from datetime import date, datetime
+
+import pyarrow as pa
+import pytest
+from pandas import DataFrame
+
+from analysis.configuration.processing_dates import ProcessingDateRange
+from analysis.data.cube import MetricCube
+from analysis.data.metric import MetricLookupManager
+from analysis.data.sources import DuckDBSource, arrow_to_dataframe
+from analysis.detection.explorer.multiple_dimensions import MultiDimensionEvaluator
+from analysis.errors import NoDataFoundForDateRangeError
+
+
+def test_arrow_to_dataframe():
+    table = pa.table(
+        {
+            "dimension_value_0": ["mx", "ca", "mx", None],
+            "timeframe": ["current", "current", "baseline", "baseline"],
+            "submission_date": pa.array(
+                [date(2022, 4, 9), date(2022, 4, 9), date(2022, 4, 2), date(2022, 4, 2)]
+            ),
+            "metric_value": [19.0, 24.0, 15.0, 21.0],
+        }
+    )
+    df = arrow_to_dataframe(table)
+
+    assert df["dimension_value_0"].dtype == "category"
+    assert list(df["dimension_value_0"].cat.categories) == ["mx", "ca"]
+    assert df["timeframe"].dtype == "object"
+    assert df["submission_date"].dtype.kind == "M"
+    assert df["metric_value"].dtype == "float64"
+
+    values = MetricLookupManager.fillna_dimension_values(df["dimension_value_0"])
+    assert list(values) == ["mx", "ca", "mx", "None"]
+
+
+@pytest.fixture
+def local_data_dir(tmp_path):
+    pytest.importorskip("duckdb")
+    pytest.importorskip("sqlglot")
+
+    rows = [
+        [date(2022, 4, 2), "Fenix", "MX", "release", 15],
+        [date(2022, 4, 2), "Fenix", "CA", "release", 21],
+        [date(2022, 4, 2), "Fenix", "CA", None, 80],
+        [date(2022, 4, 9), "Fenix", "MX", "release", 19],
+        [date(2022, 4, 9), "Fenix", "CA", "release", 24],
+        [date(2022, 4, 9), "Fenix", "CA", None, 81],
+        [date(2022, 4, 9), "Focus", "CA", "release", 1000],
+    ]
+    cols = ["submission_date", "app_name", "country", "channel", "dau"]
+    DataFrame(rows, columns=cols).to_parquet(
+        tmp_path / "moz-fx-data-shared-prod.telemetry.active_users_aggregates.parquet"
+    )
+    return tmp_path
+
+
+@pytest.fixture
+def date_ranges():
+    return {
+        "current": ProcessingDateRange(
+            start_date=datetime.strptime("2022-04-09", "%Y-%m-%d"),
+            end_date=datetime.strptime("2022-04-10", "%Y-%m-%d"),
+        ),
+        "baseline": ProcessingDateRange(
+            start_date=datetime.strptime("2022-04-02", "%Y-%m-%d"),
+            end_date=datetime.strptime("2022-04-03", "%Y-%m-%d"),
+        ),
+    }
+
+
+def test_duckdb_top_level(local_data_dir, date_ranges):
+    df = MetricLookupManager(source=DuckDBSource(local_data_dir)).get_metric_with_date_ranges(
+        metric_name="dau",
+        table_name="active_user_aggregates",
+        app_name="Fenix",
+        date_ranges=date_ranges,
+        excluded_dimensions=[{"dimension": "country", "dim_values": ["MX"]}],
+    )
+    assert df.set_index("timeframe")["metric_value"].to_dict() == {
+        "current": 105,
+        "baseline": 101,
+    }
+
+
+def test_duckdb_by_dimensions(local_data_dir, date_ranges):
+    df = MetricLookupManager(
+        source=DuckDBSource(local_data_dir)
+    ).get_metric_by_dimensions_with_date_ranges(
+        metric_name="dau",
+        table_name="active_user_aggregates",
+        app_name="Fenix",
+        date_ranges=date_ranges,
+        dimensions=["channel"],
+    )
+    values = df.set_index(["timeframe", "dimension_value_0"])["metric_value"].to_dict()
+    assert values == {
+        ("current", "release"): 43,
+        ("current", "None"): 81,
+        ("baseline", "release"): 36,
+        ("baseline", "None"): 80,
+    }
+
+
+def test_duckdb_by_dimension_pair(local_data_dir, date_ranges):
+    df = MetricLookupManager(
+        source=DuckDBSource(local_data_dir)
+    ).get_metric_by_dimensions_with_date_ranges(
+        metric_name="dau",
+        table_name="active_user_aggregates",
+        app_name="Fenix",
+        date_ranges=date_ranges,
+        dimensions=["country", "channel"],
+    )
+    values = df.set_index(["timeframe", "dimension_value_0", "dimension_value_1"])[
+        "metric_value"
+    ].to_dict()
+    assert values == {
+        ("current", "MX", "release"): 19,
+        ("current", "CA", "release"): 24,
+        ("current", "CA", "None"): 81,
+        ("baseline", "MX", "release"): 15,
+        ("baseline", "CA", "release"): 21,
+        ("baseline", "CA", "None"): 80,
+    }
+
+
+def test_duckdb_by_dimension_pair_included_values(local_data_dir, date_ranges):
+    df = MetricLookupManager(
+        source=DuckDBSource(local_data_dir)
+    ).get_metric_by_dimensions_with_date_ranges(
+        metric_name="dau",
+        table_name="active_user_aggregates",
+        app_name="Fenix",
+        date_ranges=date_ranges,
+        dimensions=["country", "channel"],
+        included_dimension_values=[
+            {"dimension": "country", "dim_values": ["CA"]},
+            {"dimension": "channel", "dim_values": ["release", "beta"]},
+        ],
+    )
+    values = df.set_index(["timeframe", "dimension_value_0", "dimension_value_1"])[
+        "metric_value"
+    ].to_dict()
+    assert values == {
+        ("current", "CA", "release"): 24,
+        ("baseline", "CA", "release"): 21,
+    }
+
+
+def test_duckdb_lazy_dimension_permutations_null_value(
+    local_data_dir, date_ranges, mock_analysis_profile
+):
+    mock_analysis_profile.dataset.metric_name = "dau"
+    mock_analysis_profile.dataset.table_name = "active_user_aggregates"
+    mock_analysis_profile.dataset.app_name = "Fenix"
+    mock_analysis_profile.percent_change.exclude_dimension_values = None
+    mock_analysis_profile.percent_change.contrib_to_overall_change_threshold_percent = 0
+    evaluator = MultiDimensionEvaluator(
+        profile=mock_analysis_profile,
+        baseline_period=date_ranges["baseline"],
+        current_period=date_ranges["current"],
+        parent_df=DataFrame({"metric_value": [124, 116], "timeframe": ["current", "baseline"]}),
+        metric_lookup=MetricLookupManager(source=DuckDBSource(local_data_dir)),
+    )
+    # The NULL channel is reported as "None" by the one dimension evaluation.
+    one_dim_evaluation = {
+        "dimension_calc": {
+            "country": DataFrame({"dimension_value_0": ["CA"]}),
+            "channel": DataFrame({"dimension_value_0": ["None"]}),
+        }
+    }
+    result = evaluator.evaluate(one_dim_evaluation)["multi_dimension_calc"][("channel", "country")]
+
+    values = result.set_index(["dimension_value_0", "dimension_value_1"])
+    assert values.loc[("None", "CA"), "current"] == 81
+    assert values.loc[("None", "CA"), "baseline"] == 80
+
+
+def test_duckdb_top_level_variants(local_data_dir, date_ranges):
+    metric_lookup = MetricLookupManager(source=DuckDBSource(local_data_dir))
+    excluded_dimensions = [
+        {"dimension": "country", "dim_values": ["MX"]},
+        {"dimension": "channel", "dim_values": ["beta"]},
+    ]
+    kwargs = {
+        "metric_name": "dau",
+        "table_name": "active_user_aggregates",
+        "app_name": "Fenix",
+        "date_ranges": date_ranges,
+    }
+    results = metric_lookup.get_top_level_metrics_with_date_ranges(
+        excluded_dimensions=excluded_dimensions, **kwargs
+    )
+
+    # The single query returns the same values as a query for each.
+    expected = {
+        "all": metric_lookup.get_metric_with_date_ranges(**kwargs),
+        "dimension_values_excluded": metric_lookup.get_metric_with_date_ranges(
+            excluded_dimensions=excluded_dimensions, **kwargs
+        ),
+        "dimension_values_only": metric_lookup.get_metric_with_date_ranges(
+            included_dimensions_only=excluded_dimensions, **kwargs
+        ),
+    }
+    assert list(results.keys()) == list(expected.keys())
+    for variant, values in results.items():
+        assert (
+            values.set_index("timeframe")["metric_value"].to_dict()
+            == expected[variant].set_index("timeframe")["metric_value"].to_dict()
+        )
+    assert results["dimension_values_only"].set_index("timeframe")["metric_value"].to_dict() == {
+        "current": 19,
+        "baseline": 15,
+    }
+
+
+def test_duckdb_top_level_variant_without_last_day(local_data_dir):
+    # MX has rows on the first day of the current date range but not on its last day.
+    rows = [
+        [date(2022, 4, 2), "Fenix", "MX", "release", 15],
+        [date(2022, 4, 2), "Fenix", "CA", "release", 21],
+        [date(2022, 4, 8), "Fenix", "MX", "release", 19],
+        [date(2022, 4, 8), "Fenix", "CA", "release", 24],
+        [date(2022, 4, 9), "Fenix", "CA", "release", 25],
+    ]
+    cols = ["submission_date", "app_name", "country", "channel", "dau"]
+    DataFrame(rows, columns=cols).to_parquet(
+        local_data_dir / "moz-fx-data-shared-prod.telemetry.active_users_aggregates.parquet"
+    )
+    metric_lookup = MetricLookupManager(source=DuckDBSource(local_data_dir))
+    excluded_dimensions = [{"dimension": "country", "dim_values": ["MX"]}]
+    kwargs = {
+        "metric_name": "dau",
+        "table_name": "active_user_aggregates",
+        "app_name": "Fenix",
+        "date_ranges": {
+            "current": ProcessingDateRange(datetime(2022, 4, 8), datetime(2022, 4, 10)),
+            "baseline": ProcessingDateRange(datetime(2022, 4, 2), datetime(2022, 4, 3)),
+        },
+    }
+
+    # As when the variant is queried on its own.
+    with pytest.raises(NoDataFoundForDateRangeError):
+        metric_lookup.get_metric_with_date_ranges(
+            included_dimensions_only=excluded_dimensions, **kwargs
+        )
+    with pytest.raises(NoDataFoundForDateRangeError):
+        metric_lookup.get_top_level_metrics_with_date_ranges(
+            excluded_dimensions=excluded_dimensions, **kwargs
+        )
+
+
+@pytest.mark.parametrize(
+    "excluded_dimensions",
+    [
+        [],
+        [
+            {"dimension": "country", "dim_values": ["MX"]},
+            {"dimension": "channel", "dim_values": ["beta"]},
+        ],
+    ],
+)
+def test_duckdb_top_level_from_dimensions(local_data_dir, date_ranges, excluded_dimensions):
+    metric_lookup = MetricLookupManager(source=DuckDBSource(local_data_dir))
+    kwargs = {
+        "metric_name": "dau",
+        "table_name": "active_user_aggregates",
+        "app_name": "Fenix",
+        "date_ranges": date_ranges,
+        "excluded_dimensions": excluded_dimensions,
+    }
+    expected = metric_lookup.get_top_level_metrics_with_date_ranges(**kwargs)
+
+    cube = MetricCube(MetricLookupManager(source=DuckDBSource(local_data_dir)))
+    cube.load(
+        metric_name="dau",
+        table_name="active_user_aggregates",
+        app_name="Fenix",
+        date_ranges=date_ranges,
+        dimensions=["country", "channel"],
+    )
+    dimensions = [dim["dimension"] for dim in excluded_dimensions] or ["country"]
+    for lookup in [metric_lookup, cube]:
+        results = lookup.get_top_level_metrics_from_dimensions(dimensions=dimensions, **kwargs)
+
+        assert results.keys() == expected.keys()
+        for variant, values in results.items():
+            assert (
+                values.set_index("timeframe")["metric_value"].to_dict()
+                == expected[variant].set_index("timeframe")["metric_value"].to_dict()
+            )
+
+    # The cube applies the exclusions it was not loaded with, as the query does.
+    expected_values = {
+        ("current", "CA", "release"): 24,
+        ("baseline", "CA", "release"): 21,
+    }
+    if not excluded_dimensions:
+        expected_values |= {
+            ("current", "MX", "release"): 19,
+            ("current", "CA", "None"): 81,
+            ("baseline", "MX", "release"): 15,
+            ("baseline", "CA", "None"): 80,
+        }
+    kwargs["dimensions"] = ["country", "channel"]
+    for lookup in [metric_lookup, cube]:
+        values = lookup.get_metric_by_dimensions_with_date_ranges(**kwargs)
+        assert (
+            values.set_index(["timeframe", "dimension_value_0", "dimension_value_1"])[
+                "metric_value"
+            ].to_dict()
+            == expected_values
+        )
+
+
+@pytest.mark.parametrize(
+    "excluded_dimensions", [[], [{"dimension": "country", "dim_values": ["MX"]}]]
+)
+def test_duckdb_top_level_from_sparse_dimensions(local_data_dir, excluded_dimensions):
+    # MX only has values on some of the days, XX is not a known country code.
+    rows = [[date(2022, 4, day), "Fenix", "CA", "release", 10 * day] for day in range(1, 10)]
+    rows += [
+        [date(2022, 4, 2), "Fenix", "MX", "release", 7],
+        [date(2022, 4, 5), "Fenix", "MX", "release", 13],
+        [date(2022, 4, 9), "Fenix", "MX", "release", 17],
+        [date(2022, 4, 8), "Fenix", None, "release", 3],
+        [date(2022, 4, 9), "Fenix", "XX", "release", 5],
+    ]
+    cols = ["submission_date", "app_name", "country", "channel", "dau"]
+    DataFrame(rows, columns=cols).to_parquet(
+        local_data_dir / "moz-fx-data-shared-prod.telemetry.active_users_aggregates.parquet"
+    )
+    metric_lookup = MetricLookupManager(source=DuckDBSource(local_data_dir))
+    kwargs = {
+        "metric_name": "dau",
+        "table_name": "active_user_aggregates",
+        "app_name": "Fenix",
+        "date_ranges": {
+            "current": ProcessingDateRange(datetime(2022, 4, 3), datetime(2022, 4, 10)),
+            "baseline": ProcessingDateRange(datetime(2022, 4, 1), datetime(2022, 4, 3)),
+        },
+        "excluded_dimensions": excluded_dimensions,
+    }
+    expected = metric_lookup.get_top_level_metrics_with_date_ranges(**kwargs)
+
+    cube = MetricCube(MetricLookupManager(source=DuckDBSource(local_data_dir)))
+    cube.load(
+        metric_name="dau",
+        table_name="active_user_aggregates",
+        app_name="Fenix",
+        date_ranges=kwargs["date_ranges"],
+        dimensions=["country", "channel"],
+    )
+    for lookup in [metric_lookup, cube]:
+        results = lookup.get_top_level_metrics_from_dimensions(dimensions=["country"], **kwargs)
+
+        assert results.keys() == expected.keys()
+        for variant, values in results.items():
+            assert values.set_index("timeframe")["metric_value"].to_dict() == pytest.approx(
+                expected[variant].set_index("timeframe")["metric_value"].to_dict()
+            )
+
+
+def test_duckdb_shared_dimension_sets(local_data_dir, date_ranges):
+    metric_lookup = MetricLookupManager(source=DuckDBSource(local_data_dir))
+    dimension_sets = [("country",), ("channel",), ("channel", "country")]
+
+    shared = metric_lookup.get_metrics_by_dimension_sets_for_apps_with_date_ranges(
+        metric_names=["dau"],
+        table_name="active_user_aggregates",
+        app_names=["Fenix", "Focus"],
+        date_ranges=date_ranges,
+        dimension_sets=dimension_sets,
+    )
+    # Focus has no baseline data.
+    assert list(shared) == [("dau", "Fenix")]
+
+    single = metric_lookup.get_metric_by_dimension_sets_with_date_ranges(
+        metric_name="dau",
+        table_name="active_user_aggregates",
+        app_name="Fenix",
+        date_ranges=date_ranges,
+        dimension_sets=dimension_sets,
+    )
+    for dim_set in dimension_sets:
+        columns = [col for col in single[dim_set].columns if col != "metric_value"]
+        assert shared[("dau", "Fenix")][dim_set].set_index(columns)["metric_value"].to_dict() == (
+            single[dim_set].set_index(columns)["metric_value"].to_dict()
+        )
+
+
+def test_duckdb_folded_dimension_values(local_data_dir, date_ranges):
+    metric_lookup = MetricLookupManager(source=DuckDBSource(local_data_dir))
+    cube = MetricCube(metric_lookup)
+    kwargs = {
+        "metric_name": "dau",
+        "table_name": "active_user_aggregates",
+        "app_name": "Fenix",
+        "date_ranges": date_ranges,
+        "dimensions": ["channel", "country"],
+    }
+    cube.load(**kwargs)
+    # The NULL channel is kept, none of the countries are.
+    folded_dimension_values = [
+        {"dimension": "channel", "dim_values": ["None"]},
+        {"dimension": "country", "dim_values": ["US"]},
+    ]
+
+    for lookup in [metric_lookup, cube]:
+        values = lookup.get_metric_by_dimensions_with_date_ranges(
+            folded_dimension_values=folded_dimension_values, **kwargs
+        )
+        assert values.set_index(["timeframe", "dimension_value_0", "dimension_value_1"])[
+            "metric_value"
+        ].to_dict() == {
+            ("current", "None", "Other"): 81,
+            ("current", "Other", "Other"): 43,
+            ("baseline", "None", "Other"): 80,
+            ("baseline", "Other", "Other"): 36,
+        }
+
+
+def test_duckdb_cube_loaded_for_span(local_data_dir, date_ranges):
+    metric_lookup = MetricLookupManager(source=DuckDBSource(local_data_dir))
+    cube = MetricCube(metric_lookup)
+    cube.load(
+        metric_name="dau",
+        table_name="active_user_aggregates",
+        app_name="Fenix",
+        date_ranges={
+            "span": ProcessingDateRange(
+                start_date=date_ranges["baseline"].start_date,
+                end_date=date_ranges["current"].end_date,
+            )
+        },
+        dimensions=["country", "channel"],
+    )
+
+    for dimensions in [["country"], ["country", "channel"]]:
+        kwargs = {
+            "metric_name": "dau",
+            "table_name": "active_user_aggregates",
+            "app_name": "Fenix",
+            "date_ranges": date_ranges,
+            "dimensions": dimensions,
+            "excluded_dimensions": [{"dimension": "country", "dim_values": ["MX"]}],
+        }
+        columns = [f"dimension_value_{i}" for i in range(len(dimensions))] + ["timeframe"]
+        assert (
+            cube.get_metric_by_dimensions_with_date_ranges(**kwargs)
+            .set_index(columns)["metric_value"]
+            .to_dict()
+            == metric_lookup.get_metric_by_dimensions_with_date_ranges(**kwargs)
+            .set_index(columns)["metric_value"]
+            .to_dict()
+        )
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+from pandas import DataFrame
+
+from analysis.data.metric import MetricLookupManager
+from analysis.data.sources import MetricSource
+from analysis.logging import profile_context
+from analysis.logging.timings import Timings, timings
+
+
+def test_measure():
+    recorder = Timings()
+    with profile_context("fenix"):
+        with recorder.measure("query", metric="dau") as details:
+            details["rows"] = 2
+    with pytest.raises(ValueError):
+        with recorder.measure("report"):
+            raise ValueError("wkhtmltopdf crashed")
+
+    query, report = recorder.timings
+    assert query.name == "query"
+    assert query.profile == "fenix"
+    assert query.details == {"metric": "dau", "rows": 2}
+    assert query.wall_seconds >= 0 and query.cpu_seconds >= 0
+    assert report.profile is None
+    assert report.details == {"failed": True}
+
+
+def test_totals_and_summary(tmp_path):
+    recorder = Timings()
+    for rows in [2, 3]:
+        with recorder.measure("query") as details:
+            details["rows"] = rows
+            details["total_bytes_processed"] = None
+
+    (total,) = recorder.totals()
+    assert total["count"] == 2
+    assert total["rows"] == 5
+    assert total["total_bytes_processed"] == 0
+    assert "query" in recorder.table()
+
+    path = recorder.write_summary(str(tmp_path / "run" / "timings.json"), date="2022-06-01")
+    summary = json.loads(open(path).read())
+    assert summary["date"] == "2022-06-01"
+    assert [timing["rows"] for timing in summary["timings"]] == [2, 3]
+
+
+def test_run_query_timing(mock_current_period):
+    class MockSource(MetricSource):
+        name = "mock"
+
+        def run_query(self, query, metric):
+            df = DataFrame({"timeframe": ["current"], "metric_value": [1.0]})
+            df.attrs["total_bytes_processed"] = 1024
+            return df
+
+    timings.clear()
+    MetricLookupManager(source=MockSource()).run_query(
+        query="SELECT 1", metric="dau", date_range=mock_current_period
+    )
+
+    (timing,) = timings.timings
+    assert timing.name == "query"
+    assert timing.details["rows"] == 1
+    assert timing.details["bytes"] > 0
+    assert timing.details["total_bytes_processed"] == 1024
+    assert not timing.details["cached"]
@@ -1,7 +1,13 @@
 from datetime import datetime
 
+import pytest
+from pandas import DataFrame
+
+from analysis.data.metric import MetricLookupManager
+from analysis.detection.explorer.one_dimension import OneDimensionEvaluator
 from analysis.detection.explorer.top_level import TopLevelEvaluator
 from analysis.configuration.processing_dates import ProcessingDateRange
+from analysis.errors import TopLevelMismatchError
 
 
 def test_percent_change(mock_parent_df, mock_analysis_profile):
@@ -41,3 +47,73 @@ def test_diff(mock_parent_df, mock_analysis_profile):
     )._calculate_diff(df=mock_parent_df)
 
     assert diff == expected_diff
+
+
+def get_mock_metric_lookup(queries: list) -> MetricLookupManager:
+    # ca has no value on the day before the last day of the current date range.
+    daily = DataFrame(
+        [
+            [datetime(2022, 4, 7), "mx", "current", 11.0],
+            [datetime(2022, 4, 8), "mx", "current", 19.0],
+            [datetime(2022, 4, 8), "ca", "current", 105.0],
+            [datetime(2022, 4, 1), "mx", "baseline", 15.0],
+        ],
+        columns=["submission_date", "country", "timeframe", "metric_value"],
+    )
+    top_level = DataFrame(
+        [["current", 67.5], ["baseline", 16.0]], columns=["timeframe", "metric_value"]
+    )
+
+    def mock_run_query(query, metric, date_range):
+        queries.append(query)
+        return (top_level if "window_average" in query else daily).copy()
+
+    metric_lookup = MetricLookupManager()
+    metric_lookup.run_query = mock_run_query
+    return metric_lookup
+
+
+def test_top_level_from_dimensions(
+    mock_analysis_profile, mock_baseline_period, mock_current_period
+):
+    mock_analysis_profile.dataset.table_name = "active_user_aggregates"
+    mock_analysis_profile.dataset.top_level_mode = "dimensions"
+    # The check is enabled by default, it queries the top level values.
+    mock_analysis_profile.dataset.top_level_check_tolerance = None
+    mock_analysis_profile.percent_change.exclude_dimension_values = []
+    queries = []
+    metric_lookup = get_mock_metric_lookup(queries)
+
+    evaluation = TopLevelEvaluator(
+        profile=mock_analysis_profile,
+        baseline_period=mock_baseline_period,
+        current_period=mock_current_period,
+        metric_lookup=metric_lookup,
+    ).evaluate()
+    # The window average of the daily totals, not the sum of the window averages of the values.
+    assert evaluation["top_level_diff"] == (11 + 19 + 105) / 2 - 15
+
+    # The values of the first dimension are reused by its evaluation.
+    values = OneDimensionEvaluator(
+        profile=mock_analysis_profile,
+        baseline_period=mock_baseline_period,
+        current_period=mock_current_period,
+        parent_df=evaluation["top_level_values"],
+        metric_lookup=metric_lookup,
+    )._get_current_and_baseline_values(dimension=mock_analysis_profile.percent_change.dimensions[0])
+    assert len(queries) == 1
+    assert values.set_index(["timeframe", "dimension_value_0"])["metric_value"].to_dict() == {
+        ("current", "mx"): (11 + 19) / 2,
+        ("current", "ca"): 105,
+        ("baseline", "mx"): 15,
+    }
+
+    # The check queries the values, the baseline differs.
+    mock_analysis_profile.dataset.top_level_check_tolerance = 0.01
+    with pytest.raises(TopLevelMismatchError):
+        TopLevelEvaluator(
+            profile=mock_analysis_profile,
+            baseline_period=mock_baseline_period,
+            current_period=mock_current_period,
+            metric_lookup=metric_lookup,
+        ).evaluate()